@@ -1,11 +1,26 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db.models import Count, Max, OuterRef, Q, Subquery
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html, format_html_join
 
-from .models import City
+from .models import City, FeedCheck, RequestProfile
+
+
+def _kb(size):
+    return '' if size is None else f'{size / 1024:.0f} kB'
+
+
+def _ms(ms):
+    return '' if ms is None else f'{ms:.0f} ms'
 
 
 @admin.register(City)
 class CityAdmin(admin.ModelAdmin):
-    list_display = ['name', 'slug', 'calendar_id', 'is_default', 'is_active', 'created_at']
+    list_display = ['name', 'slug', 'calendar_id', 'is_default', 'is_active',
+                    'last_fetched', 'last_failure', 'feed_size', 'occurrence_count',
+                    'index_time', 'stale_serves', 'refresh_interval']
     list_filter = ['is_active', 'is_default', 'created_at']
     search_fields = ['name', 'slug', 'calendar_id']
     list_editable = ['is_active']
@@ -14,3 +29,146 @@ class CityAdmin(admin.ModelAdmin):
     # special handling. The field stays editable: once a city has been shared,
     # its subdomain must survive a rename of the city.
     prepopulated_fields = {'slug': ('name',)}
+    readonly_fields = ['feed_health']
+    actions = ['refresh_now']
+
+    def get_queryset(self, request):
+        # One query for the list, however many cities: the latest good
+        # check's figures as subqueries, the rest as aggregates.
+        latest_ok = FeedCheck.objects.filter(city=OuterRef('pk'), ok=True)
+        return super().get_queryset(request).annotate(
+            _last_fetched=Max('feed_checks__checked_at', filter=Q(feed_checks__ok=True)),
+            _last_failure=Max('feed_checks__checked_at', filter=Q(feed_checks__ok=False)),
+            _stale_serves=Count('feed_checks', filter=Q(feed_checks__stale=True)),
+            _feed_bytes=Subquery(latest_ok.values('feed_bytes')[:1]),
+            _occurrences=Subquery(latest_ok.values('occurrences')[:1]),
+            _index_ms=Subquery(latest_ok.values('index_ms')[:1]),
+        )
+
+    @admin.display(description='Last fetched', ordering='_last_fetched')
+    def last_fetched(self, city):
+        return city._last_fetched
+
+    @admin.display(description='Last failure', ordering='_last_failure')
+    def last_failure(self, city):
+        return city._last_failure
+
+    @admin.display(description='Feed', ordering='_feed_bytes')
+    def feed_size(self, city):
+        return _kb(city._feed_bytes)
+
+    @admin.display(description='Occurrences', ordering='_occurrences')
+    def occurrence_count(self, city):
+        return city._occurrences
+
+    @admin.display(description='Parse', ordering='_index_ms')
+    def index_time(self, city):
+        return _ms(city._index_ms)
+
+    @admin.display(description='Stale serves', ordering='_stale_serves')
+    def stale_serves(self, city):
+        return city._stale_serves
+
+    @admin.display(description='Refreshed every')
+    def refresh_interval(self, city):
+        from . import schedule
+
+        if not city.is_active:
+            return ''
+        seconds = schedule.plan().get(city.calendar_id, schedule.DEFAULT_SECONDS)
+        if seconds < 3600:
+            return f'{seconds // 60} min'
+        return f'{seconds // 3600} h {seconds % 3600 // 60} min'
+
+    @admin.display(description='Feed health')
+    def feed_health(self, city):
+        """The latest looks at the feed, newest first."""
+        checks = city.feed_checks.all()[:20] if city.pk else []
+        if not checks:
+            return 'Not fetched yet.'
+        rows = format_html_join('', (
+            '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td>'
+            '<td>{}</td><td>{}</td></tr>'
+        ), ((f'{c.checked_at:%Y-%m-%d %H:%M}',
+             'OK' if c.ok else f'{c.error or "Failed"}{" (stale copy served)" if c.stale else ""}',
+             _kb(c.feed_bytes), c.vevents or '', c.occurrences or '',
+             _ms(c.fetch_ms), _ms(c.index_ms)) for c in checks))
+        return format_html(
+            '<table><thead><tr><th>Checked</th><th>Result</th><th>Feed</th>'
+            '<th>VEVENTs</th><th>Occurrences</th><th>Fetch</th><th>Parse</th>'
+            '</tr></thead><tbody>{}</tbody></table>', rows)
+
+    @admin.action(description='Refresh the selected calendars now')
+    def refresh_now(self, request, queryset):
+        # An organiser who has just fixed an event should not have to wait
+        # out the fresh copy of the feed to see it.
+        from .services import FeedRefreshService
+
+        cities = list(queryset)
+        reports = FeedRefreshService().refresh([city.calendar_id for city in cities])
+        for city, report in zip(cities, reports):
+            if report.error:
+                self.message_user(request, f'{city.name}: {report.error} '
+                                           f'({report.fetch_ms:.0f} ms)', messages.ERROR)
+                continue
+            outcome = 'updated' if report.changed else 'unchanged'
+            self.message_user(request, (
+                f'{city.name}: {outcome}, {report.occurrences} occurrences - '
+                f'fetched in {report.fetch_ms:.0f} ms, indexed in {report.index_ms:.0f} ms'
+            ), messages.SUCCESS)
+
+
+@admin.register(FeedCheck)
+class FeedCheckAdmin(admin.ModelAdmin):
+    """The whole bounded history, for filtering; written by events/health.py only."""
+    list_display = ['city', 'checked_at', 'ok', 'error', 'stale', 'feed_bytes',
+                    'vevents', 'occurrences', 'fetch_ms', 'index_ms']
+    list_filter = ['city', 'ok', 'stale']
+    date_hierarchy = 'checked_at'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    """Profiled requests - see events/profiling.py. Read-only, and bounded."""
+    list_display = ['created_at', 'method', 'path', 'host', 'status', 'duration_ms', 'peak_kb']
+    list_filter = ['status', 'method']
+    search_fields = ['path', 'host']
+    fields = ['created_at', 'method', 'path', 'host', 'status', 'duration_ms', 'peak_kb',
+              'download', 'top_functions']
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='Top functions')
+    def top_functions(self, profile):
+        return format_html('<pre style="font-size: 11px">{}</pre>', profile.summary)
+
+    @admin.display(description='Raw stats')
+    def download(self, profile):
+        url = reverse('admin:events_requestprofile_download', args=[profile.pk])
+        return format_html('<a href="{}">profile-{}.prof</a> (python -m pstats, snakeviz)',
+                           url, profile.pk)
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/download/', self.admin_site.admin_view(self.download_view),
+                 name='events_requestprofile_download'),
+        ] + super().get_urls()
+
+    def download_view(self, request, pk):
+        if not self.has_view_permission(request):
+            return HttpResponse(status=403)
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        response = HttpResponse(bytes(profile.stats), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="profile-{profile.pk}.prof"'
+        return response
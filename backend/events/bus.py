@@ -0,0 +1,101 @@
+"""Telling every node what changed, when there is more than one.
+
+Most of what this app keeps lives in the shared cache, and with REDIS_URL
+set that cache is Redis, one for every backend on every host: the feeds,
+the stored-version and registry tokens. A change there is seen by everyone
+at once. (The published indexes are files on each host, and each node
+keeps its own index's name - events/indexfiles.py.) Two things are not in
+it, because they are files on each host, read by its nginx: the cached API
+answers (EDGE_CACHE_DIR) and the rendered pages (PAGES_DIR). A new feed
+stored on one host used to purge and re-render that host's copies only.
+
+So the code that changes something announces it, and announce() does two
+things: applies it here at once, as before, and - with REDIS_URL - publishes
+it on CHANNEL. Each other host runs ``manage.py listen_invalidations``,
+which applies what it hears. A message says which node sent it, and a node
+ignores its own; one applied twice does no harm anyway - purging a missing
+file and rendering an unchanged page both do nothing.
+
+Cloudflare is one cache for all of them and is purged once, by whoever made
+the change (events/edge.py), not here.
+
+Messages:
+    {"kind": "nginx", "keys": [...]}       purge these $host$request_uri keys
+    {"kind": "pages", "calendar_id": ...}  render this city's pages again;
+                                           null for every city's
+"""
+
+import json
+import logging
+import socket
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'westnfound:invalidate'
+
+NODE = socket.gethostname()
+
+
+def enabled() -> bool:
+    return bool(settings.REDIS_URL)
+
+
+def _client():
+    import redis
+    return redis.Redis.from_url(settings.REDIS_URL)
+
+
+def announce(kind: str, **payload) -> None:
+    """Apply a change here, and tell the other nodes about it."""
+    apply(kind, payload)
+    if not enabled():
+        return
+    try:
+        _client().publish(CHANNEL, json.dumps({'kind': kind, 'node': NODE, **payload}))
+    except Exception as e:
+        # This node is in order; the others catch up when their caches expire.
+        logger.error(f'Could not announce {kind} to the other nodes: {e}')
+
+
+def apply(kind: str, payload: dict) -> None:
+    from . import edge, prerender
+    from .models import City
+
+    if kind == 'nginx':
+        removed = edge.purge_local(payload['keys'])
+        if removed:
+            logger.info(f'Purged {removed} cached answers from nginx')
+    elif kind == 'pages':
+        city = None
+        if payload.get('calendar_id'):
+            city = City.objects.filter(calendar_id=payload['calendar_id']).first()
+            if city is None:
+                return
+        prerender.refresh(city)
+    else:
+        logger.warning(f'Unknown announcement: {kind}')
+
+
+def receive(raw) -> None:
+    """Apply one message heard on CHANNEL, unless this node sent it."""
+    try:
+        message = json.loads(raw)
+        kind = message.pop('kind')
+        if message.pop('node', None) == NODE:
+            return
+        apply(kind, message)
+    except Exception as e:
+        logger.error(f'Could not apply announcement {raw!r}: {e}', exc_info=True)
+
+
+def listen() -> None:
+    """Apply what the other nodes announce, for as long as the connection lasts."""
+    from django.db import close_old_connections
+
+    pubsub = _client().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(CHANNEL)
+    for message in pubsub.listen():
+        close_old_connections()
+        receive(message['data'])
@@ -17,6 +17,7 @@ import re
 from pathlib import Path
 
 from django.http import HttpResponse, HttpResponseRedirect
+from django.utils.html import json_script
 from django.views import View
 
 from django.conf import settings
@@ -58,6 +59,8 @@ DESCRIPTION_CALENDAR_CITY = (
 )
 
 TITLE_TAG = re.compile(r'<title>.*?</title>', re.S)
+# A stylesheet link or a script tag, and the address it loads.
+ASSET_TAG = re.compile(r'<(link|script)\b([^>]*)\b(?:href|src)="([^"]+)"([^>]*)>')
 DESCRIPTION_TAG = re.compile(r'<meta name="description" content="[^"]*">')
 HEAD_END = '</head>'
 
@@ -102,6 +105,13 @@ class DocumentView(View):
     # subdomain of the default city.
     canonical_path = '/'
 
+    # What the page's script asks the API for first, answered in the page.
+    initial_paths = ()
+
+    # What it asks the API for right after that, started early by a Link
+    # header (preload_header).
+    preload_fetches = ()
+
     def get(self, request):
         city = getattr(request, 'city', None)
 
@@ -118,6 +128,45 @@ class DocumentView(View):
         # reader a moment after the page appears.
         city_count = City.objects.filter(is_active=True).count()
 
+        page = self.render(request.get_host(), city, city_count,
+                           getattr(request, 'city_is_unknown', False))
+        response = HttpResponse(page, content_type='text/html; charset=utf-8')
+        response['Link'] = self.preload_header()
+        return response
+
+    def preload_header(self):
+        """A Link header announcing what the page will load, as it loads it.
+
+        Read off the page itself, so the addresses carry the same ?v= stamps
+        as the tags and can never ask for a version the page will not use -
+        relative, like the tags, so they resolve to the same URLs. The
+        browser starts on them as soon as the headers arrive, before the
+        body; Cloudflare, with Early Hints on, sends them ahead as a 103
+        from the headers it saw last time. Pages nginx serves from disk send
+        the same value, written out by render_pages (events/prerender.py).
+        """
+        links = []
+        for tag, before, url, after in ASSET_TAG.findall(_read(self.filename)):
+            if url.startswith(('https://', 'http://', '//')):
+                # Alpine, from a CDN: connect early, the version is theirs.
+                origin = '/'.join(url.split('/')[:3])
+                links.append(f'<{origin}>; rel=preconnect')
+            elif '?v=' in url and tag == 'script':
+                links.append(f'<{url}>; rel=preload; as=script')
+            elif '?v=' in url and 'stylesheet' in before + after:
+                links.append(f'<{url}>; rel=preload; as=style')
+        # crossorigin, because fetch() is a CORS request even to its own
+        # origin; without it the preloaded answer would not be reused.
+        links += [f'<{path}>; rel=preload; as=fetch; crossorigin'
+                  for path in self.preload_fetches]
+        return ', '.join(dict.fromkeys(links))
+
+    def render(self, host, city, city_count, city_is_unknown=False):
+        """The page as ``host`` serves it to ``city``.
+
+        Also what render_pages writes to disk for nginx (events/prerender.py),
+        so a page Django answers and a page nginx answers are one page.
+        """
         page = _read(self.filename)
         title = _escape(self.title_for(city, city_count))
         description = _escape(self.description_for(city, city_count))
@@ -140,16 +189,58 @@ class DocumentView(View):
         if city is None:
             tag = '<meta name="robots" content="noindex">'
         else:
-            host = request.get_host()
             tag = (f'<link rel="canonical" href="{scheme_for(host)}://'
                    f'{host}{self.canonical_path}">')
-        page = page.replace(HEAD_END, f'    {tag}\n{HEAD_END}', 1)
+        data = json_script(initial_data(self.initial_paths, host, city, city_is_unknown),
+                           'initial-data')
+        return page.replace(HEAD_END, f'    {tag}\n    {data}\n{HEAD_END}', 1)
+
+
+def initial_data(paths, host, city, city_is_unknown):
+    """What the API would answer for each of ``paths`` on ``host``, as {status, body}.
+
+    The first thing either page does is ask the API for its city, the list
+    of cities and the next events - round trips made one after another on
+    a phone before anything useful is on screen. The answers are known here
+    already, so they come with the page; the script takes each one instead
+    of asking, once, and asks the API as usual after that.
+
+    From what is stored, never from Google: a page is not held up by a feed
+    fetch, and a page rendered ahead for nginx (events/prerender.py) calls
+    this with no request at all. The events may therefore be older than the
+    API's; app.js drops any that have ended and refreshes behind them.
+    """
+    from . import views
+
+    data = {}
+    for path in paths:
+        if path == '/api/cities/':
+            data[path] = {'status': 200, 'body': views.cities_body(host, city)}
+        elif city is None:
+            data[path] = {'status': 404, 'body': views.no_city_body(host, city_is_unknown)}
+        elif path == '/api/calendar/':
+            data[path] = {'status': 200, 'body': views.calendar_body(host, city)}
+        elif path.startswith('/api/next-events/'):
+            data[path] = _next_events(city, int(path.rpartition('=')[2]))
+    return data
+
+
+def _next_events(city, limit):
+    from .services import OccurrenceStore
+    from .views import NO_UPCOMING_EVENTS
 
-        return HttpResponse(page, content_type='text/html; charset=utf-8')
+    events = [row.as_event(city.calendar_id)
+              for row in OccurrenceStore().upcoming(city.calendar_id, limit)]
+    if not events:
+        return {'status': 404, 'body': NO_UPCOMING_EVENTS}
+    return {'status': 200, 'body': {'success': True, 'events': events, 'count': len(events)}}
 
 
 class HomeView(DocumentView):
     filename = 'index.html'
+    initial_paths = ('/api/cities/', '/api/next-events/?limit=3')
+    # app.js refreshes the events in the page at once; see loadEvent().
+    preload_fetches = ('/api/next-events/?limit=3',)
 
     def title_for(self, city, city_count):
         if city is None or city_count < 2:
@@ -165,6 +256,7 @@ class HomeView(DocumentView):
 class CalendarPageView(DocumentView):
     filename = 'calendar.html'
     canonical_path = '/kalendarz'
+    initial_paths = ('/api/calendar/', '/api/cities/')
 
     def title_for(self, city, city_count):
         base = f'{SITE_TITLE} - {CALENDAR_TITLE}'
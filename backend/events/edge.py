@@ -0,0 +1,132 @@
+"""Letting nginx and Cloudflare answer the polls, and telling them when to stop.
+
+Every open page asks /api/next-events/ again every few minutes, and the
+answer is the same for everyone on one host until one of two things
+happens: the first event in it ends, or the city's feed changes. So the
+answers say how long they hold (cache_control), and the two caches in front
+of Django keep them that long - and are told to drop them (purge) the moment
+a refresh stores a new feed or a city is edited.
+
+nginx: the prod config caches these endpoints under the key
+``$host$request_uri``. Open-source nginx has no purge command, but its cache
+is files named after the MD5 of the key, and the directory is shared with
+this container (EDGE_CACHE_DIR). Deleting the file is a purge: nginx treats
+the missing file as a miss and asks Django again.
+
+Cloudflare: purged by URL through its API, if CLOUDFLARE_ZONE_ID and
+CLOUDFLARE_API_TOKEN are set - in a background thread, so that the request
+which happened to trigger a refresh does not wait on Cloudflare.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from typing import Iterable, List
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+logger = logging.getLogger(__name__)
+
+# How long a browser may keep an answer without asking. Short: unlike the
+# caches in front, a browser cannot be purged.
+BROWSER_SECONDS = 60
+
+# Answers that only a city edit changes, and every edit purges.
+CITY_SECONDS = 24 * 60 * 60
+
+# The event endpoints as the pages ask for them: the limit is part of the
+# cache key, so each spelling is its own entry to purge.
+EVENT_PATHS = ['/api/next-event/', '/api/next-events/'] + [
+    f'/api/next-events/?limit={n}' for n in range(1, 11)
+]
+CITY_PATHS = ['/api/cities/', '/api/calendar/']
+
+_CLOUDFLARE_BATCH = 30
+
+
+def cache_control(response, seconds: int, stale_seconds: int = BROWSER_SECONDS):
+    """Let caches keep ``response`` for ``seconds``, per Host."""
+    if seconds <= 0:
+        response['Cache-Control'] = 'no-cache'
+    else:
+        response['Cache-Control'] = (
+            f'public, max-age={min(seconds, BROWSER_SECONDS)}, s-maxage={seconds}, '
+            f'stale-while-revalidate={stale_seconds}'
+        )
+    # The city is named by the Host header, and nothing else in the URL.
+    patch_vary_headers(response, ['Host'])
+    return response
+
+
+def hosts_for(city) -> List[str]:
+    """Every host name ``city`` answers at."""
+    hosts = []
+    for base in settings.CITY_BASE_DOMAINS:
+        hosts.append(f'{city.slug}.{base}')
+        if city.is_default:
+            hosts += [base, f'www.{base}']
+    return hosts
+
+
+def purge_city_events(city) -> None:
+    """A city's feed changed: drop its cached event answers."""
+    purge(hosts_for(city), EVENT_PATHS)
+
+
+def purge_cities(cities, extra_hosts: Iterable[str] = ()) -> None:
+    """Cities changed: every answer that names one may be out of date."""
+    hosts = [host for city in cities for host in hosts_for(city)]
+    purge(hosts + list(extra_hosts), EVENT_PATHS + CITY_PATHS)
+
+
+def purge(hosts: Iterable[str], paths: Iterable[str]) -> None:
+    keys = [f'{host}{path}' for host in set(hosts) for path in paths]
+    if not keys:
+        return
+    # Every host's nginx, this one's first (events/bus.py); Cloudflare once.
+    from . import bus
+    bus.announce('nginx', keys=keys)
+    if settings.CLOUDFLARE_ZONE_ID and settings.CLOUDFLARE_API_TOKEN:
+        threading.Thread(target=_purge_cloudflare, args=(keys,), daemon=True).start()
+
+
+def nginx_cache_file(key: str) -> str:
+    """Where nginx keeps the answer for ``key``, with ``levels=1:2``."""
+    digest = hashlib.md5(key.encode()).hexdigest()
+    return os.path.join(settings.EDGE_CACHE_DIR, digest[-1], digest[-3:-1], digest)
+
+
+def purge_local(keys) -> int:
+    """Delete this host's nginx cache files for ``keys``. How many there were."""
+    if not settings.EDGE_CACHE_DIR:
+        return 0
+    removed = 0
+    for key in keys:
+        try:
+            os.unlink(nginx_cache_file(key))
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f'Could not purge {key} from nginx: {e}')
+    return removed
+
+
+def _purge_cloudflare(keys) -> None:
+    import requests
+
+    url = (f'https://api.cloudflare.com/client/v4/zones/'
+           f'{settings.CLOUDFLARE_ZONE_ID}/purge_cache')
+    headers = {'Authorization': f'Bearer {settings.CLOUDFLARE_API_TOKEN}'}
+    # Cloudflare terminates TLS, and plain http only redirects there.
+    urls = [f'https://{key}' for key in keys]
+    for i in range(0, len(urls), _CLOUDFLARE_BATCH):
+        try:
+            response = requests.post(url, headers=headers, timeout=10,
+                                     json={'files': urls[i:i + _CLOUDFLARE_BATCH]})
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning(f'Cloudflare purge failed: {e}')
+            return
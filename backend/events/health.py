@@ -0,0 +1,67 @@
+"""What each look at a feed found, kept for the admin panel's health view.
+
+A calendar that has grown to thousands of events slows every worker that
+parses it, and one Google has stopped publishing is served from the last
+good copy for a week - both quietly, until someone notices an event missing.
+So every fetch leaves a FeedCheck row: whether Google answered and why not,
+how big the feed was, how many VEVENTs and occurrences it made, how long
+fetching and expanding took, and whether a stale copy was served instead.
+
+The measurements are taken where the work happens, and that is sometimes a
+worker thread (EverywhereService and FeedRefreshService fetch side by side),
+where writing to the database would mean a connection per thread and, under
+SQLite, a locked table. So note() only files them in memory; the rows are
+written by flush(), which the code that started the work calls on its own
+thread when it is done. A note without a fetch - the same feed expanded
+again for a new day - goes onto the city's latest row.
+"""
+
+import logging
+import threading
+from typing import Dict
+
+from django.utils import timezone as django_timezone
+
+logger = logging.getLogger(__name__)
+
+_pending: Dict[str, dict] = {}
+_lock = threading.Lock()
+
+
+def note(calendar_id: str, **fields) -> None:
+    """File measurements of ``calendar_id``'s feed, for the next flush()."""
+    with _lock:
+        _pending.setdefault(calendar_id, {}).update(fields)
+
+
+def flush() -> None:
+    """Write what was noted since the last flush. Never fails the caller."""
+    global _pending
+    if not _pending:
+        return
+    with _lock:
+        pending, _pending = _pending, {}
+    for calendar_id, fields in pending.items():
+        try:
+            _write(calendar_id, fields)
+        except Exception as e:
+            logger.error(f'Could not record the health of {calendar_id}: {e}', exc_info=True)
+
+
+def _write(calendar_id: str, fields: dict) -> None:
+    from .models import City, FeedCheck
+
+    city = City.objects.filter(calendar_id=calendar_id).first()
+    if city is None:
+        return
+    if 'ok' not in fields:
+        latest = FeedCheck.objects.filter(city=city).first()
+        if latest is not None:
+            FeedCheck.objects.filter(pk=latest.pk).update(**fields)
+        return
+
+    FeedCheck.objects.create(city=city, checked_at=django_timezone.now(), **fields)
+    expired = list(FeedCheck.objects.filter(city=city)
+                   .values_list('pk', flat=True)[FeedCheck.HISTORY:])
+    if expired:
+        FeedCheck.objects.filter(pk__in=expired).delete()
@@ -0,0 +1,101 @@
+"""Packed indexes as files, mapped by every worker instead of copied into each.
+
+gunicorn runs four workers. An index kept in the cache as bytes is read
+back by each of them - four copies of every city's year of occurrences in
+memory, unpickled four times - and built by whichever of them first finds
+the feed changed, which is fine, but then held by all four.
+
+So the worker that builds an index publishes it as a file in INDEX_DIR,
+named after the calendar, the feed version and the window it covers, and
+puts only the file's name in the cache. Every worker then maps that file
+read-only (PackedIndex.open): the operating system keeps one copy in its
+page cache and every worker reads from it, so memory grows with the number
+of cities, not cities times workers. A mapping is opened once per worker
+and per file and then reused; a new name in the cache is a new index.
+
+A file is never changed once written. A new version or a new window is a
+new file, written beside the old one and renamed into place, so no reader
+ever sees half of one; the calendar's older files are then unlinked, which
+leaves any worker still mapping one with its copy until it moves on.
+
+With INDEX_DIR empty the index is kept in the cache as bytes, as before.
+
+The files are on this host's disk, and with REDIS_URL the cache is every
+host's: a name another host published would name a file that is not here,
+and each host would rebuild the index and put its own name over the other's.
+So there each node keeps its name under a key of its own (cache_key).
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+
+from . import bus
+from .packing import PackedIndex
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = '.wnfi'
+
+# calendar_id -> (file name, its mapping), in this process.
+_attached: Dict[str, Tuple[str, PackedIndex]] = {}
+_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return bool(settings.INDEX_DIR)
+
+
+def cache_key(calendar_id: str) -> str:
+    """Where the cache keeps this calendar's index, or its file's name."""
+    if enabled() and bus.enabled():
+        return f'ics:index:{calendar_id}:{bus.NODE}'
+    return f'ics:index:{calendar_id}'
+
+
+def _prefix(calendar_id: str) -> str:
+    return hashlib.sha256(calendar_id.encode()).hexdigest()[:16]
+
+
+def publish(calendar_id: str, packed: bytes, index: PackedIndex) -> str:
+    """Write ``packed`` where every worker can map it. The file's name."""
+    directory = Path(settings.INDEX_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    prefix = _prefix(calendar_id)
+    name = f'{prefix}-{index.version}-{index.window[0].date().isoformat()}{SUFFIX}'
+    path = directory / name
+    if not path.exists():
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(packed)
+        os.replace(temporary, path)
+    for old in directory.glob(f'{prefix}-*{SUFFIX}'):
+        if old.name != name:
+            try:
+                old.unlink()
+            except FileNotFoundError:
+                pass  # Another worker got there first.
+    return name
+
+
+def attach(calendar_id: str, name: str) -> Optional[PackedIndex]:
+    """The index in file ``name``, mapped once in this process; None if gone."""
+    attached = _attached.get(calendar_id)
+    if attached is not None and attached[0] == name:
+        return attached[1]
+    with _lock:
+        try:
+            index = PackedIndex.open(Path(settings.INDEX_DIR) / name)
+        except (OSError, ValueError) as e:
+            # Unlinked by a newer build, or written by another version of
+            # this code: the caller builds it again.
+            logger.info(f'Could not map index {name}: {e}')
+            return None
+        _attached[calendar_id] = (name, index)
+    return index
@@ -0,0 +1,471 @@
+"""A calendar's occurrences, expanded once per feed version and then patched.
+
+Every API request used to parse the whole feed and expand every recurring
+series in it, for a year ahead, to answer "what is next". Most of that work
+repeats itself: when one organiser moves one social, every other series in
+the calendar expands to exactly what it expanded to a quarter of an hour ago.
+
+So the expansion is kept, series by series, and a new copy of the feed is
+compared with the one the kept expansion came from. A series is everything
+sharing a UID: the master event and each occurrence overridden through
+RECURRENCE-ID. Only the series whose fingerprint moved are expanded again;
+the rest are carried over as they are.
+
+The fingerprint is what Google bumps when someone edits an event - SEQUENCE
+and LAST-MODIFIED of every component in the series. DTSTAMP is not part of
+it: Google stamps it with the time of the export, so it changes on every
+fetch and would make every series look edited.
+
+The feed is read with events/parsing.py, which leaves icalendar out of it
+unless something needs expanding: fingerprints come from the raw lines, and
+a changed one-off event - most of any calendar - becomes its occurrence
+directly, and a plain weekly or daily series is expanded by
+events/recurrence.py. Only series with overrides or unusual rules, and events
+the reader does not vouch for, are parsed by icalendar, and only those. A
+feed the reader cannot read at all, or whose X-WR-TIMEZONE it does not know
+(a Windows name), is indexed entirely by icalendar, as before.
+"""
+
+import bisect
+import hashlib
+import heapq
+import logging
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+from operator import attrgetter
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from django.utils import timezone as django_timezone
+
+logger = logging.getLogger(__name__)
+
+# How far ahead the endpoints look, as they always have.
+HORIZON = timedelta(days=365)
+
+# Anything longer is a festival or a holiday block somebody put in the
+# calendar, not an event anyone wants a countdown to.
+MAX_DURATION = timedelta(hours=12)
+
+# The synthetic key given to a VEVENT that arrived without a UID, which the
+# RFC forbids and Google never sends - but a hand-edited feed might.
+_NO_UID = 'no-uid:'
+
+
+class Occurrence(NamedTuple):
+    """One occurrence of an event, ordered by when it starts."""
+    start: datetime
+    end: datetime
+    title: str
+    description: str
+    location: str
+
+    def as_event(self, calendar_id: str) -> Dict[str, str]:
+        """The shape the API has always answered with."""
+        return {
+            'title': self.title,
+            'description': self.description,
+            'location': self.location,
+            'start': self.start.isoformat(),
+            'end': self.end.isoformat(),
+            'calendar_id': calendar_id,
+        }
+
+
+@dataclass
+class Series:
+    """The occurrences of one UID, and the fingerprint they were expanded from."""
+    fingerprint: str
+    occurrences: List[Occurrence]
+
+
+@dataclass
+class FeedIndex:
+    """Every occurrence of one feed version, sorted by start."""
+    calendar_id: str
+    version: str
+    window: Tuple[datetime, datetime]
+    # Everything outside the events that changes what they expand to: the
+    # VTIMEZONEs and calendar-wide properties such as X-WR-TIMEZONE.
+    context: str
+    series: Dict[str, Series]
+    occurrences: List[Occurrence]
+
+    def covers(self, now: datetime) -> bool:
+        """Whether this index was expanded over the window ``now`` falls in."""
+        return self.window == window_for(now)
+
+    def upcoming(self, now: datetime) -> Iterator[Occurrence]:
+        """Occurrences that have not ended yet and start within the horizon."""
+        horizon = now + HORIZON
+        # Nothing that started more than MAX_DURATION ago can still be on,
+        # so the search can start there rather than at the year's beginning.
+        first = bisect.bisect_left(self.occurrences, now - MAX_DURATION,
+                                   key=attrgetter('start'))
+        for occurrence in self.occurrences[first:]:
+            if occurrence.start >= horizon:
+                break
+            if occurrence.end > now:
+                yield occurrence
+
+
+def feed_version(feed: bytes) -> str:
+    """A short name for one exact copy of a feed."""
+    return hashlib.sha256(feed).hexdigest()[:16]
+
+
+def window_for(now: datetime) -> Tuple[datetime, datetime]:
+    """The span an index expands over: a year and a day from local midnight.
+
+    Fixed for a whole day rather than sliding with ``now``, so that kept
+    expansions stay valid between fetches. The day it moves, everything is
+    expanded again - once a day instead of once a request.
+    """
+    start = django_timezone.localtime(now).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    return start, start + HORIZON + timedelta(days=1)
+
+
+def build_index(calendar_id: str, feed: bytes, version: str, now: datetime,
+                previous: Optional[FeedIndex] = None) -> FeedIndex:
+    """Index ``feed``, reusing whatever of ``previous`` still holds."""
+    from .parsing import Unsupported, parse_feed, text
+    from .parsing import zone as olson
+
+    try:
+        parsed = parse_feed(feed)
+        # The zone of every floating time in the feed: one the reader does
+        # not know (a Windows name, say) is no better than an unreadable feed.
+        wr_timezone = parsed.property('X-WR-TIMEZONE')
+        zone = olson(text(wr_timezone)) if wr_timezone is not None else None
+    except Unsupported as e:
+        logger.info(f'Indexing {calendar_id} with icalendar: {e}')
+        return _build_from_calendar(calendar_id, feed, version, now, previous)
+    return _build_from_records(calendar_id, parsed, zone, version, now, previous)
+
+
+def _build_from_records(calendar_id, parsed, zone, version, now, previous) -> FeedIndex:
+    from .parsing import Property, Unsupported, text
+
+    window = window_for(now)
+    context = _records_context(parsed)
+
+    groups: Dict[str, list] = {}
+    for record in parsed.events:
+        uid = text(record.uid)
+        if not uid:
+            uid = _NO_UID + hashlib.sha256(record.raw.encode()).hexdigest()[:16]
+            uid_line = f'UID:{uid}'
+            record = record._replace(
+                uid=Property('UID', uid, {}, uid_line),
+                lines=(record.lines[0], uid_line) + tuple(
+                    line for line in record.lines[1:]
+                    if record.uid is None or line != record.uid.line),
+            )
+        groups.setdefault(uid, []).append(record)
+
+    reusable = _reusable(previous, window, context)
+    series: Dict[str, Series] = {}
+    changed: Dict[str, str] = {}
+    for uid, records in groups.items():
+        fingerprint = _fingerprint(_record_fingerprint(r) for r in records)
+        kept = reusable.get(uid)
+        if kept is not None and kept.fingerprint == fingerprint:
+            series[uid] = kept
+        else:
+            changed[uid] = fingerprint
+
+    to_expand = []
+    for uid, fingerprint in changed.items():
+        records = groups[uid]
+        try:
+            if len(records) != 1:
+                raise Unsupported('A series with overrides')
+            record = records[0]
+            if record.rrule is None:
+                occurrences = _direct(record, window, zone)
+            else:
+                occurrences = _recurring(record, window, zone)
+        except Unsupported:
+            to_expand.extend(records)
+        else:
+            series[uid] = Series(fingerprint, occurrences)
+
+    if to_expand:
+        from icalendar import Calendar
+
+        expanded = _expanded(Calendar.from_ical(parsed.calendar(to_expand)), window)
+        for record in to_expand:
+            uid = text(record.uid)
+            series[uid] = Series(changed[uid], expanded.get(uid, []))
+
+    expanded_uids = {text(r.uid) for r in to_expand}
+    logger.info(
+        f'Indexed {calendar_id} at {version}: {len(changed)} of {len(groups)} '
+        f'series changed, {len(expanded_uids)} of them expanded, the rest reused'
+    )
+    return _index(calendar_id, version, window, context, series)
+
+
+def _build_from_calendar(calendar_id, feed, version, now, previous) -> FeedIndex:
+    """The same index, from a feed parsed whole by icalendar."""
+    # Imported here, not at the top: this is the only code path that parses,
+    # and everything else that imports this module - down to robots.txt -
+    # should not pay for the calendar stack. See events/startup.py.
+    from icalendar import Calendar
+
+    calendar = Calendar.from_ical(feed)
+    window = window_for(now)
+
+    timezones = [c for c in calendar.subcomponents if c.name == 'VTIMEZONE']
+    context = _context_fingerprint(calendar, timezones)
+
+    groups: Dict[str, list] = {}
+    for component in calendar.subcomponents:
+        if component.name != 'VEVENT':
+            continue
+        uid = str(component.get('UID', ''))
+        if not uid:
+            uid = _NO_UID + hashlib.sha256(component.to_ical()).hexdigest()[:16]
+            component['UID'] = uid
+        groups.setdefault(uid, []).append(component)
+
+    reusable = _reusable(previous, window, context)
+    series: Dict[str, Series] = {}
+    changed: Dict[str, str] = {}
+    for uid, components in groups.items():
+        fingerprint = _series_fingerprint(components)
+        kept = reusable.get(uid)
+        if kept is not None and kept.fingerprint == fingerprint:
+            series[uid] = kept
+        else:
+            changed[uid] = fingerprint
+
+    if changed:
+        expanded = _expand(
+            calendar, timezones,
+            [c for uid in changed for c in groups[uid]],
+            window,
+        )
+        for uid, fingerprint in changed.items():
+            series[uid] = Series(fingerprint, expanded.get(uid, []))
+
+    logger.info(
+        f'Indexed {calendar_id} at {version}: {len(changed)} of '
+        f'{len(groups)} series expanded, the rest reused'
+    )
+    return _index(calendar_id, version, window, context, series)
+
+
+def _reusable(previous, window, context) -> Dict[str, Series]:
+    if (previous is not None and previous.window == window
+            and previous.context == context):
+        return previous.series
+    return {}
+
+
+def _index(calendar_id, version, window, context, series) -> FeedIndex:
+    return FeedIndex(
+        calendar_id=calendar_id,
+        version=version,
+        window=window,
+        context=context,
+        series=series,
+        occurrences=list(heapq.merge(*(s.occurrences for s in series.values()))),
+    )
+
+
+def _records_context(parsed) -> str:
+    # Marked apart from _context_fingerprint's, so that an index built by
+    # one path is never patched by the other.
+    digest = hashlib.sha256(b'records\n')
+    for prop in sorted(parsed.properties, key=lambda p: p.name):
+        digest.update(prop.line.encode() + b'\n')
+    for timezone_block in parsed.timezones:
+        digest.update(timezone_block.encode())
+    return digest.hexdigest()[:16]
+
+
+def _record_fingerprint(record) -> str:
+    digest = hashlib.sha256()
+    if record.last_modified is not None:
+        for prop in (record.recurrence_id, record.sequence, record.last_modified):
+            if prop is not None:
+                digest.update(prop.line.encode())
+            digest.update(b'\n')
+    else:
+        for line in record.lines:
+            if not line.upper().startswith('DTSTAMP'):
+                digest.update(line.encode() + b'\n')
+    return digest.hexdigest()
+
+
+def _direct(record, window, zone) -> List[Occurrence]:
+    """A one-off event's occurrence, read off the record - or Unsupported.
+
+    What recurring_ical_events would have made of it, step for step: floating
+    and UTC times moved to X-WR-TIMEZONE, the same overlap test against the
+    window, the same filter on length.
+    """
+    from .parsing import Unsupported, date_time, text
+
+    if (record.rrule or record.rdate or record.exdate or record.recurrence_id
+            or record.dtstart is None or 'DURATION' in record.others):
+        raise Unsupported('Needs expanding')
+    start = _aware(_standard(date_time(record.dtstart), zone))
+    end = _aware(_standard(date_time(record.dtend), zone)) if record.dtend else start
+    if end < start:
+        raise Unsupported('Ends before it starts')
+
+    window_start, window_end = window
+    if start == end:
+        inside = window_start <= start < window_end
+    else:
+        inside = start < window_end and window_start < end
+    if not inside or end - start > MAX_DURATION:
+        return []
+    return [Occurrence(
+        start=start,
+        end=end,
+        title=text(record.summary, 'Untitled'),
+        description=text(record.description),
+        location=text(record.location),
+    )]
+
+
+def _recurring(record, window, zone) -> List[Occurrence]:
+    """A plain weekly or daily series, expanded by events/recurrence.py."""
+    from .parsing import Unsupported, date_time, date_times, text
+    from .recurrence import expand
+
+    if (record.rdate or record.recurrence_id or record.dtstart is None
+            or 'DURATION' in record.others):
+        raise Unsupported('Needs expanding')
+    start = _standard(date_time(record.dtstart), zone)
+    end = _standard(date_time(record.dtend), zone) if record.dtend else start
+    exdates = [_standard(value, zone) for prop in record.exdate for value in date_times(prop)]
+
+    title = text(record.summary, 'Untitled')
+    description = text(record.description)
+    location = text(record.location)
+    return [
+        Occurrence(start=_aware(first), end=_aware(last), title=title,
+                   description=description, location=location)
+        for first, last in expand(record.rrule.value, start, end, exdates, window)
+        if last - first <= MAX_DURATION
+    ]
+
+
+def _standard(value: datetime, zone) -> datetime:
+    # What x_wr_timezone does to a calendar with X-WR-TIMEZONE.
+    if zone is None:
+        return value
+    if value.tzinfo is None:
+        return value.replace(tzinfo=zone)
+    if (value.tzname() or '').upper() == 'UTC':
+        return value.astimezone(zone)
+    return value
+
+
+def _context_fingerprint(calendar, timezones) -> str:
+    digest = hashlib.sha256()
+    for key, value in sorted(calendar.items(), key=lambda item: item[0]):
+        digest.update(key.encode() + b':' + _ical(value) + b'\n')
+    for timezone_component in timezones:
+        digest.update(timezone_component.to_ical())
+    return digest.hexdigest()[:16]
+
+
+def _series_fingerprint(components) -> str:
+    return _fingerprint(_component_fingerprint(c) for c in components)
+
+
+def _fingerprint(parts) -> str:
+    # Order-independent: Google does not promise to list the overrides of a
+    # series the same way twice, and reordering them changes nothing.
+    return hashlib.sha256('\n'.join(sorted(parts)).encode()).hexdigest()[:16]
+
+
+def _component_fingerprint(component) -> str:
+    digest = hashlib.sha256()
+    if 'LAST-MODIFIED' in component:
+        for name in ('RECURRENCE-ID', 'SEQUENCE', 'LAST-MODIFIED'):
+            value = component.get(name)
+            if value is not None:
+                digest.update(name.encode() + b':' + _ical(value))
+            digest.update(b'\n')
+    else:
+        # Without LAST-MODIFIED nothing promises to move on an edit, so the
+        # content itself is compared - all of it but DTSTAMP.
+        for line in component.to_ical().splitlines():
+            if not line.startswith(b'DTSTAMP'):
+                digest.update(line + b'\n')
+    return digest.hexdigest()
+
+
+def _ical(value) -> bytes:
+    return value.to_ical() if hasattr(value, 'to_ical') else str(value).encode()
+
+
+def _expand(calendar, timezones, components, window) -> Dict[str, List[Occurrence]]:
+    """Expand ``components`` over ``window``, grouped by UID and sorted.
+
+    One call for every changed series together rather than one per series:
+    most of the cost of recurring_ical_events is per calendar, not per event.
+    """
+    from icalendar import Calendar
+
+    partial = Calendar()
+    for key, value in calendar.items():
+        partial[key] = value
+    for timezone_component in timezones:
+        partial.add_component(timezone_component)
+    for component in components:
+        partial.add_component(component)
+    return _expanded(partial, window)
+
+
+def _expanded(calendar, window) -> Dict[str, List[Occurrence]]:
+    import recurring_ical_events
+    from icalendar.windows_to_olson import WINDOWS_TO_OLSON
+
+    # recurring_ical_events reads X-WR-TIMEZONE as an Olson name; a calendar
+    # exported from Outlook names its zone the Windows way.
+    wr_timezone = str(calendar.get('X-WR-TIMEZONE', ''))
+    if wr_timezone in WINDOWS_TO_OLSON:
+        calendar['X-WR-TIMEZONE'] = WINDOWS_TO_OLSON[wr_timezone]
+
+    expanded: Dict[str, List[Occurrence]] = {}
+    for component in recurring_ical_events.of(calendar).between(*window):
+        occurrence = _occurrence(component)
+        if occurrence is not None:
+            expanded.setdefault(str(component.get('UID', '')), []).append(occurrence)
+    for occurrences in expanded.values():
+        occurrences.sort()
+    return expanded
+
+
+def _aware(value) -> datetime:
+    if isinstance(value, datetime):
+        return value if value.tzinfo is not None else django_timezone.make_aware(value)
+    # A date: the event is taken to start at local midnight.
+    return django_timezone.make_aware(datetime.combine(value, time.min))
+
+
+def _occurrence(component) -> Optional[Occurrence]:
+    dtstart = component.get('dtstart')
+    if not dtstart:
+        return None
+    start = _aware(dtstart.dt)
+
+    dtend = component.get('dtend')
+    end = _aware(dtend.dt) if dtend else None
+    if end is not None and end - start > MAX_DURATION:
+        return None
+
+    return Occurrence(
+        start=start,
+        end=end if end is not None else start,
+        title=str(component.get('summary', 'Untitled')),
+        description=str(component.get('description', '')),
+        location=str(component.get('location', '')),
+    )
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from events import bus
+
+
+class Command(BaseCommand):
+    help = "Apply what the other hosts announce they changed (see events/bus.py)."
+
+    def handle(self, *args, **options):
+        if not bus.enabled():
+            raise CommandError('REDIS_URL is not set: there is nothing to listen to.')
+        self.stdout.write(f'Listening on {bus.CHANNEL} as {bus.NODE}')
+        bus.listen()
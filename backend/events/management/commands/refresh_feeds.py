@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from events.models import City
+from events.services import FeedRefreshService
+
+
+class Command(BaseCommand):
+    help = "Fetch cities' feeds from Google now, rather than when they are due."
+
+    def add_arguments(self, parser):
+        parser.add_argument('slugs', nargs='*',
+                            help='Cities to refresh, by slug. Every active city if none.')
+
+    def handle(self, *args, slugs, **options):
+        cities = City.objects.filter(is_active=True)
+        if slugs:
+            cities = City.objects.filter(slug__in=slugs)
+            missing = set(slugs) - {city.slug for city in cities}
+            if missing:
+                raise CommandError(f'No such city: {", ".join(sorted(missing))}')
+        cities = list(cities.order_by('slug'))
+
+        failed = 0
+        for city, report in zip(cities, FeedRefreshService().refresh(
+                [city.calendar_id for city in cities])):
+            timing = f'fetch {report.fetch_ms:6.0f} ms, index {report.index_ms:6.0f} ms'
+            if report.error:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f'{city.slug:20} {timing}  {report.error}'))
+            else:
+                outcome = 'updated' if report.changed else 'unchanged'
+                self.stdout.write(f'{city.slug:20} {timing}  {outcome}, '
+                                  f'{report.occurrences} occurrences')
+        if failed:
+            raise CommandError(f'{failed} of {len(cities)} calendars could not be refreshed.')
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from events.prerender import render_pages
+
+
+class Command(BaseCommand):
+    help = "Write each city's pages to PAGES_DIR, for nginx to serve without Django."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None,
+                            help='Where to write them, instead of PAGES_DIR.')
+
+    def handle(self, *args, dir, **options):
+        if not (dir or settings.PAGES_DIR):
+            raise CommandError('PAGES_DIR is not set; pass --dir to write somewhere anyway.')
+        counts = render_pages(dir)
+        self.stdout.write(
+            f'{counts["written"]} written, {counts["unchanged"]} unchanged, '
+            f'{counts["removed"]} hosts removed')
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from events.startup import HEAVY, WSGI_BUDGET_MS, heavy_imported, import_times
+
+STAGES = (
+    ('westnfound.wsgi', 'import westnfound.wsgi'),
+    # The URLconf is imported by the first request, whatever it asks for.
+    ('first request', 'import westnfound.wsgi, westnfound.urls'),
+    ('fetch and parse', 'import westnfound.wsgi, westnfound.urls, '
+                        'icalendar, recurring_ical_events, requests'),
+)
+
+
+class Command(BaseCommand):
+    help = "What starting the application costs, from python -X importtime."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=15,
+                            help='How many of the slowest imports to list.')
+
+    def handle(self, *args, top, **options):
+        for name, statement in STAGES:
+            times = import_times(statement)
+            total = sum(t.self_us for t in times.values()) / 1000
+            heavy = sorted({m.split('.')[0] for m in heavy_imported(times)})
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{name}: {total:.0f} ms, {len(times)} modules'))
+            self.stdout.write(
+                f'  calendar stack: {", ".join(heavy) if heavy else "not imported"}')
+
+            slowest = sorted(times.items(), key=lambda item: -item[1].cumulative_us)
+            for module, t in slowest[:top]:
+                self.stdout.write(f'  {t.cumulative_us / 1000:8.1f} ms  {module}')
+
+        self.stdout.write(
+            f'\nBudget for westnfound.wsgi: {WSGI_BUDGET_MS} ms, '
+            f'without {", ".join(HEAVY)}.')
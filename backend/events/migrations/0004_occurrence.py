@@ -0,0 +1,32 @@
+# Generated by Django 5.1.2 on 2026-10-19 17:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0003_calendar_to_city'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Occurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uid', models.CharField(max_length=255)),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('title', models.TextField()),
+                ('location', models.TextField(blank=True)),
+                ('description', models.TextField(blank=True)),
+                ('feed_version', models.CharField(help_text='Which copy of the feed this came from - see events/indexing.py', max_length=16)),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occurrences', to='events.city')),
+            ],
+            options={
+                'ordering': ['start'],
+                'indexes': [models.Index(fields=['city', 'end'], name='occurrence_city_end'), models.Index(fields=['city', 'start'], name='occurrence_city_start')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-19 17:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0004_occurrence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='occurrence',
+            name='encoded',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
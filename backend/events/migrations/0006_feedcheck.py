@@ -0,0 +1,34 @@
+# Generated by Django 5.1.2 on 2026-10-19 18:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0005_occurrence_encoded'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedCheck',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checked_at', models.DateTimeField()),
+                ('ok', models.BooleanField(help_text='Google answered with a calendar')),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('stale', models.BooleanField(default=False, help_text='The last good copy was served instead')),
+                ('feed_bytes', models.PositiveIntegerField(blank=True, null=True)),
+                ('vevents', models.PositiveIntegerField(blank=True, null=True)),
+                ('occurrences', models.PositiveIntegerField(blank=True, null=True)),
+                ('fetch_ms', models.FloatField(blank=True, null=True)),
+                ('index_ms', models.FloatField(blank=True, help_text='Parsing the feed and expanding its recurrences', null=True)),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_checks', to='events.city')),
+            ],
+            options={
+                'ordering': ['-checked_at'],
+                'indexes': [models.Index(fields=['city', '-checked_at'], name='feedcheck_city_checked')],
+            },
+        ),
+    ]
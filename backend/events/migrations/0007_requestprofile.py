@@ -0,0 +1,31 @@
+# Generated by Django 5.1.2 on 2026-10-19 18:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0006_feedcheck'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=255)),
+                ('host', models.CharField(blank=True, max_length=255)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('duration_ms', models.FloatField()),
+                ('peak_kb', models.PositiveIntegerField(help_text='Peak memory allocated while answering')),
+                ('summary', models.TextField(help_text='Top functions by cumulative time')),
+                ('stats', models.BinaryField()),
+            ],
+            options={
+                'ordering': ['-created_at', '-pk'],
+            },
+        ),
+    ]
@@ -64,3 +64,140 @@ class City(models.Model):
     def default(cls):
         """The city served on the apex domain, or None if the table is empty."""
         return cls.objects.filter(is_active=True, is_default=True).first()
+
+
+class Occurrence(models.Model):
+    """One occurrence of one event, as the last refresh of its city's feed left it.
+
+    Rows are written by the refresher and only by it, all of a city's at
+    once, so a reader never sees half of one feed and half of another. What
+    they buy is that answering "what is next" is a range query on an index:
+    no feed to parse, nothing lost when a worker restarts or the cache is
+    cleared.
+    """
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='occurrences')
+    uid = models.CharField(max_length=255)
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    title = models.TextField()
+    location = models.TextField(blank=True)
+    description = models.TextField(blank=True)
+    feed_version = models.CharField(
+        max_length=16,
+        help_text="Which copy of the feed this came from - see events/indexing.py"
+    )
+    # The event as the API answers it, JSON-encoded once when the row is
+    # written - less the calendar_id, which as_json() adds, and the closing
+    # brace. Empty on rows written before there was such a column.
+    encoded = models.TextField(blank=True, default='', editable=False)
+
+    class Meta:
+        ordering = ['start']
+        indexes = [
+            # "Not over yet" and "in date order", the two questions the
+            # endpoints ask, always of one city.
+            models.Index(fields=['city', 'end'], name='occurrence_city_end'),
+            models.Index(fields=['city', 'start'], name='occurrence_city_start'),
+        ]
+
+    def __str__(self):
+        return f'{self.title} ({self.start:%Y-%m-%d %H:%M})'
+
+    def as_event(self, calendar_id):
+        """The shape the API has always answered with, in the site's timezone."""
+        from django.utils import timezone
+
+        return {
+            'title': self.title,
+            'description': self.description,
+            'location': self.location,
+            'start': timezone.localtime(self.start).isoformat(),
+            'end': timezone.localtime(self.end).isoformat(),
+            'calendar_id': calendar_id,
+        }
+
+    @staticmethod
+    def encode(event):
+        """``event``, an as_event() dict, as the column keeps it."""
+        import json
+
+        from django.core.serializers.json import DjangoJSONEncoder
+
+        fields = {k: v for k, v in event.items() if k != 'calendar_id'}
+        return json.dumps(fields, cls=DjangoJSONEncoder)[:-1]
+
+    def as_json(self, calendar_id):
+        """as_event() as JsonResponse would encode it, mostly already encoded.
+
+        The calendar_id is spliced in rather than stored: a city pointed at
+        another calendar keeps its rows until the next refresh, and they
+        should not answer with the old calendar's address meanwhile.
+        """
+        import json
+
+        encoded = self.encoded or self.encode(self.as_event(calendar_id))
+        return f'{encoded}, "calendar_id": {json.dumps(calendar_id)}}}'
+
+
+class FeedCheck(models.Model):
+    """One look at a city's feed in Google, for the health view in the admin panel.
+
+    Written by the fetch path (events/health.py), a row per fetch, and only
+    the last HISTORY rows of a city are kept - enough to see a calendar
+    growing, or Google failing since the small hours, and small enough that
+    nobody has to clean it up.
+    """
+    HISTORY = 96
+
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='feed_checks')
+    checked_at = models.DateTimeField()
+    ok = models.BooleanField(help_text="Google answered with a calendar")
+    error = models.CharField(max_length=255, blank=True)
+    stale = models.BooleanField(
+        default=False,
+        help_text="The last good copy was served instead"
+    )
+    feed_bytes = models.PositiveIntegerField(null=True, blank=True)
+    vevents = models.PositiveIntegerField(null=True, blank=True)
+    occurrences = models.PositiveIntegerField(null=True, blank=True)
+    fetch_ms = models.FloatField(null=True, blank=True)
+    index_ms = models.FloatField(
+        null=True, blank=True,
+        help_text="Parsing the feed and expanding its recurrences"
+    )
+
+    class Meta:
+        ordering = ['-checked_at']
+        indexes = [
+            models.Index(fields=['city', '-checked_at'], name='feedcheck_city_checked'),
+        ]
+
+    def __str__(self):
+        return f'{self.city} at {self.checked_at:%Y-%m-%d %H:%M}'
+
+
+class RequestProfile(models.Model):
+    """One request as cProfile and tracemalloc saw it - see events/profiling.py.
+
+    Only the last HISTORY are kept: profiles are for looking at now, and
+    the raw stats of a request that reached the icalendar stack run to a
+    few hundred kilobytes.
+    """
+    HISTORY = 50
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    host = models.CharField(max_length=255, blank=True)
+    status = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    peak_kb = models.PositiveIntegerField(help_text="Peak memory allocated while answering")
+    summary = models.TextField(help_text="Top functions by cumulative time")
+    # marshal of the pstats dict: what cProfile's dump_stats() writes.
+    stats = models.BinaryField()
+
+    class Meta:
+        ordering = ['-created_at', '-pk']
+
+    def __str__(self):
+        return f'{self.method} {self.path} at {self.created_at:%Y-%m-%d %H:%M:%S}'
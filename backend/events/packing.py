@@ -0,0 +1,243 @@
+"""The occurrence index as one flat, versioned buffer.
+
+Pickling a FeedIndex means pickling every datetime with its tzinfo, every
+title once per occurrence of a weekly series, and a tuple per occurrence
+- and then rebuilding all of it, object by object, each time a worker reads
+it back from the cache. Most readers want the next three events.
+
+So the index is packed into a layout a reader can use in place:
+
+    header      magic, format, byte order, window, counts, section offsets
+    strings     u32 offset per string, then each string as u32 length and
+                UTF-8 bytes. Interned: a weekly title is stored once.
+    series      per series: uid, fingerprint (string numbers), first member
+                and member count
+    members     occurrence numbers, grouped by series
+    occurrences one column per field, in start order: start and end as
+                epoch seconds (i64), their UTC offsets in seconds (i32), and
+                title, description and location as string numbers (u32)
+
+Every section starts on an 8-byte boundary and the columns are native
+arrays, so memoryview.cast() reads them where they lie - from a bytes object
+out of the cache, or from a file mapped with mmap. Finding the next event is
+a bisect over the start column; only the occurrences returned are decoded.
+
+A buffer that is not this format - an older one, another byte order, a
+truncated file - is refused with ValueError, and the caller builds the index
+again rather than guess.
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Tuple
+
+from .indexing import HORIZON, MAX_DURATION, Occurrence, Series, window_for
+
+MAGIC = b'WNFI'
+FORMAT = 1
+_LITTLE = sys.byteorder == 'little'
+
+# magic, format, little-endian, window start and end (epoch, offset),
+# calendar_id/version/context string numbers, counts, section offsets.
+_HEADER = struct.Struct('<4sBB2xqiqiIIIIII' + 'I' * 7)
+
+_SERIES_FIELDS = 4
+
+
+def _pad(n: int) -> int:
+    return (n + 7) & ~7
+
+
+class _Strings:
+    def __init__(self):
+        self.numbers: Dict[str, int] = {}
+        self.items: List[str] = []
+
+    def __call__(self, value: str) -> int:
+        number = self.numbers.get(value)
+        if number is None:
+            number = self.numbers[value] = len(self.items)
+            self.items.append(value)
+        return number
+
+
+def _epoch(value: datetime) -> Tuple[int, int]:
+    return int(value.timestamp()), int(value.utcoffset().total_seconds())
+
+
+def pack_index(index) -> bytes:
+    """``index`` (a FeedIndex or a PackedIndex) as one buffer."""
+    strings = _Strings()
+    header_strings = (strings(index.calendar_id), strings(index.version),
+                      strings(index.context))
+
+    occurrences = index.occurrences
+    number_of = {}
+    columns = {name: array(code) for name, code in (
+        ('start', 'q'), ('end', 'q'), ('start_offset', 'i'), ('end_offset', 'i'),
+        ('title', 'I'), ('description', 'I'), ('location', 'I'))}
+    for number, occurrence in enumerate(occurrences):
+        number_of[id(occurrence)] = number
+        start, start_offset = _epoch(occurrence.start)
+        end, end_offset = _epoch(occurrence.end)
+        columns['start'].append(start)
+        columns['end'].append(end)
+        columns['start_offset'].append(start_offset)
+        columns['end_offset'].append(end_offset)
+        columns['title'].append(strings(occurrence.title))
+        columns['description'].append(strings(occurrence.description))
+        columns['location'].append(strings(occurrence.location))
+
+    series_table = array('I')
+    members = array('I')
+    for uid, series in index.series.items():
+        series_table.extend((strings(uid), strings(series.fingerprint),
+                             len(members), len(series.occurrences)))
+        members.extend(number_of[id(o)] for o in series.occurrences)
+
+    encoded = [s.encode('utf-8') for s in strings.items]
+    string_offsets = array('I')
+    blob = bytearray()
+    for value in encoded:
+        string_offsets.append(len(blob))
+        blob += struct.pack('<I', len(value)) + value
+
+    sections = [string_offsets.tobytes(), bytes(blob), series_table.tobytes(),
+                members.tobytes()] + [columns[name].tobytes() for name in (
+                    'start', 'end', 'start_offset', 'end_offset',
+                    'title', 'description', 'location')]
+    offsets = []
+    position = _pad(_HEADER.size)
+    for section in sections:
+        offsets.append(position)
+        position = _pad(position + len(section))
+
+    window_start, window_start_offset = _epoch(index.window[0])
+    window_end, window_end_offset = _epoch(index.window[1])
+    header = _HEADER.pack(
+        MAGIC, FORMAT, _LITTLE,
+        window_start, window_start_offset, window_end, window_end_offset,
+        *header_strings, len(encoded), len(index.series), len(occurrences),
+        # strings blob, series, members, and the first four columns; the
+        # three string-number columns follow the offset columns at fixed
+        # sizes, so they need no entry of their own.
+        *offsets[1:8],
+    )
+
+    out = bytearray(position)
+    out[:len(header)] = header
+    for offset, section in zip(offsets, sections):
+        out[offset:offset + len(section)] = section
+    return bytes(out)
+
+
+class PackedIndex:
+    """A packed index, read in place. Answers what a FeedIndex answers."""
+
+    def __init__(self, buffer):
+        view = memoryview(buffer)
+        if len(view) < _HEADER.size:
+            raise ValueError('Not a packed index: too short')
+        (magic, fmt, little,
+         window_start, window_start_offset, window_end, window_end_offset,
+         calendar_id, version, context, n_strings, n_series, n_occurrences,
+         blob_at, series_at, members_at, start_at, end_at, start_offset_at,
+         end_offset_at) = _HEADER.unpack_from(view)
+        if magic != MAGIC or fmt != FORMAT:
+            raise ValueError(f'Not a packed index of format {FORMAT}')
+        if bool(little) != _LITTLE:
+            raise ValueError('Packed index has the other byte order')
+
+        self._buffer = buffer
+        self._view = view
+        self._blob_at = blob_at
+        self._string_offsets = view[_pad(_HEADER.size):][:4 * n_strings].cast('I')
+        self._series = view[series_at:][:4 * _SERIES_FIELDS * n_series].cast('I')
+        self._members = view[members_at:][:4 * n_occurrences].cast('I')
+        n = n_occurrences
+        self._start = view[start_at:][:8 * n].cast('q')
+        self._end = view[end_at:][:8 * n].cast('q')
+        self._start_offset = view[start_offset_at:][:4 * n].cast('i')
+        self._end_offset = view[end_offset_at:][:4 * n].cast('i')
+        title_at = _pad(end_offset_at + 4 * n)
+        description_at = _pad(title_at + 4 * n)
+        location_at = _pad(description_at + 4 * n)
+        self._title = view[title_at:][:4 * n].cast('I')
+        self._description = view[description_at:][:4 * n].cast('I')
+        self._location = view[location_at:][:4 * n].cast('I')
+        if len(self._location) != n or len(self._string_offsets) != n_strings:
+            raise ValueError('Packed index is truncated')
+
+        self._strings: Dict[int, str] = {}
+        self._zones: Dict[int, timezone] = {}
+        self.calendar_id = self._string(calendar_id)
+        self.version = self._string(version)
+        self.context = self._string(context)
+        self.window = (self._datetime(window_start, window_start_offset),
+                       self._datetime(window_end, window_end_offset))
+
+    @classmethod
+    def open(cls, path) -> 'PackedIndex':
+        """Map a packed index file read-only, without reading it into memory."""
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self):
+        return len(self._start)
+
+    def _string(self, number: int) -> str:
+        value = self._strings.get(number)
+        if value is None:
+            at = self._blob_at + self._string_offsets[number]
+            (length,) = struct.unpack_from('<I', self._view, at)
+            value = self._strings[number] = str(self._view[at + 4:at + 4 + length], 'utf-8')
+        return value
+
+    def _datetime(self, epoch: int, offset: int) -> datetime:
+        zone = self._zones.get(offset)
+        if zone is None:
+            zone = self._zones[offset] = timezone(timedelta(seconds=offset))
+        return datetime.fromtimestamp(epoch, zone)
+
+    def _occurrence(self, i: int) -> Occurrence:
+        return Occurrence(
+            start=self._datetime(self._start[i], self._start_offset[i]),
+            end=self._datetime(self._end[i], self._end_offset[i]),
+            title=self._string(self._title[i]),
+            description=self._string(self._description[i]),
+            location=self._string(self._location[i]),
+        )
+
+    @property
+    def occurrences(self) -> List[Occurrence]:
+        return [self._occurrence(i) for i in range(len(self))]
+
+    @property
+    def series(self) -> Dict[str, Series]:
+        """Every series, decoded - what the indexer needs to patch this index."""
+        table = self._series
+        result = {}
+        for row in range(0, len(table), _SERIES_FIELDS):
+            uid, fingerprint, first, count = table[row:row + _SERIES_FIELDS]
+            result[self._string(uid)] = Series(
+                self._string(fingerprint),
+                [self._occurrence(self._members[first + k]) for k in range(count)],
+            )
+        return result
+
+    def covers(self, now: datetime) -> bool:
+        return self.window == window_for(now)
+
+    def upcoming(self, now: datetime) -> Iterator[Occurrence]:
+        horizon = int((now + HORIZON).timestamp())
+        current = now.timestamp()
+        i = bisect_left(self._start, int((now - MAX_DURATION).timestamp()))
+        for i in range(i, len(self)):
+            if self._start[i] >= horizon:
+                break
+            if self._end[i] > current:
+                yield self._occurrence(i)
@@ -0,0 +1,291 @@
+"""Google's basic.ics, read straight from the bytes into what we use of it.
+
+``Calendar.from_ical`` builds a full component tree: a typed property object
+for every line of every event, a pytz-localised datetime for every DTSTAMP,
+CREATED and LAST-MODIFIED nobody reads. For a busy city that is most of the
+time an index rebuild takes, and most rebuilds change a handful of series.
+
+This reader makes one pass over the unfolded feed and keeps, per VEVENT, the
+handful of properties the indexer looks at - as strings, decoded only when
+asked - plus the block's own lines, so that whatever needs the full
+treatment can still be handed to icalendar, one block at a time.
+
+It is specialised, not general. Anything it does not understand - bytes
+that are not UTF-8, a line that is not a content line, a property an event
+has twice that it may have once, components that do not nest - raises
+Unsupported, and the caller parses the feed with icalendar as it always did.
+Where it does understand a value, it decodes it the way icalendar 5 does,
+quirks included, so that both paths answer the same; the differential tests
+in events/tests.py hold them to that.
+"""
+
+import re
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+# A fold is a line break followed by a space or a tab - and, as icalendar
+# reads it, any run of line breaks before that.
+_FOLD = re.compile(r'(\r?\n)+[ \t]')
+_NEWLINE = re.compile(r'\r?\n')
+_NAME = re.compile(r'[A-Za-z0-9-]+\Z')
+
+# Properties an event may have at most once, and that we keep. A second
+# copy would turn into a list on icalendar's side; not worth matching.
+_SINGLE = {
+    'UID': 'uid', 'DTSTART': 'dtstart', 'DTEND': 'dtend', 'SUMMARY': 'summary',
+    'DESCRIPTION': 'description', 'LOCATION': 'location', 'RRULE': 'rrule',
+    'RECURRENCE-ID': 'recurrence_id', 'STATUS': 'status', 'SEQUENCE': 'sequence',
+    'LAST-MODIFIED': 'last_modified',
+}
+_MULTIPLE = {'EXDATE': 'exdate', 'RDATE': 'rdate'}
+
+
+class Unsupported(ValueError):
+    """The feed holds something this reader leaves to icalendar."""
+
+
+class Property(NamedTuple):
+    """One content line: its parts, undecoded, and the line itself."""
+    name: str
+    value: str
+    params: Dict[str, str]
+    line: str
+
+
+class EventRecord(NamedTuple):
+    """The parts of one VEVENT the indexer uses, and the block it came from."""
+    uid: Optional[Property]
+    dtstart: Optional[Property]
+    dtend: Optional[Property]
+    summary: Optional[Property]
+    description: Optional[Property]
+    location: Optional[Property]
+    rrule: Optional[Property]
+    recurrence_id: Optional[Property]
+    status: Optional[Property]
+    sequence: Optional[Property]
+    last_modified: Optional[Property]
+    exdate: Tuple[Property, ...]
+    rdate: Tuple[Property, ...]
+    # Every other property name on the event itself - DURATION, say, which
+    # changes what the event expands to and is not handled here.
+    others: frozenset
+    lines: Tuple[str, ...]
+
+    @property
+    def raw(self) -> str:
+        """The block as unfolded content lines, ready for icalendar."""
+        return '\r\n'.join(self.lines) + '\r\n'
+
+
+class ParsedFeed(NamedTuple):
+    # Calendar-wide properties (X-WR-TIMEZONE and the like), as content lines.
+    properties: Tuple[Property, ...]
+    # Each VTIMEZONE block, unfolded.
+    timezones: Tuple[str, ...]
+    events: List[EventRecord]
+
+    def property(self, name: str) -> Optional[Property]:
+        for prop in self.properties:
+            if prop.name == name:
+                return prop
+        return None
+
+    def calendar(self, records) -> bytes:
+        """A feed of this calendar's properties and zones and ``records`` only."""
+        lines = ['BEGIN:VCALENDAR']
+        lines.extend(p.line for p in self.properties)
+        lines.extend(self.timezones)
+        lines.extend(r.raw.rstrip('\r\n') for r in records)
+        lines.append('END:VCALENDAR')
+        return ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+
+
+def parse_feed(feed: bytes) -> ParsedFeed:
+    """Read ``feed``, or raise Unsupported."""
+    try:
+        text = feed.decode('utf-8')
+    except UnicodeDecodeError:
+        raise Unsupported('Feed is not UTF-8')
+
+    properties: List[Property] = []
+    timezones: List[str] = []
+    events: List[EventRecord] = []
+
+    stack: List[str] = []
+    block: List[str] = []
+    fields: Dict[str, object] = {}
+    for line in _NEWLINE.split(_FOLD.sub('', text)):
+        if not line:
+            continue
+        name, params, value = _parts(line)
+
+        if name == 'BEGIN':
+            component = value.upper()
+            if stack[:1] == [None]:
+                # Google sends one calendar per feed; a second one would
+                # come back from icalendar as a list.
+                raise Unsupported('More than one VCALENDAR')
+            if (component == 'VCALENDAR') == bool(stack):
+                raise Unsupported(f'BEGIN:{component} where it cannot be')
+            stack.append(component)
+            if len(stack) == 2:
+                block = [line]
+                fields = {'exdate': [], 'rdate': [], 'others': set()}
+            elif len(stack) > 2:
+                block.append(line)
+            continue
+
+        if name == 'END':
+            if not stack or stack[-1] != value.upper():
+                raise Unsupported(f'END:{value} closes nothing open')
+            component = stack.pop()
+            if len(stack) >= 1:
+                block.append(line)
+            if len(stack) == 1:
+                if component == 'VEVENT':
+                    events.append(_record(fields, block))
+                elif component == 'VTIMEZONE':
+                    timezones.append('\r\n'.join(block))
+            elif not stack:
+                stack.append(None)
+            continue
+
+        if not stack or stack[-1] is None:
+            raise Unsupported(f'{name} outside VCALENDAR')
+        prop = Property(name, value, params, line)
+        if len(stack) == 1:
+            properties.append(prop)
+        else:
+            block.append(line)
+            if len(stack) == 2 and stack[1] == 'VEVENT':
+                _keep(fields, prop)
+
+    if stack != [None]:
+        raise Unsupported('Feed does not end with END:VCALENDAR')
+    return ParsedFeed(tuple(properties), tuple(timezones), events)
+
+
+def _parts(line: str) -> Tuple[str, Dict[str, str], str]:
+    """(name, parameters, value) of a content line, as icalendar splits it."""
+    name_split = value_split = None
+    in_quotes = False
+    for i, ch in enumerate(line):
+        if not in_quotes:
+            if ch in ':;' and name_split is None:
+                name_split = i
+            if ch == ':':
+                value_split = i
+                break
+        if ch == '"':
+            in_quotes = not in_quotes
+    if not name_split or value_split is None or name_split + 1 == value_split:
+        raise Unsupported(f'Not a content line: {line[:40]!r}')
+    name = line[:name_split]
+    if not _NAME.match(name) or '\\' in line[:value_split]:
+        raise Unsupported(f'Not a property name: {name!r}')
+
+    params = {}
+    if name_split != value_split:
+        for param in line[name_split + 1:value_split].split(';'):
+            key, eq, val = param.partition('=')
+            if not eq or not _NAME.match(key) or ',' in val:
+                raise Unsupported(f'Parameter not understood: {param!r}')
+            if val.startswith('"') and val.endswith('"'):
+                val = val.strip('"')
+            elif '"' in val:
+                raise Unsupported(f'Parameter not understood: {param!r}')
+            params[key.upper()] = val
+    return name.upper(), params, line[value_split + 1:]
+
+
+def _keep(fields, prop):
+    name = prop.name
+    if name in _SINGLE:
+        key = _SINGLE[name]
+        if key in fields:
+            raise Unsupported(f'{name} twice in one event')
+        fields[key] = prop
+    elif name in _MULTIPLE:
+        fields[_MULTIPLE[name]].append(prop)
+    else:
+        fields['others'].add(name)
+
+
+def _record(fields, block) -> EventRecord:
+    return EventRecord(
+        **{key: fields.get(key) for key in _SINGLE.values()},
+        exdate=tuple(fields['exdate']),
+        rdate=tuple(fields['rdate']),
+        others=frozenset(fields['others']),
+        lines=tuple(block),
+    )
+
+
+def text(prop: Optional[Property], default: str = '') -> str:
+    """A TEXT value decoded as icalendar decodes it.
+
+    icalendar first swaps escaped punctuation for %-codes and back - which
+    also turns a literal ``%2C`` in the text into a comma - and then
+    unescapes what is left. Matched step for step, odd corners included.
+    """
+    if prop is None:
+        return default
+    value = (prop.value.replace(r'\,', '%2C').replace(r'\:', '%3A')
+             .replace(r'\;', '%3B').replace('\\\\', '%5C'))
+    value = (value.replace('%2C', ',').replace('%3A', ':')
+             .replace('%3B', ';').replace('%5C', '\\'))
+    return (value.replace('\\N', '\\n').replace('\r\n', '\n').replace('\\n', '\n')
+            .replace('\\,', ',').replace('\\;', ';').replace('\\\\', '\\'))
+
+
+_ZONES: Dict[str, ZoneInfo] = {}
+
+
+def zone(name: str) -> ZoneInfo:
+    """The Olson zone ``name``, or Unsupported."""
+    found = _ZONES.get(name)
+    if found is None:
+        try:
+            found = _ZONES[name] = ZoneInfo(name)
+        except (ValueError, KeyError, OSError):
+            # Windows names, custom VTIMEZONEs: icalendar knows those.
+            raise Unsupported(f'Time zone not understood: {name!r}')
+    return found
+
+
+def date_times(prop: Property) -> List[datetime]:
+    """Each DATE-TIME of a list such as EXDATE, as date_time() reads one."""
+    return [date_time(prop._replace(value=value)) for value in prop.value.split(',')]
+
+
+def date_time(prop: Property) -> datetime:
+    """A DATE-TIME value: aware if it names a zone or is UTC, else floating.
+
+    Dates, periods and lists are Unsupported, and so is a local time that a
+    DST change makes ambiguous or skips: icalendar resolves those through
+    pytz's is_dst=False, which zoneinfo does not imitate.
+    """
+    value = prop.value
+    if prop.params.get('VALUE', 'DATE-TIME').upper() != 'DATE-TIME' or len(value) not in (15, 16) \
+            or value[8] != 'T' or (len(value) == 16 and value[15] != 'Z'):
+        raise Unsupported(f'Not a single DATE-TIME: {value!r}')
+    try:
+        naive = datetime(int(value[:4]), int(value[4:6]), int(value[6:8]),
+                         int(value[9:11]), int(value[11:13]), int(value[13:15]))
+    except ValueError:
+        raise Unsupported(f'Not a DATE-TIME: {value!r}')
+
+    tzid = prop.params.get('TZID')
+    if tzid is not None:
+        if tzid.startswith('/') or tzid.endswith('/'):
+            raise Unsupported(f'Time zone not understood: {tzid!r}')
+        local = zone(tzid)
+        earlier = naive.replace(tzinfo=local)
+        if earlier.utcoffset() != naive.replace(tzinfo=local, fold=1).utcoffset():
+            raise Unsupported(f'{value} is ambiguous in {tzid}')
+        return earlier
+    if len(value) == 16:
+        return naive.replace(tzinfo=timezone.utc)
+    return naive
@@ -0,0 +1,144 @@
+"""The two pages, written to disk per city so that nginx serves them itself.
+
+DocumentView rewrites two tags and a link in a static file; what it writes
+depends on the host, the cities, the file and the stored events. Those
+change on a deploy, an edit in the admin panel or a feed update, and the
+pages are read on every visit - each one a Python worker busy for a page
+nginx could have sent from disk.
+
+So the pages are rendered ahead, one directory per host:
+
+    PAGES_DIR/lodz.gdzienawesta.com/index.html
+    PAGES_DIR/lodz.gdzienawesta.com/kalendarz.html
+
+and nginx looks for ``$host/index.html`` there before asking Django. Only
+hosts that serve a page of their own get a directory: the apex and each
+city's subdomain. Everything else - a subdomain naming no city, www and the
+default city's own subdomain, which redirect, a bare IP address - finds no
+file and goes to Django as before.
+
+Rendered again by ``manage.py render_pages``, which the prod container runs
+on start and stamp-assets.py runs after stamping, and on every city save or
+delete. A page also carries its city's next events (documents.initial_data),
+so storing a new version of a city's feed renders that city's pages again.
+A file is replaced only when its contents change, and atomically, so nginx
+never sends half a page.
+
+Headers do not live in a file, so the one header a page has - the Link
+header announcing its assets, the same for every host - is written out as
+nginx variables instead, to PAGES_DIR/links.conf, which the prod config
+includes. nginx reads it when it starts or reloads; stamp-assets.py, which
+is what changes it, reloads nginx after rendering.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# File name on disk -> the view whose page it is.
+PAGES = {
+    'index.html': 'HomeView',
+    'kalendarz.html': 'CalendarPageView',
+}
+
+LINKS_FILE = 'links.conf'
+
+
+def page_hosts() -> List[Tuple[str, object]]:
+    """(host, city) for every host that answers with a page of its own."""
+    from .middleware import canonical_host, resolve_city
+    from .models import City
+
+    bases = settings.CITY_BASE_DOMAINS
+    slugs = list(City.objects.filter(is_active=True).values_list('slug', flat=True))
+    hosts = []
+    for base in bases:
+        for host in [base] + [f'{slug}.{base}' for slug in slugs]:
+            city, _ = resolve_city(host, bases)
+            if city is not None and not canonical_host(host, city, bases):
+                hosts.append((host, city))
+    return hosts
+
+
+def render_pages(directory=None, city=None) -> Dict[str, int]:
+    """Bring ``directory`` (PAGES_DIR) in line with the cities and the files.
+
+    With ``city``, only that city's hosts, and nothing is removed.
+    Returns how many files were written, left as they were, and how many
+    host directories were removed.
+    """
+    from . import documents
+    from .models import City
+
+    directory = Path(directory or settings.PAGES_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    city_count = City.objects.filter(is_active=True).count()
+    views = {name: getattr(documents, view)() for name, view in PAGES.items()}
+
+    counts = {'written': 0, 'unchanged': 0, 'removed': 0}
+    _write(directory / LINKS_FILE, links_conf(views).encode('utf-8'))
+    hosts = page_hosts()
+    if city is not None:
+        hosts = [(host, c) for host, c in hosts if c.pk == city.pk]
+    for host, host_city in hosts:
+        for name, view in views.items():
+            page = view.render(host, host_city, city_count).encode('utf-8')
+            if _write(directory / host / name, page):
+                counts['written'] += 1
+            else:
+                counts['unchanged'] += 1
+
+    if city is not None:
+        return counts
+    # A renamed or deactivated city must stop answering from disk, or nginx
+    # would go on serving its page long after Django stopped.
+    keep = {host for host, _ in hosts}
+    for entry in directory.iterdir():
+        if entry.is_dir() and entry.name not in keep:
+            shutil.rmtree(entry)
+            counts['removed'] += 1
+    return counts
+
+
+def links_conf(views) -> str:
+    """nginx ``set`` lines: $preload_index and $preload_kalendarz."""
+    lines = ['# Written by manage.py render_pages (events/prerender.py).']
+    for name, view in views.items():
+        value = view.preload_header().replace("'", "\\'")
+        lines.append(f"set $preload_{name.partition('.')[0]} '{value}';")
+    return '\n'.join(lines) + '\n'
+
+
+def refresh(city=None) -> None:
+    """render_pages, if pages are kept at all; never fails the caller."""
+    if not settings.PAGES_DIR:
+        return
+    try:
+        counts = render_pages(city=city)
+        logger.info(f'Rendered pages: {counts}')
+    except Exception as e:
+        # Django still answers for any host whose page is missing; an old
+        # page is worse, but not worth failing a city edit over.
+        logger.error(f'Could not render pages: {e}', exc_info=True)
+
+
+def _write(path: Path, content: bytes) -> bool:
+    try:
+        if path.read_bytes() == content:
+            return False
+    except FileNotFoundError:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=path.parent, prefix='.', suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    # mkstemp's 0600 would keep nginx, another user, from reading it.
+    os.chmod(temporary, 0o644)
+    os.replace(temporary, path)
+    return True
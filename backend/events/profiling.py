@@ -0,0 +1,134 @@
+"""Profiling a request in production, on demand or by sampling.
+
+A slow /api/next-events/ on the server is not the same as one on a laptop:
+the feed is another size, the cache is cold or not, Google answers slower.
+Until now the only way to see where the time goes was to guess.
+
+A request carrying ``X-Profile: <PROFILE_SECRET>`` runs under cProfile and
+tracemalloc, and so does a random PROFILE_SAMPLE_RATE of all requests (0 by
+default: none). What was measured is stored as a RequestProfile row - the
+raw stats, loadable with pstats or snakeviz, and a summary of the functions
+that took longest, the app's own and the icalendar stack's singled out -
+and only the last HISTORY rows are kept. The admin panel lists them and
+hands out the raw stats; a profiled request answers with ``X-Profile-Id``.
+
+Both are slow - tracemalloc by several times - which is why neither is on
+unless asked for. Without a secret, the header does nothing.
+"""
+
+import hmac
+import io
+import logging
+import marshal
+import random
+from time import perf_counter
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-Profile'
+
+# Where the time of an answer goes, besides Django: this app, and the
+# libraries that parse and expand a feed.
+FOCUS = ('/events/', 'icalendar', 'recurring_ical_events', 'x_wr_timezone', 'dateutil')
+
+
+def wanted(request) -> bool:
+    """Whether to profile ``request``: it asks with the secret, or is sampled."""
+    secret = settings.PROFILE_SECRET
+    asked = request.headers.get(HEADER)
+    if secret and asked and hmac.compare_digest(asked.encode(), secret.encode()):
+        return True
+    rate = settings.PROFILE_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def summary(stats: dict, limit: int = 25) -> str:
+    """The top functions by cumulative time, all of them and the app's own."""
+    import pstats
+    import re
+
+    text = io.StringIO()
+    report = pstats.Stats(_Loaded(stats), stream=text).sort_stats('cumulative')
+    text.write('All functions\n')
+    report.print_stats(limit)
+    text.write('\nThis app and the icalendar stack\n')
+    report.print_stats('|'.join(re.escape(f) for f in FOCUS), limit)
+    return text.getvalue()
+
+
+class _Loaded:
+    """A stats dict as pstats.Stats takes it: anything with create_stats()."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class ProfilingMiddleware:
+    """Profiles the requests wanted() picks; every other request pays one check."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not wanted(request):
+            return self.get_response(request)
+
+        import cProfile
+        import tracemalloc
+
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start()
+        profiler = cProfile.Profile()
+        started = perf_counter()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is running in this thread; leave it be.
+            if not tracing:
+                tracemalloc.stop()
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+            duration_ms = (perf_counter() - started) * 1000
+            _, peak = tracemalloc.get_traced_memory()
+            if not tracing:
+                tracemalloc.stop()
+
+        try:
+            response[f'{HEADER}-Id'] = str(self._store(request, response, profiler,
+                                                       duration_ms, peak))
+        except Exception as e:
+            # The request was answered; losing its profile is no reason to fail it.
+            logger.error(f'Could not store the profile of {request.path}: {e}', exc_info=True)
+        return response
+
+    @staticmethod
+    def _store(request, response, profiler, duration_ms, peak):
+        from .models import RequestProfile
+
+        profiler.create_stats()
+        profile = RequestProfile.objects.create(
+            method=request.method,
+            path=request.get_full_path()[:255],
+            host=request.META.get('HTTP_HOST', '')[:255],
+            status=response.status_code,
+            duration_ms=duration_ms,
+            peak_kb=peak // 1024,
+            summary=summary(profiler.stats),
+            stats=marshal.dumps(profiler.stats),
+        )
+        expired = list(RequestProfile.objects.values_list('pk', flat=True)
+                       [RequestProfile.HISTORY:])
+        if expired:
+            RequestProfile.objects.filter(pk__in=expired).delete()
+        return profile.pk
@@ -0,0 +1,179 @@
+"""Plain weekly and daily rules, expanded without recurring_ical_events.
+
+Nearly every series in our calendars is a weekly social: FREQ=WEEKLY, maybe
+an INTERVAL, maybe a COUNT or an UNTIL, a handful of EXDATEs for the weeks it
+did not happen. recurring_ical_events turns each of its occurrences into a
+copied icalendar component, through dateutil and pytz, and the indexer reads
+five fields back out of every copy.
+
+For a rule this plain the occurrences are arithmetic: step the wall-clock
+start by a day or a week, attach the zone, drop the excluded ones. That is
+all this does - start and end pairs, no components - and it does exactly
+what recurring_ical_events does with the same rule, down to how EXDATEs are
+matched (by UTC or by wall-clock time, either will do).
+
+Anything beyond that raises Unsupported and the series goes to
+recurring_ical_events as before: other frequencies, BYxxx parts other than a
+plain BYDAY, a rule that does not start on one of its own days, an UNTIL not
+in UTC, and any occurrence whose local time a DST change makes ambiguous or
+skips, or that a DST change cuts through - pytz and zoneinfo part ways there.
+"""
+
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from .parsing import Unsupported
+
+_DAYS = {'MO': 0, 'TU': 1, 'WE': 2, 'TH': 3, 'FR': 4, 'SA': 5, 'SU': 6}
+_PARTS = {'FREQ', 'INTERVAL', 'COUNT', 'UNTIL', 'BYDAY', 'WKST'}
+
+
+def expand(rule: str, start: datetime, end: datetime, exdates: Iterable[datetime],
+           window: Tuple[datetime, datetime]) -> List[Tuple[datetime, datetime]]:
+    """(start, end) of every occurrence of ``rule`` that overlaps ``window``.
+
+    ``start`` and ``end`` are the master event's, as recurring_ical_events
+    would see them: aware in one zone, or both floating - in which case the
+    window is compared in its own wall-clock time, and so are the results.
+    """
+    parts = _parse(rule)
+    zone = start.tzinfo
+    if (end.tzinfo is None) != (zone is None):
+        raise Unsupported('Start and end disagree on being floating')
+    if zone is not None and start.utcoffset() != end.utcoffset():
+        raise Unsupported('A DST change inside the event')
+    duration = end - start
+    if duration < timedelta(0):
+        raise Unsupported('Ends before it starts')
+
+    until = parts.get('UNTIL')
+    if until is not None:
+        if zone is None or len(until) != 16 or not until.endswith('Z'):
+            raise Unsupported(f'UNTIL not understood: {until}')
+        until = _utc(until)
+    count = int(parts['COUNT']) if 'COUNT' in parts else None
+    if count is not None and count < 1:
+        raise Unsupported('COUNT below one')
+
+    window_start, window_end = window
+    if zone is None:
+        # What convert_to_datetime(span, None) makes of the window.
+        window_start = window_start.replace(tzinfo=None)
+        window_end = window_end.replace(tzinfo=None)
+
+    excluded: Set[datetime] = set()
+    for exdate in exdates:
+        if (exdate.tzinfo is None) != (zone is None):
+            raise Unsupported('EXDATE and DTSTART disagree on being floating')
+        excluded.update(_ids(exdate))
+
+    occurrences = []
+    first = start.replace(tzinfo=None)
+    for n, wall in enumerate(_walls(first, parts)):
+        if count is not None and n >= count:
+            break
+        occurrence = _attach(wall, zone)
+        if until is not None and occurrence > until:
+            break
+        if occurrence >= window_end:
+            break
+        stop = occurrence + duration
+        if zone is not None and stop.utcoffset() != occurrence.utcoffset():
+            raise Unsupported(f'A DST change inside the occurrence at {wall}')
+        if excluded and excluded & _ids(occurrence):
+            continue
+        if occurrence == stop:
+            inside = window_start <= occurrence < window_end
+        else:
+            inside = occurrence < window_end and window_start < stop
+        if inside:
+            occurrences.append((occurrence, stop))
+    return occurrences
+
+
+def _parse(rule: str) -> Dict[str, str]:
+    parts = {}
+    for part in rule.split(';'):
+        key, eq, value = part.partition('=')
+        if not eq or key not in _PARTS or key in parts:
+            raise Unsupported(f'Rule part not understood: {part!r}')
+        parts[key] = value
+    if parts.get('FREQ') not in ('DAILY', 'WEEKLY'):
+        raise Unsupported(f'FREQ={parts.get("FREQ")} is not plain')
+    if 'COUNT' in parts and 'UNTIL' in parts:
+        raise Unsupported('COUNT and UNTIL together')
+    for key in ('INTERVAL', 'COUNT'):
+        if key in parts and not parts[key].isdigit():
+            raise Unsupported(f'{key}={parts[key]}')
+    if parts.get('INTERVAL') == '0':
+        raise Unsupported('INTERVAL=0')
+    if 'BYDAY' in parts and parts['FREQ'] != 'WEEKLY':
+        raise Unsupported('BYDAY on a daily rule')
+    for day in parts.get('BYDAY', 'MO').split(',') + [parts.get('WKST', 'MO')]:
+        if day not in _DAYS:
+            raise Unsupported(f'Day not understood: {day!r}')
+    return parts
+
+
+def _walls(first: datetime, parts: Dict[str, str]) -> Iterator[datetime]:
+    """Wall-clock starts from ``first`` on, as dateutil's rrule steps them."""
+    interval = int(parts.get('INTERVAL', '1'))
+    if parts['FREQ'] == 'DAILY':
+        yield from _daily(first, timedelta(days=interval))
+    else:
+        yield from _weekly(first, parts, timedelta(weeks=interval))
+
+
+def _daily(first: datetime, step: timedelta) -> Iterator[datetime]:
+    wall = first
+    while True:
+        yield wall
+        wall += step
+
+
+def _weekly(first: datetime, parts: Dict[str, str], step: timedelta) -> Iterator[datetime]:
+    days = {_DAYS[d] for d in parts['BYDAY'].split(',')} if 'BYDAY' in parts \
+        else {first.weekday()}
+    if first.weekday() not in days:
+        # recurring_ical_events adds DTSTART as an extra occurrence, and
+        # dateutil leaves it out of COUNT. Not worth matching.
+        raise Unsupported('DTSTART is not one of the rule\'s days')
+    week_start = _week_start(first.date(), _DAYS[parts.get('WKST', 'MO')])
+    offsets = sorted((day - week_start.weekday()) % 7 for day in days)
+    clock = first.time()
+    while True:
+        for offset in offsets:
+            wall = datetime.combine(week_start + timedelta(days=offset), clock)
+            if wall >= first:
+                yield wall
+        week_start += step
+
+
+def _week_start(day: date, wkst: int) -> date:
+    return day - timedelta(days=(day.weekday() - wkst) % 7)
+
+
+def _attach(wall: datetime, zone) -> datetime:
+    if zone is None:
+        return wall
+    value = wall.replace(tzinfo=zone)
+    if value.utcoffset() != wall.replace(tzinfo=zone, fold=1).utcoffset():
+        raise Unsupported(f'{wall} is ambiguous or skipped')
+    return value
+
+
+def _ids(value: datetime) -> Set[datetime]:
+    # recurring_ical_events' to_recurrence_ids: a floating time as it is,
+    # an aware one both in UTC and on its own wall clock, all without zones.
+    if value.tzinfo is None:
+        return {value}
+    return {value.astimezone(timezone.utc).replace(tzinfo=None), value.replace(tzinfo=None)}
+
+
+def _utc(value: str) -> datetime:
+    try:
+        return datetime(int(value[:4]), int(value[4:6]), int(value[6:8]),
+                        int(value[9:11]), int(value[11:13]), int(value[13:15]),
+                        tzinfo=timezone.utc)
+    except ValueError:
+        raise Unsupported(f'Not a UTC DATE-TIME: {value!r}')
@@ -0,0 +1,34 @@
+"""A version for the set of cities, moved whenever a city is saved or deleted.
+
+Several answers depend on nothing but the cities we serve: the sitemap, the
+robots.txt of every host. Rather than each of them checking the table on
+every request, they are kept under this version and left alone until it
+moves.
+
+The version lives in the shared cache, not in the process, so every gunicorn
+worker sees a change the moment the admin panel makes it. It is a random
+token rather than a counter: the file cache outlives a restart and a test
+run alike, and a counter starting again from one would find last week's
+answers still filed under it.
+"""
+
+import uuid
+
+from django.core.cache import cache
+
+KEY = 'cities:version'
+
+
+def registry_version() -> str:
+    version = cache.get(KEY)
+    if version is None:
+        # add(), not set(): two workers arriving at once must settle on one.
+        cache.add(KEY, uuid.uuid4().hex[:12], None)
+        version = cache.get(KEY)
+    return version
+
+
+def bump_registry_version() -> str:
+    version = uuid.uuid4().hex[:12]
+    cache.set(KEY, version, None)
+    return version
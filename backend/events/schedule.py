@@ -0,0 +1,212 @@
+"""How often each city's feed is fetched from Google, and how often in all.
+
+Every feed used to stay fresh for a quarter of an hour, whoever was looking
+and whatever the organisers did: a city whose page half the scene reloads
+on a Friday evening waited as long for a fixed event as one nobody had
+opened in a week, and a calendar edited every day was fetched no more
+often than one untouched since spring. And every fetch comes from one
+address, ours, which Google will throttle if it sees too many.
+
+So each city gets an interval of its own, worked out from two rates kept in
+the shared cache:
+
+- demand: how often its events are asked for - the API, the subscription
+  feed, a stream connecting - counted by wanted(), in each process, and
+  added to the shared count by flush() every FLUSH_SECONDS rather than
+  written on every request;
+- change: how often a fetch finds the feed different from the last one,
+  noted by fetched(). Google stamps every copy with the moment it was made
+  (DTSTAMP), so those lines are left out of the comparison, or every fetch
+  would be a change.
+
+Both are counts that halve every half-life, so last month's rush fades and
+a new pattern shows within days. An answer served from a feed that has
+changed since it was fetched is a stale one; a city serves about demand *
+change * interval / 2 of those between fetches. The intervals that serve
+the fewest in all for a given number of fetches an hour are in proportion
+to 1 / sqrt(demand * change) - busy, volatile cities are looked at often,
+quiet or settled ones seldom - and plan() scales them to spend
+BUDGET_SHARE of FEED_FETCH_RATE, then holds each between MIN_SECONDS and
+MAX_SECONDS. What quiet and settled cities no longer spend, busy and
+volatile ones get: down to five minutes, a third of the quarter hour every
+feed used to get. The budget, not the floor, is what bounds the fetches in
+all. A city nobody asks about costs nothing whatever its interval: a feed
+is still fetched only by a request finding its copy expired.
+
+The plan is a guide; the budget itself is a token bucket shared by every
+worker on every host (throttle.take). A fetch takes a token, and one that
+finds none answers from the copy it has until there is one. The share not
+planned for is what the admin panel's refreshes and cities fetched for the
+first time - both fetched regardless - take from.
+"""
+
+import hashlib
+import logging
+import math
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .throttle import take
+
+logger = logging.getLogger(__name__)
+
+# For a city the plan has not covered yet: what every city used to get.
+DEFAULT_SECONDS = 15 * 60
+MIN_SECONDS = 5 * 60
+MAX_SECONDS = 6 * 60 * 60
+BUDGET_SHARE = 0.8
+
+DEMAND_HALF_LIFE = 24 * 60 * 60
+CHANGE_HALF_LIFE = 14 * 24 * 60 * 60
+# Before anything is known: a request a day, and a change a week.
+DEMAND_FLOOR = 1 / (24 * 60 * 60)
+CHANGE_FLOOR = 1 / (7 * 24 * 60 * 60)
+# A rate is not trusted to an hour of history less than this.
+MIN_HISTORY_SECONDS = 60 * 60
+
+PLAN_SECONDS = 5 * 60
+FLUSH_SECONDS = PLAN_SECONDS
+
+_DTSTAMP = re.compile(rb'^DTSTAMP[:;][^\r\n]*\r?\n', re.MULTILINE)
+
+
+_counted: Dict[str, float] = {}
+_lock = threading.Lock()
+_flushed_at = time.monotonic()
+
+
+def wanted(calendar_id: str, weight: float = 1.0) -> None:
+    """Count a request for this city's events, here; flush() now and then."""
+    with _lock:
+        _counted[calendar_id] = _counted.get(calendar_id, 0.0) + weight
+    if time.monotonic() - _flushed_at >= FLUSH_SECONDS:
+        flush()
+
+
+def flush(now: Optional[float] = None) -> None:
+    """Add what this process counted to the shared counts. Never fails the caller."""
+    global _counted, _flushed_at
+    now = time.time() if now is None else now
+    with _lock:
+        counted, _counted = _counted, {}
+        _flushed_at = time.monotonic()
+    try:
+        for calendar_id, weight in counted.items():
+            key = f'schedule:demand:{calendar_id}'
+            count, stamp, since = cache.get(key) or (0.0, now, now)
+            count = _decayed(count, stamp, now, DEMAND_HALF_LIFE) + weight
+            # Two processes flushing at once lose one of the two; a rate
+            # over days is no worse for it.
+            cache.set(key, (count, now, since), 8 * DEMAND_HALF_LIFE)
+        plan(now)
+    except Exception as e:
+        logger.error(f'Could not record demand: {e}', exc_info=True)
+
+
+def fetched(calendar_id: str, feed: bytes, seconds: int, now: Optional[float] = None) -> None:
+    """Note a copy of the feed fetched, fresh for ``seconds``."""
+    now = time.time() if now is None else now
+    content = hashlib.sha256(_DTSTAMP.sub(b'', feed)).hexdigest()[:16]
+    key = f'schedule:changes:{calendar_id}'
+    known = cache.get(key)
+    if known is None:
+        record = (content, 0.0, now, now)
+    else:
+        last, count, stamp, since = known
+        count = _decayed(count, stamp, now, CHANGE_HALF_LIFE) + (content != last)
+        record = (content, count, now, since)
+    cache.set(key, record, 8 * CHANGE_HALF_LIFE)
+    fresh_until(calendar_id, seconds, now)
+
+
+def fresh_until(calendar_id: str, seconds: int, now: Optional[float] = None) -> None:
+    """The copy in the cache stands for ``seconds``; see remaining()."""
+    now = time.time() if now is None else now
+    cache.set(f'schedule:until:{calendar_id}', now + seconds, seconds)
+
+
+def remaining(calendar_id: str, now: Optional[float] = None) -> int:
+    """Seconds until this city's feed is next fetched, at least 1."""
+    now = time.time() if now is None else now
+    until = cache.get(f'schedule:until:{calendar_id}')
+    if until is None:
+        return interval(calendar_id)
+    return max(1, math.ceil(until - now))
+
+
+def spend(now: Optional[float] = None) -> float:
+    """Take a fetch from the budget. Seconds until there is one, 0 if taken."""
+    capacity, refill_seconds = settings.FEED_FETCH_RATE
+    # Not in the throttle's cache, which a flood of clients can fill.
+    return take('schedule:budget', capacity, refill_seconds,
+                time.time() if now is None else now, store=cache)
+
+
+def interval(calendar_id: str) -> int:
+    """How long a fetched copy of this city's feed stays fresh, by the plan.
+
+    Read-only, and so safe off the request's thread: the plan is made by
+    flush(), which requests call.
+    """
+    planned = cache.get('schedule:plan')
+    if planned is None:
+        return DEFAULT_SECONDS
+    return planned.get(calendar_id, DEFAULT_SECONDS)
+
+
+def rates(calendar_id: str, now: float):
+    """(requests, changes) per second, as far as they are known."""
+    demand = change = None
+    known = cache.get(f'schedule:demand:{calendar_id}')
+    if known is not None:
+        count, stamp, since = known
+        demand = _rate(count, stamp, since, now, DEMAND_HALF_LIFE)
+    known = cache.get(f'schedule:changes:{calendar_id}')
+    if known is not None:
+        _, count, stamp, since = known
+        change = _rate(count, stamp, since, now, CHANGE_HALF_LIFE)
+    return demand, change
+
+
+def plan(now: Optional[float] = None) -> Dict[str, int]:
+    """Seconds between fetches for every active city, made at most every PLAN_SECONDS."""
+    from .models import City
+
+    planned = cache.get('schedule:plan')
+    if planned is not None:
+        return planned
+    now = time.time() if now is None else now
+    calendar_ids = list(City.objects.filter(is_active=True)
+                        .values_list('calendar_id', flat=True))
+    weights = {}
+    for calendar_id in calendar_ids:
+        demand, change = rates(calendar_id, now)
+        weights[calendar_id] = math.sqrt(max(demand or 0, DEMAND_FLOOR)
+                                         * max(change or 0, CHANGE_FLOOR))
+    _, refill_seconds = settings.FEED_FETCH_RATE
+    budget = BUDGET_SHARE / refill_seconds
+    total = sum(weights.values())
+    planned = {
+        calendar_id: int(min(MAX_SECONDS, max(MIN_SECONDS, total / (budget * weight))))
+        for calendar_id, weight in weights.items()
+    }
+    cache.set('schedule:plan', planned, PLAN_SECONDS)
+    return planned
+
+
+def _decayed(count: float, stamp: float, now: float, half_life: float) -> float:
+    return count * 2 ** (-max(0.0, now - stamp) / half_life)
+
+
+def _rate(count: float, stamp: float, since: float, now: float, half_life: float) -> float:
+    """Per second: ``count`` over the time it was counted in, weighted as it was."""
+    # How much time a count that halves every half_life remembers, for a
+    # history of this length; the whole half_life / ln 2 only in the long run.
+    history = max(MIN_HISTORY_SECONDS, now - since)
+    remembered = half_life / math.log(2) * (1 - 2 ** (-history / half_life))
+    return _decayed(count, stamp, now, half_life) / remembered
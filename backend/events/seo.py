@@ -9,26 +9,76 @@ is nowhere in the served HTML, because the footer that links the cities is
 built by JavaScript from /api/cities/.
 
 Both responses depend on the Host header, exactly like the rest of the site.
+And on nothing else but the set of cities, which changes a few times a year -
+so each is rendered once per host and per version of that set (see
+events/registry.py) and then handed out as ready bytes, with an ETag that
+lets a crawler coming back skip the body altogether.
 """
 
+import hashlib
+
 from django.conf import settings
+from django.core.cache import cache
 from django.http import HttpResponse, HttpResponseNotFound, HttpResponseRedirect
+from django.utils.cache import get_conditional_response
 from django.views import View
 from xml.sax.saxutils import escape
 
 from .middleware import base_domain_for, canonical_host, scheme_for
 from .models import City
+from .registry import registry_version
 
 # Addresses worth offering to a crawler, in the site's own language. The page
 # answers to /calendar as well, but the two spellings are one page, so listing
 # both would be asking Google to pick a favourite between duplicates.
 CITY_PATHS = ['/', '/kalendarz']
 
+# A safety net under the registry version: a city changed by a data migration
+# fires no signal, and a day is as long as that may go unnoticed.
+RENDERED_SECONDS = 24 * 60 * 60
+
+
 def _host_of(city: City, base: str) -> str:
     """The address a city answers on: the apex for the default, else its own."""
     return base if city.is_default else f'{city.slug}.{base}'
 
 
+def _prerendered(request, name, content_type, render):
+    """``render()``'s answer for this host, rendered once per city set.
+
+    ``render`` returns either the body, to be kept, or a whole response -
+    a redirect or a 404 - which is passed through as it is.
+
+    Only hosts naming a city we serve, under one of our base domains, are
+    kept: those are few, and known. Any other host is whatever a client put
+    in its Host header - a wildcard DNS record answers for all of them - and
+    keeping each would let anyone push the feeds out of the cache.
+    """
+    host = request.get_host().lower()
+    key = None
+    rendered = None
+    if (getattr(request, 'city', None) is not None
+            and base_domain_for(host, settings.CITY_BASE_DOMAINS) is not None):
+        key = f'seo:{name}:{registry_version()}:{host}'
+        rendered = cache.get(key)
+
+    if rendered is None:
+        body = render()
+        if isinstance(body, HttpResponse):
+            return body
+        body = body.encode('utf-8')
+        rendered = (body, f'"{hashlib.sha256(body).hexdigest()[:16]}"')
+        if key is not None:
+            cache.set(key, rendered, RENDERED_SECONDS)
+
+    body, etag = rendered
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type=content_type)
+    response['ETag'] = etag
+    return response
+
+
 class RobotsView(View):
     """robots.txt naming this host's sitemap.
 
@@ -38,6 +88,23 @@ class RobotsView(View):
     """
 
     def get(self, request):
+        response = _prerendered(request, 'robots', 'text/plain; charset=utf-8',
+                                lambda: self.render(request))
+        # What this file should live for. Whether anyone downstream agrees is
+        # another matter: measured 2026-08-16, the zone's Browser Cache TTL of
+        # four hours behaves as a floor rather than a default, so Cloudflare
+        # rewrites max-age=300 to max-age=14400 on the way out, while
+        # styles.css keeps the year it asks for because a year is above the
+        # floor. Neither no-cache nor a small number survives that on its own.
+        #
+        # It takes a cache rule in Cloudflare, scoped to this path, for the
+        # value below to be the one a reader actually sees. The header stays
+        # regardless: it is the origin saying what it means, and it is what
+        # the rule will defer to.
+        response['Cache-Control'] = 'public, max-age=300'
+        return response
+
+    def render(self, request):
         host = request.get_host()
         # Point at the sitemap of the address this city actually keeps. The
         # default city answers on its own subdomain too, and naming that copy
@@ -53,20 +120,7 @@ class RobotsView(View):
             f'Sitemap: {scheme_for(named)}://{named}/sitemap.xml',
             '',
         ]
-        response = HttpResponse('\n'.join(lines), content_type='text/plain; charset=utf-8')
-        # What this file should live for. Whether anyone downstream agrees is
-        # another matter: measured 2026-08-16, the zone's Browser Cache TTL of
-        # four hours behaves as a floor rather than a default, so Cloudflare
-        # rewrites max-age=300 to max-age=14400 on the way out, while
-        # styles.css keeps the year it asks for because a year is above the
-        # floor. Neither no-cache nor a small number survives that on its own.
-        #
-        # It takes a cache rule in Cloudflare, scoped to this path, for the
-        # value below to be the one a reader actually sees. The header stays
-        # regardless: it is the origin saying what it means, and it is what
-        # the rule will defer to.
-        response['Cache-Control'] = 'public, max-age=300'
-        return response
+        return '\n'.join(lines)
 
 
 class SitemapView(View):
@@ -79,6 +133,10 @@ class SitemapView(View):
     """
 
     def get(self, request):
+        return _prerendered(request, 'sitemap', 'application/xml; charset=utf-8',
+                            lambda: self.render(request))
+
+    def render(self, request):
         host = request.get_host()
         scheme = scheme_for(host)
         base = (
@@ -117,4 +175,4 @@ class SitemapView(View):
         body.append('</urlset>')
         body.append('')
 
-        return HttpResponse('\n'.join(body), content_type='application/xml; charset=utf-8')
+        return '\n'.join(body)
@@ -1,13 +1,23 @@
-from datetime import datetime, timezone, timedelta
-from typing import Optional, Dict, Any, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+from typing import Optional, Dict, Any, List, NamedTuple, Tuple
 from urllib.parse import quote
-import requests
+import hashlib
+import heapq
 import logging
+import math
+import uuid
+from time import perf_counter
+
 from django.core.cache import cache
-from icalendar import Calendar
-from dateutil import parser
+from django.db import transaction
 from django.utils import timezone as django_timezone
-import recurring_ical_events
+
+from . import bus, edge, health, indexfiles, schedule
+from .indexing import HORIZON, build_index, feed_version
+from .packing import PackedIndex, pack_index
+from .trimming import trim_feed
 
 logger = logging.getLogger(__name__)
 
@@ -34,34 +44,55 @@ class CalendarFeedService:
 
     The fresh copy spares Google the polling. Every subscribed calendar app
     refreshes on its own schedule, and without a cache each one of them would
-    become a request to Google; with it, they share one fetch per quarter of
-    an hour, which is far more often than a dance calendar changes.
+    become a request to Google; with it, they share one fetch per interval -
+    the city's own, from events/schedule.py, as often as its demand and its
+    organisers' edits justify and the budget of fetches for all cities allows.
+    A fetch the budget has no room for waits, and the copy there is stands.
 
     The last good copy answers when Google does not. A feed that is minutes
     stale is a calendar nobody notices; a feed that is briefly missing is
     events disappearing from someone's phone.
     """
 
-    FRESH_SECONDS = 15 * 60
     LAST_GOOD_SECONDS = 7 * 24 * 60 * 60
     TIMEOUT_SECONDS = 10
 
-    def get(self, calendar_id: str) -> Tuple[Optional[bytes], bool]:
-        """Return (feed, is_stale). ``feed`` is None only if we never had one."""
+    def get(self, calendar_id: str, refetch: bool = False) -> Tuple[Optional[bytes], bool]:
+        """Return (feed, is_stale). ``feed`` is None only if we never had one.
+
+        ``refetch`` asks Google even if the fresh copy has not expired.
+        """
         fresh_key = f'ics:fresh:{calendar_id}'
         last_good_key = f'ics:last-good:{calendar_id}'
 
-        cached = cache.get(fresh_key)
+        cached = None if refetch else cache.get(fresh_key)
         if cached is not None:
             return cached, False
 
+        wait = schedule.spend()
+        if wait and not refetch:
+            last_good = cache.get(last_good_key)
+            if last_good is not None:
+                seconds = math.ceil(wait)
+                logger.info(f'Over the fetch budget: {calendar_id} waits {seconds} s')
+                cache.set(fresh_key, last_good, seconds)
+                schedule.fresh_until(calendar_id, seconds)
+                return last_good, False
+
+        started = perf_counter()
         body = self._fetch(calendar_id)
+        fetch_ms = (perf_counter() - started) * 1000
         if body is not None:
-            cache.set(fresh_key, body, self.FRESH_SECONDS)
+            seconds = schedule.interval(calendar_id)
+            cache.set(fresh_key, body, seconds)
             cache.set(last_good_key, body, self.LAST_GOOD_SECONDS)
+            schedule.fetched(calendar_id, body, seconds)
+            health.note(calendar_id, ok=True, error='', feed_bytes=len(body),
+                        fetch_ms=fetch_ms)
             return body, False
 
         last_good = cache.get(last_good_key)
+        health.note(calendar_id, ok=False, fetch_ms=fetch_ms, stale=last_good is not None)
         if last_good is not None:
             logger.warning(
                 f'Serving a stale feed for {calendar_id}: Google is unreachable'
@@ -71,16 +102,22 @@ class CalendarFeedService:
         return None, False
 
     def _fetch(self, calendar_id: str) -> Optional[bytes]:
+        # Most requests never get here, and requests costs more to import
+        # than the rest of this app together - see events/startup.py.
+        import requests
+
         try:
             response = requests.get(ical_url(calendar_id), timeout=self.TIMEOUT_SECONDS)
         except requests.RequestException as exc:
             logger.error(f'Failed to fetch feed {calendar_id}: {exc}')
+            health.note(calendar_id, error=str(exc)[:255] or type(exc).__name__)
             return None
 
         if response.status_code != 200:
             logger.error(
                 f'Failed to fetch feed {calendar_id}: {response.status_code}'
             )
+            health.note(calendar_id, error=f'HTTP {response.status_code}')
             return None
 
         # A calendar Google has stopped publishing answers 200 with a login
@@ -88,11 +125,251 @@ class CalendarFeedService:
         # HTML, and caching it would keep doing so for a week.
         if not response.content.lstrip().startswith(b'BEGIN:VCALENDAR'):
             logger.error(f'Feed {calendar_id} did not come back as a calendar')
+            health.note(calendar_id, error='Not a calendar (is it still public?)')
             return None
 
         return response.content
 
 
+class TrimmedFeedService:
+    """The feed cut down to a window around today, for calendar apps.
+
+    Cut once per copy of the feed and per day - the window moves at
+    midnight - and then handed out as bytes, like the full feed is.
+    """
+
+    # How much history a subscriber may ask for. Snapped to one of these so
+    # the number of copies kept per feed stays small whatever is in the URL.
+    HISTORY_DAYS = (0, 7, 30, 90, 365)
+    DEFAULT_HISTORY_DAYS = 30
+    # Further ahead than the site looks: a subscriber planning a trip to a
+    # festival next summer wants to see it.
+    FUTURE = timedelta(days=2 * 365)
+    SECONDS = 24 * 60 * 60
+
+    @classmethod
+    def history_days(cls, requested: Optional[str]) -> int:
+        """The window a ``?window=`` asks for, snapped up to one we keep."""
+        try:
+            days = int(requested)
+        except (TypeError, ValueError):
+            return cls.DEFAULT_HISTORY_DAYS
+        for allowed in cls.HISTORY_DAYS:
+            if days <= allowed:
+                return allowed
+        return cls.HISTORY_DAYS[-1]
+
+    def get(self, calendar_id: str, history_days: int) -> Tuple[Optional[bytes], bool]:
+        """Return (feed, is_stale), as CalendarFeedService.get does."""
+        feed, is_stale = CalendarFeedService().get(calendar_id)
+        if feed is None:
+            return None, False
+
+        today = django_timezone.localtime(django_timezone.now()).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        key = (f'ics:trimmed:{calendar_id}:{feed_version(feed)}:'
+               f'{history_days}:{today.date().isoformat()}')
+
+        trimmed = cache.get(key)
+        if trimmed is None:
+            start = today - timedelta(days=history_days)
+            trimmed = trim_feed(feed, start, today + self.FUTURE)
+            cache.set(key, trimmed, self.SECONDS)
+        return trimmed, is_stale
+
+
+class CalendarIndexService:
+    """A city's occurrences, indexed once per copy of its feed.
+
+    The feed is fetched and cached by CalendarFeedService; this keeps what it
+    expands to next to it, packed (see events/packing.py) so that reading it
+    back is a few slices of one buffer rather than unpickling a year of
+    occurrences. A request finding the index built from the feed it has just
+    been handed answers from it directly. One finding an older index patches
+    it - see events/indexing.py for what gets reused.
+    """
+
+    # The index is worth keeping as long as the feed it was built from.
+    SECONDS = CalendarFeedService.LAST_GOOD_SECONDS
+
+    def get(self, calendar_id: str) -> Optional[PackedIndex]:
+        feed, _ = CalendarFeedService().get(calendar_id)
+        if feed is None:
+            return None
+
+        version = feed_version(feed)
+        now = django_timezone.now()
+
+        previous = self.cached(calendar_id)
+        if (previous is not None and previous.version == version
+                and previous.covers(now)):
+            return previous
+
+        started = perf_counter()
+        packed = pack_index(build_index(calendar_id, feed, version, now, previous))
+        index = PackedIndex(packed)
+        health.note(calendar_id, vevents=feed.count(b'BEGIN:VEVENT'),
+                    occurrences=len(index), index_ms=(perf_counter() - started) * 1000)
+        if indexfiles.enabled():
+            # Every worker maps the one file rather than keeping a copy.
+            name = indexfiles.publish(calendar_id, packed, index)
+            cache.set(indexfiles.cache_key(calendar_id), name, self.SECONDS)
+            return indexfiles.attach(calendar_id, name) or index
+        cache.set(indexfiles.cache_key(calendar_id), packed, self.SECONDS)
+        return index
+
+    def cached(self, calendar_id: str) -> Optional[PackedIndex]:
+        """The index as last built, whichever feed it came from.
+
+        A file name in the cache is an index published to INDEX_DIR, and is
+        mapped; bytes are the index itself.
+        """
+        packed = cache.get(indexfiles.cache_key(calendar_id))
+        if isinstance(packed, str):
+            return indexfiles.attach(calendar_id, packed)
+        if not isinstance(packed, bytes):
+            return None
+        try:
+            return PackedIndex(packed)
+        except ValueError:
+            # Written by another version of this code; built again below.
+            return None
+
+
+class OccurrenceStore:
+    """A city's occurrences in the database, and the refresher that writes them.
+
+    Reading is an indexed range query. Writing happens when a reader finds
+    the city unchecked since its feed's copy expired: the refresher
+    asks CalendarIndexService for the index of the current feed and, if it
+    is not the one already stored, replaces the city's rows with it in one
+    transaction.
+
+    When there is no feed at all - Google down, and the cache lost with the
+    container - the rows stay, and the site keeps answering from them.
+
+    One refresh of a city at a time, across every worker on every host: the
+    first to find it due claims it in the shared cache (add() succeeds for
+    one caller only) and the rest answer from the stored rows meanwhile -
+    or, if there are none yet, wait a little for the claimant's. A claim
+    lapses on its own, so a worker killed mid-fetch holds nobody up for long.
+    """
+
+    # A fetch and an index, with room to spare.
+    CLAIM_SECONDS = 60
+    WAIT_SECONDS = CalendarFeedService.TIMEOUT_SECONDS
+
+    def upcoming(self, calendar_id: str, limit: int):
+        """The next ``limit`` stored occurrences of this calendar, not yet over."""
+        from .models import Occurrence
+
+        now = django_timezone.now()
+        return Occurrence.objects.filter(
+            city__calendar_id=calendar_id, end__gt=now, start__lt=now + HORIZON,
+        ).order_by('start')[:limit]
+
+    def is_checked(self, calendar_id: str) -> bool:
+        return cache.get(f'ics:checked:{calendar_id}') is not None
+
+    def next_check(self, calendar_id: str) -> Optional[datetime]:
+        """When the refresher looks at this calendar's feed again; None if due."""
+        checked = cache.get(f'ics:checked:{calendar_id}')
+        if not isinstance(checked, tuple):
+            return None
+        return datetime.fromtimestamp(checked[1], tz=dt_timezone.utc)
+
+    def claim(self, calendar_id: str) -> Optional[str]:
+        """The right to refresh this city now, or None if someone has it."""
+        token = uuid.uuid4().hex
+        if cache.add(f'ics:refreshing:{calendar_id}', token, self.CLAIM_SECONDS):
+            return token
+        return None
+
+    def release(self, calendar_id: str, token: str) -> None:
+        key = f'ics:refreshing:{calendar_id}'
+        # Not someone else's: ours may have lapsed and been claimed again.
+        if cache.get(key) == token:
+            cache.delete(key)
+
+    def refresh(self, calendar_id: str) -> None:
+        """Bring the stored rows in line with the current feed, if needed."""
+        if self.is_checked(calendar_id):
+            return
+        token = self.claim(calendar_id)
+        if token is None:
+            if cache.get(f'ics:stored:{calendar_id}') is None:
+                self._wait(calendar_id)
+            return
+        try:
+            index = CalendarIndexService().get(calendar_id)
+            if index is not None:
+                self.store(calendar_id, index)
+        finally:
+            self.release(calendar_id, token)
+            health.flush()
+
+    def _wait(self, calendar_id: str) -> None:
+        """Until another worker's refresh of this city is done, or WAIT_SECONDS."""
+        from time import sleep
+
+        deadline = perf_counter() + self.WAIT_SECONDS
+        while (perf_counter() < deadline and not self.is_checked(calendar_id)
+               and cache.get(f'ics:refreshing:{calendar_id}') is not None):
+            sleep(0.1)
+
+    def store(self, calendar_id: str, index: PackedIndex) -> None:
+        from .models import City, Occurrence
+
+        city = City.objects.filter(calendar_id=calendar_id).first()
+        if city is None:
+            return
+
+        # The window is part of it: the index is expanded again each day,
+        # and the new day at the far end of the year wants storing too.
+        stored = f'{city.pk}:{index.version}:{index.window[0].date().isoformat()}'
+        stored_key = f'ics:stored:{calendar_id}'
+        if cache.get(stored_key) != stored:
+            rows = []
+            for uid, series in index.series.items():
+                for o in series.occurrences:
+                    row = Occurrence(
+                        city=city, uid=uid[:255], start=o.start, end=o.end,
+                        title=o.title, location=o.location, description=o.description,
+                        feed_version=index.version,
+                    )
+                    row.encoded = Occurrence.encode(row.as_event(calendar_id))
+                    rows.append(row)
+            with transaction.atomic():
+                Occurrence.objects.filter(city=city).delete()
+                Occurrence.objects.bulk_create(rows)
+            cache.set(stored_key, stored, CalendarFeedService.LAST_GOOD_SECONDS)
+            logger.info(f'Stored {len(rows)} occurrences of {calendar_id} at {index.version}')
+            # What nginx and Cloudflare hold for this city was answered
+            # from the rows just replaced.
+            edge.purge_city_events(city)
+            # And so were its pages, which carry its next events - on
+            # every host, which is why this is announced.
+            bus.announce('pages', calendar_id=calendar_id)
+
+        # The version checked, and until when - as long as the copy of the
+        # feed it came from: the API tells clients the latter, as the
+        # earliest its answer can change.
+        seconds = schedule.remaining(calendar_id)
+        until = django_timezone.now() + timedelta(seconds=seconds)
+        cache.set(f'ics:checked:{calendar_id}', (index.version, until.timestamp()), seconds)
+
+
+class EncodedEvents(NamedTuple):
+    """Events as JSON fragments, and the moment the answer stops being true."""
+    fragments: List[str]
+    # When the first of them ends, and a later event takes its place in the
+    # list. None with no events: then only a feed change changes the answer.
+    changes_at: Optional[datetime]
+    # The earlier of that and the next look at the feeds: until then the
+    # answer cannot change, and a client need not ask again.
+    valid_until: Optional[datetime] = None
+
+
 class GoogleCalendarService:
     """Service for fetching events from Google Calendar using public iCal feed"""
 
@@ -106,99 +383,16 @@ class GoogleCalendarService:
         Returns:
             Dictionary with event data or None if no events found
         """
-        try:
-            # The same cached copy the subscription feed hands out. Without it
-            # every visit to the site was its own request to Google, from the
-            # server's single address; now the whole site, every visitor and
-            # every subscriber share one fetch per calendar per quarter hour.
-            feed, _ = CalendarFeedService().get(calendar_id)
-
-            if feed is None:
-                logger.error(f"Failed to fetch calendar {calendar_id}")
-                return None
-
-            # Parse iCal data
-            cal = Calendar.from_ical(feed)
-
-            # Use Django's configured timezone (from settings.TIME_ZONE)
-            now = django_timezone.now()
-
-            # Get all events (including recurring) for the next year
-            # recurring_ical_events expands RRULE to individual occurrences
-            events = recurring_ical_events.of(cal).between(
-                now,
-                now + timedelta(days=365)
-            )
-
-            upcoming_events = []
-
-            for component in events:
-                if component.name == "VEVENT":
-                    dtstart = component.get('dtstart')
-                    if not dtstart:
-                        continue
-
-                    # Get start datetime
-                    start_dt = dtstart.dt
-
-                    # Convert to datetime if it's a date
-                    if isinstance(start_dt, datetime):
-                        # Ensure timezone awareness
-                        if start_dt.tzinfo is None:
-                            start_dt = django_timezone.make_aware(start_dt)
-                    else:
-                        # It's a date, convert to datetime at midnight
-                        from datetime import date, time
-                        start_dt = django_timezone.make_aware(datetime.combine(start_dt, time.min))
-
-                    # Get end datetime
-                    dtend = component.get('dtend')
-                    end_dt = None
-                    if dtend:
-                        end_dt = dtend.dt
-                        if isinstance(end_dt, datetime):
-                            if end_dt.tzinfo is None:
-                                end_dt = django_timezone.make_aware(end_dt)
-                        else:
-                            from datetime import time
-                            end_dt = django_timezone.make_aware(datetime.combine(end_dt, time.min))
-
-                    # Skip events longer than 12 hours
-                    if end_dt:
-                        duration = end_dt - start_dt
-                        if duration > timedelta(hours=12):
-                            continue
-
-                    # Show events that haven't ended yet (not just future events)
-                    # Use end time if available, otherwise use start time
-                    event_time = end_dt if end_dt else start_dt
-                    if event_time > now:
-                        event_data = {
-                            'title': str(component.get('summary', 'Untitled')),
-                            'description': str(component.get('description', '')),
-                            'location': str(component.get('location', '')),
-                            'start': start_dt.isoformat(),
-                            'end': end_dt.isoformat() if end_dt else start_dt.isoformat(),
-                            'start_dt': start_dt,  # For sorting
-                            'calendar_id': calendar_id,
-                        }
-                        upcoming_events.append(event_data)
-
-            if not upcoming_events:
-                return None
-
-            # Sort by start time and return the earliest
-            upcoming_events.sort(key=lambda x: x['start_dt'])
-            next_event = upcoming_events[0]
+        events = self._upcoming(calendar_id, 1)
+        if not events:
+            return None
 
-            # Remove the helper field
-            del next_event['start_dt']
+        next_event = events[0]
 
-            return next_event
+        # Remove the helper field
+        del next_event['start_dt']
 
-        except Exception as e:
-            logger.error(f"Error fetching events from calendar {calendar_id}: {str(e)}", exc_info=True)
-            return None
+        return next_event
 
     def get_next_event_from_multiple_calendars(self, calendar_ids: list) -> Optional[Dict[str, Any]]:
         """
@@ -236,81 +430,8 @@ class GoogleCalendarService:
             List of event dictionaries sorted by start time
         """
         all_events = []
-
         for calendar_id in calendar_ids:
-            try:
-                # Shared with the subscription feed; see get_next_event().
-                feed, _ = CalendarFeedService().get(calendar_id)
-
-                if feed is None:
-                    logger.error(f"Failed to fetch calendar {calendar_id}")
-                    continue
-
-                # Parse iCal data
-                cal = Calendar.from_ical(feed)
-                now = django_timezone.now()
-
-                # Get all events for the next year
-                events = recurring_ical_events.of(cal).between(
-                    now,
-                    now + timedelta(days=365)
-                )
-
-                for component in events:
-                    if component.name == "VEVENT":
-                        dtstart = component.get('dtstart')
-                        if not dtstart:
-                            continue
-
-                        # Get start datetime
-                        start_dt = dtstart.dt
-
-                        # Convert to datetime if it's a date
-                        if isinstance(start_dt, datetime):
-                            if start_dt.tzinfo is None:
-                                start_dt = django_timezone.make_aware(start_dt)
-                        else:
-                            from datetime import date, time
-                            start_dt = django_timezone.make_aware(datetime.combine(start_dt, time.min))
-
-                        # Get end datetime
-                        dtend = component.get('dtend')
-                        end_dt = None
-                        if dtend:
-                            end_dt = dtend.dt
-                            if isinstance(end_dt, datetime):
-                                if end_dt.tzinfo is None:
-                                    end_dt = django_timezone.make_aware(end_dt)
-                            else:
-                                from datetime import time
-                                end_dt = django_timezone.make_aware(datetime.combine(end_dt, time.min))
-
-                        # Skip events longer than 12 hours
-                        if end_dt:
-                            duration = end_dt - start_dt
-                            if duration > timedelta(hours=12):
-                                continue
-
-                        # Show events that haven't ended yet
-                        event_time = end_dt if end_dt else start_dt
-                        if event_time > now:
-                            event_data = {
-                                'title': str(component.get('summary', 'Untitled')),
-                                'description': str(component.get('description', '')),
-                                'location': str(component.get('location', '')),
-                                'start': start_dt.isoformat(),
-                                'end': end_dt.isoformat() if end_dt else start_dt.isoformat(),
-                                'start_dt': start_dt,  # For sorting
-                                'calendar_id': calendar_id,
-                            }
-                            all_events.append(event_data)
-
-            except Exception as e:
-                logger.error(f"Error fetching events from calendar {calendar_id}: {str(e)}", exc_info=True)
-                continue
-
-        if not all_events:
-            return []
+            all_events.extend(self._upcoming(calendar_id, limit))
 
         # Sort by start time
         all_events.sort(key=lambda x: x['start_dt'])
@@ -323,3 +444,232 @@ class GoogleCalendarService:
             del event['start_dt']
 
         return result_events
+
+    def get_next_events_json(self, calendar_ids: list, limit: int = 3) -> EncodedEvents:
+        """
+        The same events as get_next_events_from_multiple_calendars, JSON-encoded
+
+        Each is the fragment stored with its row when the feed was indexed,
+        so answering a poll encodes nothing but the envelope around them.
+
+        Args:
+            calendar_ids: List of Google Calendar IDs
+            limit: Number of events to return (default: 3)
+
+        Returns:
+            EncodedEvents: the JSON objects, as strings, sorted by start
+            time, when the first of them ends, and until when that holds
+        """
+        rows = []
+        for calendar_id in calendar_ids:
+            rows.extend((row.start, calendar_id, row)
+                        for row in self._upcoming_rows(calendar_id, limit))
+        rows.sort(key=lambda item: item[0])
+        rows = rows[:limit]
+        changes_at = min((row.end for _, _, row in rows), default=None)
+
+        # A calendar with no check on record - its refresh just failed - is
+        # tried again by the next request; promise no longer than a check lasts.
+        store = OccurrenceStore()
+        now = django_timezone.now()
+        checks = [store.next_check(calendar_id)
+                  or now + timedelta(seconds=schedule.interval(calendar_id))
+                  for calendar_id in calendar_ids]
+        return EncodedEvents(
+            [row.as_json(calendar_id) for _, calendar_id, row in rows],
+            changes_at,
+            min([changes_at] + checks if changes_at else checks,
+                default=now + timedelta(seconds=schedule.MAX_SECONDS)),
+        )
+
+    def _upcoming(self, calendar_id: str, limit: int) -> List[Dict[str, Any]]:
+        """The next ``limit`` events of one calendar, each with a 'start_dt'."""
+        events = []
+        for occurrence in self._upcoming_rows(calendar_id, limit):
+            event = occurrence.as_event(calendar_id)
+            event['start_dt'] = occurrence.start  # For sorting
+            events.append(event)
+        return events
+
+    def _upcoming_rows(self, calendar_id: str, limit: int):
+        """The next ``limit`` stored occurrences of one calendar.
+
+        Read from the database. The rows come from the same cached copy of
+        the calendar the subscription feed hands out - one fetch per
+        calendar per interval for the whole site, every visitor and every
+        subscriber.
+        """
+        store = OccurrenceStore()
+        try:
+            store.refresh(calendar_id)
+        except Exception as e:
+            # Whatever is stored is still the best answer there is.
+            logger.error(f"Error refreshing calendar {calendar_id}: {str(e)}", exc_info=True)
+        return store.upcoming(calendar_id, limit)
+
+
+class EverywhereService:
+    """The next events across every city, for a national overview.
+
+    Each city's stored occurrences come out of an index already sorted by
+    start, so the overview is a k-way merge of k sorted streams: taking N
+    events costs O(N log k), however many events the calendars hold. Cities
+    due for a refresh have their feeds fetched and indexed side by side
+    rather than one after another - the wait is the slowest calendar, not
+    the sum of them.
+
+    The merged answer is kept until the first event in it ends, which is the
+    earliest moment it can change without a feed changing, and never past
+    the next fetch of any of the feeds - and comes with that moment, for the
+    caches in front to keep it as long.
+    """
+
+    MAX_WORKERS = 8
+
+    def get(self, cities: list, limit: int) -> Tuple[List[Dict[str, Any]], datetime]:
+        """(events, valid until)."""
+        # The stored version of each feed is part of the key, so a refresh
+        # that stores a new one is seen at once, not when this expires.
+        stored = cache.get_many([f'ics:stored:{c.calendar_id}' for c in cities])
+        key = 'everywhere:' + hashlib.sha256(repr(
+            [(c.slug, c.name, c.calendar_id) for c in cities] + [limit]
+            + sorted(stored.items())
+        ).encode()).hexdigest()[:16]
+        cached = cache.get(key)
+        if isinstance(cached, tuple):
+            return cached
+
+        store = OccurrenceStore()
+        # Fetching and parsing in threads; writing to the database here, on
+        # the request's own connection. A city another worker is refreshing
+        # is left to it.
+        claims = {}
+        for city in cities:
+            if not store.is_checked(city.calendar_id):
+                token = store.claim(city.calendar_id)
+                if token is not None:
+                    claims[city.calendar_id] = token
+        try:
+            for calendar_id, index in self._indexes(list(claims)).items():
+                if index is not None:
+                    store.store(calendar_id, index)
+        finally:
+            for calendar_id, token in claims.items():
+                store.release(calendar_id, token)
+            health.flush()
+
+        now = django_timezone.now()
+        streams = [
+            self._tagged(store.upcoming(city.calendar_id, limit), city)
+            for city in cities
+        ]
+        events = []
+        soonest_end = None
+        for occurrence, city in islice(
+                heapq.merge(*streams, key=lambda pair: pair[0].start), limit):
+            event = occurrence.as_event(city.calendar_id)
+            event['city'] = {'name': city.name, 'slug': city.slug}
+            events.append(event)
+            if soonest_end is None or occurrence.end < soonest_end:
+                soonest_end = occurrence.end
+
+        timeout = min((schedule.remaining(c.calendar_id) for c in cities),
+                      default=schedule.DEFAULT_SECONDS)
+        if soonest_end is not None:
+            timeout = max(1, min(timeout, int((soonest_end - now).total_seconds())))
+        answer = (events, now + timedelta(seconds=timeout))
+        cache.set(key, answer, timeout)
+        return answer
+
+    @staticmethod
+    def _tagged(occurrences, city):
+        for occurrence in occurrences:
+            yield occurrence, city
+
+    def _indexes(self, calendar_ids: List[str]) -> Dict[str, Optional[PackedIndex]]:
+        def index_of(calendar_id):
+            try:
+                return CalendarIndexService().get(calendar_id)
+            except Exception as e:
+                logger.error(f"Error indexing calendar {calendar_id}: {str(e)}", exc_info=True)
+                return None
+
+        if len(calendar_ids) < 2:
+            return {cid: index_of(cid) for cid in calendar_ids}
+        with ThreadPoolExecutor(max_workers=min(self.MAX_WORKERS, len(calendar_ids))) as pool:
+            return dict(zip(calendar_ids, pool.map(index_of, calendar_ids)))
+
+
+class RefreshReport(NamedTuple):
+    """How refreshing one city's feed went, for whoever asked for it."""
+    calendar_id: str
+    # Google answered with a calendar; False means the stored rows stand.
+    fetched: bool
+    # The stored rows were replaced: the feed, or the day, was new.
+    changed: bool
+    occurrences: int
+    fetch_ms: float
+    index_ms: float
+    error: str = ''
+
+
+class FeedRefreshService:
+    """Refetch cities' feeds now, not when their fresh copy expires.
+
+    Outside the fetch budget's say (events/schedule.py): a refresh someone
+    asked for is made even when the budget is spent, though it spends it.
+
+    For an organiser who has just fixed an event and wants to see it, from
+    the admin panel or ``manage.py refresh_feeds``. The feeds are fetched
+    and indexed side by side, as EverywhereService does; the rows are then
+    written here, one city per transaction, on the caller's connection.
+    Writing them purges what was answered from the old ones - nginx,
+    Cloudflare, the pages - exactly as a refresh on its own schedule would;
+    a feed found unchanged leaves all of that alone.
+    """
+
+    MAX_WORKERS = EverywhereService.MAX_WORKERS
+
+    def refresh(self, calendar_ids: List[str]) -> List[RefreshReport]:
+        if len(calendar_ids) < 2:
+            indexed = [self._index(cid) for cid in calendar_ids]
+        else:
+            with ThreadPoolExecutor(
+                    max_workers=min(self.MAX_WORKERS, len(calendar_ids))) as pool:
+                indexed = list(pool.map(self._index, calendar_ids))
+
+        store = OccurrenceStore()
+        reports = []
+        for calendar_id, (index, report) in zip(calendar_ids, indexed):
+            if index is not None:
+                before = cache.get(f'ics:stored:{calendar_id}')
+                try:
+                    store.store(calendar_id, index)
+                except Exception as e:
+                    logger.error(f"Error storing calendar {calendar_id}: {str(e)}", exc_info=True)
+                    report = report._replace(error=str(e))
+                else:
+                    report = report._replace(
+                        changed=cache.get(f'ics:stored:{calendar_id}') != before)
+            logger.info(f'Refreshed {calendar_id}: {report}')
+            reports.append(report)
+        health.flush()
+        return reports
+
+    def _index(self, calendar_id: str) -> Tuple[Optional[PackedIndex], RefreshReport]:
+        started = perf_counter()
+        feed, is_stale = CalendarFeedService().get(calendar_id, refetch=True)
+        fetched = perf_counter()
+        report = RefreshReport(calendar_id, feed is not None and not is_stale, False, 0,
+                               (fetched - started) * 1000, 0.0)
+        if not report.fetched:
+            return None, report._replace(error='Google did not answer with a calendar')
+        try:
+            # Reads the copy just fetched, which is now the fresh one.
+            index = CalendarIndexService().get(calendar_id)
+        except Exception as e:
+            logger.error(f"Error indexing calendar {calendar_id}: {str(e)}", exc_info=True)
+            return None, report._replace(error=str(e))
+        return index, report._replace(
+            occurrences=len(index) if index is not None else 0,
+            index_ms=(perf_counter() - fetched) * 1000)
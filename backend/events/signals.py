@@ -0,0 +1,31 @@
+"""What has to happen when a city changes, wherever the change came from."""
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import bus, edge
+from .models import City
+from .registry import bump_registry_version
+
+
+@receiver(pre_save, sender=City)
+def city_changing(sender, instance, **kwargs):
+    # A renamed slug leaves answers cached under the old subdomain, which
+    # the city as saved no longer names.
+    if instance.pk is not None:
+        old = City.objects.filter(pk=instance.pk).first()
+        instance._old_hosts = edge.hosts_for(old) if old is not None else []
+
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def city_changed(sender, instance, **kwargs):
+    bump_registry_version()
+    # Every host's /api/cities/ lists every city, so an edit to one is a
+    # purge of them all.
+    edge.purge_cities(list(City.objects.all()) + [instance],
+                      extra_hosts=getattr(instance, '_old_hosts', ()))
+    # Titles name the city and depend on how many there are: every page,
+    # on every host.
+    transaction.on_commit(lambda: bus.announce('pages', calendar_id=None))
@@ -0,0 +1,60 @@
+"""What starting the application costs, measured with ``python -X importtime``.
+
+The calendar stack - icalendar, recurring_ical_events and, through them,
+dateutil, plus requests for fetching - is most of what this app imports,
+and most processes never use it: `manage.py migrate`, `collectstatic`, the
+admin panel, a request for robots.txt. So nothing imports it at module level;
+the code paths that fetch or parse import it where they do so. This module
+measures that the arrangement holds, for the startup report
+(`manage.py startup_report`) and for the test that keeps it holding.
+
+The measurement runs in a fresh interpreter: this one has long since
+imported everything.
+"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, NamedTuple
+
+from django.conf import settings
+
+# Modules that only the paths that fetch or parse may import.
+HEAVY = ('icalendar', 'recurring_ical_events', 'dateutil', 'requests')
+
+# What importing westnfound.wsgi may cost, Django included, in milliseconds.
+# Measured at about 250 ms; the rest is headroom for a slow CI machine, not
+# room to grow into.
+WSGI_BUDGET_MS = 1000
+
+
+class ImportTime(NamedTuple):
+    self_us: int
+    cumulative_us: int
+
+
+def import_times(statement: str) -> Dict[str, ImportTime]:
+    """Every module ``statement`` imports, as ``-X importtime`` reports it."""
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'westnfound.settings')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=Path(settings.BASE_DIR), env=env,
+        capture_output=True, text=True, check=True,
+    )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue    # the header line
+        name = fields[2].strip()
+        times[name] = ImportTime(int(fields[0]), int(fields[1]))
+    return times
+
+
+def heavy_imported(times: Dict[str, ImportTime]) -> Dict[str, ImportTime]:
+    return {name: t for name, t in times.items() if name.split('.')[0] in HEAVY}
@@ -0,0 +1,201 @@
+"""Server-Sent Events: the next events of a city, pushed when they change.
+
+Every open page used to ask /api/next-events/ again every five minutes, and
+again whenever its tab came back into view, whether or not anything had
+changed - and the answer changes a few times a day. /api/stream/ answers
+once and then keeps the connection, sending a new answer only when there is
+one: when the refresher stores a new version of the city's feed, or when the
+first event listed ends and another takes its place.
+
+A connection is an open socket and nothing else for hours at a time, which a
+synchronous gunicorn worker cannot afford - four of them would be four
+visitors. So the stream is async, and it is served by its own ASGI process
+(the stream-prod service, uvicorn); under WSGI the view refuses with 501 and
+the page goes on polling as before.
+
+One watcher per city and limit per process, however many connections: it
+looks at the refresher's stored-version key in the shared cache every
+WATCH_SECONDS, refreshing the city when its feed is due exactly as a request
+to the API would, and reads the events again only when that key moved or the
+first event has ended. Listeners wait on it, not on the database.
+
+The protocol is the usual one: each message carries an id (a hash of its
+data), so a browser reconnecting sends Last-Event-ID and is not sent what it
+already has; a comment line every HEARTBEAT_SECONDS keeps proxies from
+closing an idle connection; ``retry`` tells the browser how long to wait
+before reconnecting. The data is what the page would have fetched, in the
+shape the page carries its initial data in: {"status": ..., "body": ...}.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Dict, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone as django_timezone
+from django.views import View
+
+logger = logging.getLogger(__name__)
+
+WATCH_SECONDS = 5
+HEARTBEAT_SECONDS = 25
+RETRY_MS = 5000
+
+
+class Channel:
+    """One city's next events in this process: one watcher, any number of listeners."""
+
+    def __init__(self, calendar_id: str, limit: int):
+        self.calendar_id = calendar_id
+        self.limit = limit
+        self.message: Optional[Tuple[str, str]] = None   # (id, data)
+        self.listeners = 0
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self) -> None:
+        self.listeners += 1
+        # None, or done, when the last listener has left: a channel kept by
+        # whoever got it before then starts watching again.
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._watch())
+
+    def unsubscribe(self) -> None:
+        self.listeners -= 1
+        if not self.listeners:
+            self._task.cancel()
+            self._task = None
+            key = (asyncio.get_running_loop(), self.calendar_id, self.limit)
+            # Not a newer channel that has taken this one's place.
+            if _channels.get(key) is self:
+                del _channels[key]
+
+    async def next_message(self, after: Optional[str], timeout: float):
+        """The current message if its id is not ``after``; else the next, or None."""
+        changed = self._changed
+        if self.message is not None and self.message[0] != after:
+            return self.message
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return self.message
+
+    async def _watch(self):
+        stored = object()
+        changes_at = None
+        while True:
+            try:
+                token = await sync_to_async(_refreshed)(self.calendar_id)
+                if token != stored or (changes_at is not None
+                                       and django_timezone.now() >= changes_at):
+                    stored = token
+                    message, changes_at = await sync_to_async(_message)(
+                        self.calendar_id, self.limit)
+                    if message != self.message:
+                        self.message = message
+                        changed, self._changed = self._changed, asyncio.Event()
+                        changed.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The last message stands; the next round may do better.
+                logger.error(f'Error watching {self.calendar_id}: {e}', exc_info=True)
+            await asyncio.sleep(WATCH_SECONDS)
+
+
+_channels: Dict[tuple, Channel] = {}
+
+
+def channel_for(calendar_id: str, limit: int) -> Channel:
+    """The channel for this city and limit, subscribed to; unsubscribe() when done."""
+    # Per event loop: asyncio's primitives belong to the loop that made them.
+    key = (asyncio.get_running_loop(), calendar_id, limit)
+    if key not in _channels:
+        _channels[key] = Channel(calendar_id, limit)
+    # At once, with nothing awaited in between: the last listener leaving
+    # meanwhile would take the channel out of the registry first.
+    _channels[key].subscribe()
+    return _channels[key]
+
+
+def _refreshed(calendar_id: str):
+    """Refresh the city if due, as a request would; the stored-version key."""
+    from .services import OccurrenceStore
+
+    try:
+        OccurrenceStore().refresh(calendar_id)
+    except Exception as e:
+        logger.error(f"Error refreshing calendar {calendar_id}: {str(e)}", exc_info=True)
+    return cache.get(f'ics:stored:{calendar_id}')
+
+
+def _message(calendar_id: str, limit: int):
+    """(id, data) of what /api/next-events/ answers now, and when that changes."""
+    from .services import GoogleCalendarService
+    from .views import NO_UPCOMING_EVENTS, envelope
+
+    events = GoogleCalendarService().get_next_events_json([calendar_id], limit)
+    if events.fragments:
+        data = f'{{"status": 200, "body": {envelope(events.fragments)}}}'
+    else:
+        data = json.dumps({'status': 404, 'body': NO_UPCOMING_EVENTS})
+    message_id = hashlib.sha256(data.encode()).hexdigest()[:16]
+    return (message_id, data), events.changes_at
+
+
+async def _events(calendar_id: str, limit: int, last_id: Optional[str]):
+    channel = channel_for(calendar_id, limit)
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        while True:
+            message = await channel.next_message(last_id, HEARTBEAT_SECONDS)
+            if message is None:
+                yield ': heartbeat\n\n'
+                continue
+            last_id, data = message
+            yield f'id: {last_id}\nevent: events\ndata: {data}\n\n'
+    finally:
+        channel.unsubscribe()
+
+
+class EventStreamView(View):
+    """GET /api/stream/?limit=3 - the next events of the request's city, as they change."""
+
+    async def get(self, request):
+        from django.core.handlers.asgi import ASGIRequest
+
+        from .views import _no_city_response
+
+        city = getattr(request, 'city', None)
+        if city is None:
+            return _no_city_response(request)
+        if not isinstance(request, ASGIRequest):
+            # Under WSGI an endless response holds a worker for good.
+            return JsonResponse({
+                'error': 'Streaming unavailable',
+                'message': 'This server answers /api/next-events/ only'
+            }, status=501)
+
+        from . import schedule
+
+        await sync_to_async(schedule.wanted)(city.calendar_id)
+        try:
+            limit = int(request.GET.get('limit', 3))
+            if limit < 1 or limit > 10:
+                limit = 3
+        except ValueError:
+            limit = 3
+
+        response = StreamingHttpResponse(
+            _events(city.calendar_id, limit, request.headers.get('Last-Event-ID') or None),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        # Or nginx would hold the messages back to fill its buffer.
+        response['X-Accel-Buffering'] = 'no'
+        return response
@@ -1,3 +1,4 @@
+import json
 from unittest.mock import Mock, patch
 
 from datetime import timedelta
@@ -9,9 +10,10 @@ from django.core.exceptions import ValidationError
 from django.test import TestCase, override_settings
 from django.utils import timezone
 
+from . import schedule
 from .middleware import resolve_city
 from .models import City
-from .services import GoogleCalendarService
+from .services import EncodedEvents, GoogleCalendarService
 from .slugs import to_slug
 
 
@@ -153,11 +155,9 @@ class ApiScopingTests(TestCase):
 
         def fake(_service, calendar_ids, limit=3):
             seen.append(list(calendar_ids))
-            return [{'title': 'x', 'start': '2026-09-05T21:00:00+02:00'}]
+            return EncodedEvents(['{"title": "x", "start": "2026-09-05T21:00:00+02:00"}'], None)
 
-        with patch.object(
-            GoogleCalendarService, 'get_next_events_from_multiple_calendars', fake
-        ):
+        with patch.object(GoogleCalendarService, 'get_next_events_json', fake):
             response = self.client.get('/api/next-events/', HTTP_HOST=host)
         return response, seen
 
@@ -197,6 +197,14 @@ ICS = (
 ).encode()
 
 
+# Each test class's own caches, in memory: the shared one, and the throttle's.
+LOCMEM = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'throttle': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                 'LOCATION': 'throttle'},
+}
+
+
 def _google_says(body=ICS, status=200):
     response = Mock()
     response.status_code = status
@@ -204,7 +212,7 @@ def _google_says(body=ICS, status=200):
     return response
 
 
-@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+@override_settings(CACHES=LOCMEM)
 class CalendarFeedTests(TestCase):
     """The feed people subscribe to. These paths used to redirect to Google."""
 
@@ -222,7 +230,7 @@ class CalendarFeedTests(TestCase):
     def test_apex_serves_the_default_city_calendar(self):
         for path in self.PATHS:
             cache.clear()
-            with patch('events.services.requests.get', return_value=_google_says()) as get:
+            with patch('requests.get', return_value=_google_says()) as get:
                 response = self.client.get(path, HTTP_HOST='gdzienawesta.com')
             self.assertEqual(response.status_code, 200, path)
             self.assertEqual(response.content, ICS, path)
@@ -232,7 +240,7 @@ class CalendarFeedTests(TestCase):
             self.assertIn('warsawwestiesdance%40gmail.com', get.call_args[0][0], path)
 
     def test_subdomain_serves_its_own_calendar(self):
-        with patch('events.services.requests.get', return_value=_google_says()) as get:
+        with patch('requests.get', return_value=_google_says()) as get:
             response = self.client.get('/kalendarz.ics', HTTP_HOST='lodz.gdzienawesta.com')
         self.assertEqual(response.status_code, 200)
         self.assertIn('lodz%40example.com', get.call_args[0][0])
@@ -245,14 +253,14 @@ class CalendarFeedTests(TestCase):
 
     def test_subscribers_share_one_fetch(self):
         """Every subscribed calendar app polls on its own; Google sees one."""
-        with patch('events.services.requests.get', return_value=_google_says()) as get:
+        with patch('requests.get', return_value=_google_says()) as get:
             for _ in range(5):
                 self.client.get('/kalendarz.ics', HTTP_HOST='gdzienawesta.com')
         self.assertEqual(get.call_count, 1)
 
     def test_the_site_and_the_feed_share_one_fetch(self):
         """The page used to go to Google on every single visit."""
-        with patch('events.services.requests.get', return_value=_google_says()) as get:
+        with patch('requests.get', return_value=_google_says()) as get:
             events = self.client.get('/api/next-events/', HTTP_HOST='gdzienawesta.com')
             feed = self.client.get('/kalendarz.ics', HTTP_HOST='gdzienawesta.com')
 
@@ -262,17 +270,17 @@ class CalendarFeedTests(TestCase):
         self.assertEqual(feed.content, ICS)
 
     def test_each_city_is_cached_separately(self):
-        with patch('events.services.requests.get', return_value=_google_says()) as get:
+        with patch('requests.get', return_value=_google_says()) as get:
             self.client.get('/kalendarz.ics', HTTP_HOST='gdzienawesta.com')
             self.client.get('/kalendarz.ics', HTTP_HOST='lodz.gdzienawesta.com')
         self.assertEqual(get.call_count, 2)
 
     def test_last_good_copy_answers_when_google_is_down(self):
-        with patch('events.services.requests.get', return_value=_google_says()):
+        with patch('requests.get', return_value=_google_says()):
             self.client.get('/kalendarz.ics', HTTP_HOST='gdzienawesta.com')
 
         cache.delete('ics:fresh:warsawwestiesdance@gmail.com')
-        with patch('events.services.requests.get', side_effect=requests.Timeout()):
+        with patch('requests.get', side_effect=requests.Timeout()):
             response = self.client.get('/kalendarz.ics', HTTP_HOST='gdzienawesta.com')
 
         self.assertEqual(response.status_code, 200)
@@ -281,17 +289,17 @@ class CalendarFeedTests(TestCase):
 
     def test_no_copy_at_all_is_an_error_not_an_empty_calendar(self):
         """An empty calendar reads as "everything was cancelled" to a subscriber."""
-        with patch('events.services.requests.get', side_effect=requests.Timeout()):
+        with patch('requests.get', side_effect=requests.Timeout()):
             response = self.client.get('/kalendarz.ics', HTTP_HOST='gdzienawesta.com')
         self.assertEqual(response.status_code, 502)
 
     def test_a_login_page_is_neither_served_nor_cached(self):
         """A calendar Google stopped publishing answers 200 with HTML."""
-        with patch('events.services.requests.get', return_value=_google_says(b'<html>Sign in')):
+        with patch('requests.get', return_value=_google_says(b'<html>Sign in')):
             response = self.client.get('/kalendarz.ics', HTTP_HOST='gdzienawesta.com')
         self.assertEqual(response.status_code, 502)
 
-        with patch('events.services.requests.get', return_value=_google_says()):
+        with patch('requests.get', return_value=_google_says()):
             response = self.client.get('/kalendarz.ics', HTTP_HOST='gdzienawesta.com')
         self.assertEqual(response.content, ICS)
 
@@ -551,6 +559,170 @@ class DocumentTests(TestCase):
         title, _, _ = self._head('/', 'gdansk.gdzienawesta.com')
         self.assertEqual(title, 'Gdzie na Westa?')
 
+    def _initial(self, path, host):
+        import json
+        import re
+        _, _, body = self._head(path, host)
+        return json.loads(re.search(
+            r'<script id="initial-data" type="application/json">(.*?)</script>',
+            body, re.S).group(1))
+
+    def test_the_first_api_answers_come_with_the_page(self):
+        from events.models import Occurrence
+
+        lodz = City.objects.get(slug='lodz')
+        start = timezone.now() + timedelta(days=2)
+        Occurrence.objects.create(city=lodz, uid='a', start=start,
+                                  end=start + timedelta(hours=2), title='Social')
+        with patch('requests.get', side_effect=AssertionError('no fetching for a page')):
+            data = self._initial('/', 'lodz.gdzienawesta.com')
+        self.assertEqual(data['/api/cities/'], {
+            'status': 200,
+            'body': self.client.get('/api/cities/', HTTP_HOST='lodz.gdzienawesta.com').json()})
+        events = data['/api/next-events/?limit=3']
+        self.assertEqual(events['status'], 200)
+        self.assertEqual([e['title'] for e in events['body']['events']], ['Social'])
+
+    def test_the_calendar_page_brings_its_calendar(self):
+        data = self._initial('/kalendarz', 'lodz.gdzienawesta.com')
+        self.assertEqual(data['/api/calendar/'], {
+            'status': 200,
+            'body': self.client.get('/api/calendar/', HTTP_HOST='lodz.gdzienawesta.com').json()})
+
+    def test_an_unknown_city_brings_the_apis_404(self):
+        data = self._initial('/kalendarz', 'gdansk.gdzienawesta.com')
+        self.assertEqual(data['/api/calendar/']['status'], 404)
+        self.assertEqual(data['/api/calendar/']['body']['error'], 'Unknown city')
+
+    def test_the_stamped_assets_are_announced_before_the_page(self):
+        response = self.client.get('/', HTTP_HOST='gdzienawesta.com')
+        self.assertEqual(response['Link'],
+                         '<app.js?v=abc>; rel=preload; as=script, '
+                         '</api/next-events/?limit=3>; rel=preload; as=fetch; crossorigin')
+
+    def test_the_header_follows_the_stamps(self):
+        page = DocumentTests.PAGE.replace(
+            '</head>', '<link rel="stylesheet" href="styles.css?v=s1">\n'
+                       '<script defer src="https://cdn.example.com/alpine.js"></script>\n</head>'
+        ).replace('app.js?v=abc', 'calendar.js?v=c2')
+        (self.dir / 'calendar.html').write_text(page, encoding='utf-8')
+        response = self.client.get('/kalendarz', HTTP_HOST='gdzienawesta.com')
+        self.assertEqual(response['Link'],
+                         '<styles.css?v=s1>; rel=preload; as=style, '
+                         '<https://cdn.example.com>; rel=preconnect, '
+                         '<calendar.js?v=c2>; rel=preload; as=script')
+
+    def test_a_city_name_cannot_close_the_data_block(self):
+        City.objects.filter(slug='lodz').update(name='Łódź</script><script>alert(1)')
+        _, _, body = self._head('/', 'lodz.gdzienawesta.com')
+        self.assertNotIn('</script><script>alert(1)', body)
+
+
+@override_settings(CACHES=LOCMEM)
+class PrerenderTests(TestCase):
+    """The pages on disk for nginx are the pages Django would have answered."""
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        from events import documents
+
+        cache.clear()
+        self.frontend = Path(tempfile.mkdtemp())
+        self.pages = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.frontend)
+        self.addCleanup(shutil.rmtree, self.pages)
+        for name in ('index.html', 'calendar.html'):
+            (self.frontend / name).write_text(DocumentTests.PAGE, encoding='utf-8')
+        old_dir = documents.FRONTEND_DIR
+        documents.FRONTEND_DIR = self.frontend
+        documents._cache.clear()
+        self.addCleanup(setattr, documents, 'FRONTEND_DIR', old_dir)
+        self.addCleanup(documents._cache.clear)
+
+        self.warsaw = City.objects.create(name='Warszawa', slug='warszawa',
+                                          calendar_id='w@example.com', is_default=True)
+        self.lodz = City.objects.create(name='Łódź', slug='lodz', calendar_id='l@example.com')
+
+    def _render(self):
+        from events.prerender import render_pages
+        with override_settings(CITY_BASE_DOMAINS=['gdzienawesta.com']):
+            return render_pages(self.pages)
+
+    def test_each_page_is_what_django_answers_for_its_host(self):
+        self._render()
+        for host in ('gdzienawesta.com', 'lodz.gdzienawesta.com'):
+            for path, name in (('/', 'index.html'), ('/kalendarz', 'kalendarz.html')):
+                self.assertEqual((self.pages / host / name).read_bytes(),
+                                 self.client.get(path, HTTP_HOST=host).content, (host, path))
+
+    def test_hosts_that_redirect_or_name_no_city_are_left_to_django(self):
+        self._render()
+        self.assertEqual(sorted(p.name for p in self.pages.iterdir() if p.is_dir()),
+                         ['gdzienawesta.com', 'lodz.gdzienawesta.com'])
+
+    def test_a_city_that_goes_away_stops_being_served_from_disk(self):
+        self._render()
+        City.objects.filter(pk=self.lodz.pk).update(is_active=False)
+        counts = self._render()
+        self.assertFalse((self.pages / 'lodz.gdzienawesta.com').exists())
+        self.assertEqual(counts['removed'], 1)
+        # And the apex no longer names its city: one city left.
+        self.assertIn('<title>Gdzie na Westa?</title>',
+                      (self.pages / 'gdzienawesta.com' / 'index.html').read_text())
+
+    def test_unchanged_pages_are_not_written_again(self):
+        self._render()
+        self.assertEqual(self._render(), {'written': 0, 'unchanged': 4, 'removed': 0})
+
+    def test_nginx_is_given_the_same_link_headers(self):
+        self._render()
+        links = (self.pages / 'links.conf').read_text()
+        home = self.client.get('/', HTTP_HOST='gdzienawesta.com')['Link']
+        calendar = self.client.get('/kalendarz', HTTP_HOST='gdzienawesta.com')['Link']
+        self.assertIn(f"set $preload_index '{home}';", links)
+        self.assertIn(f"set $preload_kalendarz '{calendar}';", links)
+
+    def test_nginx_starts_without_the_links(self):
+        import re
+        from events import documents
+
+        path = documents.FRONTEND_DIR / 'nginx.prod.conf'
+        if not path.exists():
+            self.skipTest(f'nginx.prod.conf not mounted at {path}')
+        conf = path.read_text()
+        # Included by a wildcard, which may match nothing, after a default
+        # for every variable render_pages sets.
+        [include] = re.findall(r'include /usr/share/nginx/pages/(\S+);', conf)
+        self.assertIn('*', include)
+        self._render()
+        written = re.findall(r'set (\$\w+) ', (self.pages / 'links.conf').read_text())
+        self.assertTrue(written)
+        for variable in written:
+            self.assertLess(conf.index(f"set {variable} '';"), conf.index('include /usr/share'))
+
+    def test_a_new_feed_renders_its_citys_pages(self):
+        from events.services import OccurrenceStore
+
+        with override_settings(PAGES_DIR=str(self.pages),
+                               CITY_BASE_DOMAINS=['gdzienawesta.com']):
+            self._render()
+            apex = (self.pages / 'gdzienawesta.com' / 'index.html').read_text(encoding='utf-8')
+            with patch('requests.get', return_value=_google_says(_feed(WEEKLY))):
+                OccurrenceStore().refresh('w@example.com')
+        page = (self.pages / 'gdzienawesta.com' / 'index.html').read_text(encoding='utf-8')
+        self.assertNotEqual(page, apex)
+        self.assertIn('Social', page)
+
+    def test_saving_a_city_renders_the_pages(self):
+        with override_settings(PAGES_DIR=str(self.pages),
+                               CITY_BASE_DOMAINS=['gdzienawesta.com']):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.lodz.name = 'Łódź Bałuty'
+                self.lodz.save()
+        self.assertIn('Łódź Bałuty', (self.pages / 'lodz.gdzienawesta.com' / 'index.html')
+                      .read_text(encoding='utf-8'))
+
 
 class TranslationParityTests(TestCase):
     """The Python strings must say what translations.js says.
@@ -717,3 +889,1608 @@ class FeedUrlTests(TestCase):
         with override_settings(CITY_BASE_DOMAINS=['lvh.me']):
             self.assertEqual(self._feed('lvh.me'),
                              'http://warszawa.lvh.me/kalendarz.ics')
+
+
+def _feed(*events, stamp='20260101T000000Z'):
+    """A Google-shaped feed: X-WR-TIMEZONE, a VTIMEZONE, then the events."""
+    body = [
+        'BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//Google Inc//Google Calendar 70.9054//EN',
+        'X-WR-TIMEZONE:Europe/Warsaw',
+        'BEGIN:VTIMEZONE', 'TZID:Europe/Warsaw',
+        'BEGIN:DAYLIGHT', 'TZOFFSETFROM:+0100', 'TZOFFSETTO:+0200', 'TZNAME:CEST',
+        'DTSTART:19700329T020000', 'RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU', 'END:DAYLIGHT',
+        'BEGIN:STANDARD', 'TZOFFSETFROM:+0200', 'TZOFFSETTO:+0100', 'TZNAME:CET',
+        'DTSTART:19701025T030000', 'RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU', 'END:STANDARD',
+        'END:VTIMEZONE',
+    ]
+    for event in events:
+        body += ['BEGIN:VEVENT', f'DTSTAMP:{stamp}', *event, 'END:VEVENT']
+    body.append('END:VCALENDAR')
+    return ('\r\n'.join(body) + '\r\n').encode()
+
+
+def _local(days, hour):
+    start = timezone.localtime(timezone.now() + timedelta(days=days))
+    return start.strftime('%Y%m%d') + f'T{hour:02d}0000'
+
+
+WEEKLY = [
+    'UID:social@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(-20, 21)}',
+    f'DTEND;TZID=Europe/Warsaw:{_local(-20, 23)}', 'RRULE:FREQ=WEEKLY',
+    'SEQUENCE:0', 'LAST-MODIFIED:20260101T000000Z', 'SUMMARY:Social',
+]
+WORKSHOP = [
+    'UID:workshop@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(3, 12)}',
+    f'DTEND;TZID=Europe/Warsaw:{_local(3, 16)}',
+    'SEQUENCE:0', 'LAST-MODIFIED:20260101T000000Z', 'SUMMARY:Warsztaty',
+]
+
+
+class IncrementalIndexTests(TestCase):
+    """Only the series that changed are expanded again - events/indexing.py."""
+
+    def _build(self, feed, previous=None):
+        from events.indexing import build_index, feed_version
+        return build_index('w@example.com', feed, feed_version(feed),
+                           timezone.now(), previous)
+
+    def _expanded(self, feed, previous):
+        # Every series not carried over from ``previous`` as it was.
+        index = self._build(feed, previous)
+        seen = [uid for uid, series in index.series.items()
+                if series is not previous.series.get(uid)]
+        return index, seen
+
+    def test_an_edited_event_is_the_only_one_expanded_again(self):
+        before = self._build(_feed(WEEKLY, WORKSHOP))
+        moved = [line.replace('T12', 'T13').replace('SEQUENCE:0', 'SEQUENCE:1')
+                 .replace('20260101T000000Z', '20260102T000000Z') for line in WORKSHOP]
+
+        after, seen = self._expanded(_feed(WEEKLY, moved), before)
+
+        self.assertEqual(seen, ['workshop@google.com'])
+        self.assertIs(after.series['social@google.com'],
+                      before.series['social@google.com'])
+        self.assertEqual(after.occurrences, self._build(_feed(WEEKLY, moved)).occurrences)
+
+    def test_a_new_export_of_the_same_calendar_reuses_everything(self):
+        # Google stamps DTSTAMP with the time of the export.
+        before = self._build(_feed(WEEKLY, WORKSHOP))
+        _, seen = self._expanded(_feed(WEEKLY, WORKSHOP, stamp='20260301T000000Z'), before)
+        self.assertEqual(seen, [])
+
+    def test_an_overridden_occurrence_changes_its_series(self):
+        before = self._build(_feed(WEEKLY, WORKSHOP))
+        moved = [
+            'UID:social@google.com', f'RECURRENCE-ID;TZID=Europe/Warsaw:{_local(1, 21)}',
+            f'DTSTART;TZID=Europe/Warsaw:{_local(1, 20)}',
+            f'DTEND;TZID=Europe/Warsaw:{_local(1, 22)}',
+            'SEQUENCE:1', 'LAST-MODIFIED:20260102T000000Z', 'SUMMARY:Social (wcześniej)',
+        ]
+        after, seen = self._expanded(_feed(WEEKLY, moved, WORKSHOP), before)
+        self.assertEqual(set(seen), {'social@google.com'})
+        self.assertIs(after.series['workshop@google.com'],
+                      before.series['workshop@google.com'])
+
+    def test_the_index_agrees_with_expanding_the_whole_calendar(self):
+        import recurring_ical_events
+        from icalendar import Calendar
+
+        feed = _feed(WEEKLY, WORKSHOP)
+        index = self._build(feed)
+        now = timezone.now()
+        whole = recurring_ical_events.of(Calendar.from_ical(feed)).between(
+            now, now + timedelta(days=365))
+        self.assertEqual(
+            sorted((o.start, o.title) for o in index.upcoming(now)),
+            sorted((c['DTSTART'].dt, str(c['SUMMARY'])) for c in whole
+                   if c['DTEND'].dt > now),
+        )
+
+
+@override_settings(CACHES=LOCMEM)
+class TrimmedFeedTests(TestCase):
+    """?window= hands a phone the events that still matter, not the archive."""
+
+    OLD_PARTY = [
+        'UID:old@google.com', 'DTSTART:20200105T200000Z', 'DTEND:20200105T230000Z',
+        'SUMMARY:Sylwester 2019',
+    ]
+    ENDED_SERIES = [
+        'UID:ended@google.com', 'DTSTART;TZID=Europe/Warsaw:20210104T190000',
+        'DTEND;TZID=Europe/Warsaw:20210104T210000',
+        'RRULE:FREQ=WEEKLY;UNTIL=20220101T000000Z', 'SUMMARY:Kurs 2021',
+    ]
+
+    def setUp(self):
+        cache.clear()
+        City.objects.create(name='Warszawa', calendar_id='w@example.com', is_default=True)
+        self.feed = _feed(self.OLD_PARTY, self.ENDED_SERIES, WEEKLY, WORKSHOP)
+
+    def _get(self, path):
+        with patch('requests.get', return_value=_google_says(self.feed)):
+            return self.client.get(path, HTTP_HOST='gdzienawesta.com')
+
+    def test_finished_events_are_left_out(self):
+        body = self._get('/kalendarz.ics?window=30').content
+        self.assertNotIn(b'old@google.com', body)
+        self.assertNotIn(b'ended@google.com', body)
+
+    def test_a_series_that_is_still_running_stays_whole(self):
+        # Its first occurrence is weeks old; the RRULE still reaches today.
+        body = self._get('/kalendarz.ics?window=7').content
+        self.assertIn(b'UID:social@google.com\r\nDTSTART;TZID=Europe/Warsaw', body)
+        self.assertIn(b'RRULE:FREQ=WEEKLY', body)
+        self.assertIn(b'workshop@google.com', body)
+
+    def test_the_timezones_the_events_need_come_along(self):
+        body = self._get('/kalendarz.ics?window=30').content
+        self.assertIn(b'BEGIN:VTIMEZONE\r\nTZID:Europe/Warsaw', body)
+        self.assertTrue(body.startswith(b'BEGIN:VCALENDAR'))
+        self.assertTrue(body.endswith(b'END:VCALENDAR\r\n'))
+
+    def test_the_kept_events_are_googles_own_bytes(self):
+        body = self._get('/kalendarz.ics?window=30').content
+        start = self.feed.index(b'BEGIN:VEVENT\r\nDTSTAMP:20260101T000000Z\r\nUID:workshop')
+        block = self.feed[start:self.feed.index(b'END:VEVENT\r\n', start)]
+        self.assertIn(block, body)
+
+    def test_more_history_when_asked_for(self):
+        body = self._get('/kalendarz.ics?window=100000').content
+        self.assertNotIn(b'old@google.com', body)
+        with patch('events.services.TrimmedFeedService.HISTORY_DAYS', (0, 365 * 10)):
+            body = self._get('/kalendarz.ics?window=3650').content
+        self.assertIn(b'old@google.com', body)
+
+    def test_without_the_parameter_nothing_changes(self):
+        self.assertEqual(self._get('/kalendarz.ics').content, self.feed)
+
+    def test_cut_once_per_copy_of_the_feed(self):
+        from events import services
+        with patch.object(services, 'trim_feed', wraps=services.trim_feed) as trim:
+            for _ in range(3):
+                self._get('/kalendarz.ics?window=30')
+        self.assertEqual(trim.call_count, 1)
+
+    def test_window_is_snapped_to_the_ones_we_keep(self):
+        from events.services import TrimmedFeedService
+        self.assertEqual(TrimmedFeedService.history_days('10'), 30)
+        self.assertEqual(TrimmedFeedService.history_days('0'), 0)
+        self.assertEqual(TrimmedFeedService.history_days(''), 30)
+        self.assertEqual(TrimmedFeedService.history_days('9999'), 365)
+
+
+def _one_off(uid, days, hour, title):
+    return [f'UID:{uid}', f'DTSTART;TZID=Europe/Warsaw:{_local(days, hour)}',
+            f'DTEND;TZID=Europe/Warsaw:{_local(days, hour + 2)}', f'SUMMARY:{title}']
+
+
+@override_settings(CACHES=LOCMEM,
+                   CITY_BASE_DOMAINS=['gdzienawesta.com'])
+class EverywhereTests(TestCase):
+    """/api/everywhere/: every city's next events, merged by start."""
+
+    FEEDS = {
+        'w@example.com': _feed(_one_off('w1', 1, 20, 'Warszawa 1'),
+                               _one_off('w2', 4, 20, 'Warszawa 2')),
+        'l@example.com': _feed(_one_off('l1', 2, 19, 'Łódź 1'),
+                               _one_off('l2', 3, 19, 'Łódź 2')),
+    }
+
+    def setUp(self):
+        cache.clear()
+        City.objects.create(name='Warszawa', slug='warszawa',
+                            calendar_id='w@example.com', is_default=True)
+        City.objects.create(name='Łódź', slug='lodz', calendar_id='l@example.com')
+
+    def _google(self, url, timeout):
+        for calendar_id, feed in self.FEEDS.items():
+            if calendar_id.replace('@', '%40') in url:
+                return _google_says(feed)
+        return _google_says(status=404)
+
+    def _get(self, query=''):
+        with patch('requests.get', side_effect=self._google) as get:
+            response = self.client.get(f'/api/everywhere/{query}',
+                                       HTTP_HOST='lodz.gdzienawesta.com')
+        return response, get
+
+    def test_events_from_every_city_are_merged_by_start(self):
+        response, get = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([e['title'] for e in response.json()['events']],
+                         ['Warszawa 1', 'Łódź 1', 'Łódź 2', 'Warszawa 2'])
+        self.assertEqual(get.call_count, 2)
+
+    def test_each_event_says_which_city_it_is_in(self):
+        events = self._get()[0].json()['events']
+        self.assertEqual(events[0]['city'], {'name': 'Warszawa', 'slug': 'warszawa',
+                                             'url': '//gdzienawesta.com'})
+        self.assertEqual(events[1]['city']['url'], '//lodz.gdzienawesta.com')
+
+    def test_limit(self):
+        data = self._get('?limit=2')[0].json()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(self._get('?limit=500')[0].json()['count'], 4)
+
+    def test_the_merged_answer_is_kept(self):
+        self._get()
+        from events import services
+        with patch.object(services.CalendarIndexService, 'get') as index:
+            response, _ = self._get()
+        index.assert_not_called()
+        self.assertEqual(response.json()['count'], 4)
+
+    def test_caches_keep_it_per_host_until_it_can_change(self):
+        response, _ = self._get()
+        self.assertIn('Host', response['Vary'])
+        ages = dict(part.split('=') for part in response['Cache-Control'].split(', ')
+                    if '=' in part)
+        self.assertEqual(ages['max-age'], '60')
+        self.assertEqual(ages['stale-while-revalidate'], '0')
+        # Never past the next look at either feed.
+        self.assertLessEqual(int(ages['s-maxage']), schedule.DEFAULT_SECONDS)
+        self.assertGreater(int(ages['s-maxage']), schedule.DEFAULT_SECONDS - 5)
+        # And the same from the kept answer.
+        again, _ = self._get()
+        self.assertIn('s-maxage', again['Cache-Control'])
+
+    def test_a_city_that_fails_leaves_the_others_standing(self):
+        self.FEEDS = {'w@example.com': self.FEEDS['w@example.com']}
+        titles = [e['title'] for e in self._get()[0].json()['events']]
+        self.assertEqual(titles, ['Warszawa 1', 'Warszawa 2'])
+
+
+@override_settings(CACHES=LOCMEM,
+                   CITY_BASE_DOMAINS=['gdzienawesta.com'])
+class PrerenderedSeoTests(TestCase):
+    """robots.txt and the sitemap are rendered once per host and city set."""
+
+    def setUp(self):
+        cache.clear()
+        City.objects.create(name='Warszawa', slug='warszawa',
+                            calendar_id='w@example.com', is_default=True)
+        self.lodz = City.objects.create(name='Łódź', slug='lodz', calendar_id='l@example.com')
+
+    def test_a_crawler_burst_asks_the_database_once(self):
+        self.client.get('/sitemap.xml', HTTP_HOST='gdzienawesta.com')
+        # What is left per request is resolving the city from the Host header.
+        with self.assertNumQueries(5):
+            for _ in range(5):
+                response = self.client.get('/sitemap.xml', HTTP_HOST='gdzienawesta.com')
+        self.assertIn(b'lodz.gdzienawesta.com', response.content)
+
+    def test_a_new_city_shows_up_at_once(self):
+        self.client.get('/sitemap.xml', HTTP_HOST='gdzienawesta.com')
+        City.objects.create(name='Kraków', slug='krakow', calendar_id='k@example.com')
+        body = self.client.get('/sitemap.xml', HTTP_HOST='gdzienawesta.com').content
+        self.assertIn(b'krakow.gdzienawesta.com', body)
+
+    def test_a_deleted_city_is_gone_at_once(self):
+        self.client.get('/sitemap.xml', HTTP_HOST='gdzienawesta.com')
+        self.lodz.delete()
+        body = self.client.get('/sitemap.xml', HTTP_HOST='gdzienawesta.com').content
+        self.assertNotIn(b'lodz.gdzienawesta.com', body)
+
+    def test_a_crawler_that_has_it_gets_a_304(self):
+        for path in ('/sitemap.xml', '/robots.txt'):
+            first = self.client.get(path, HTTP_HOST='lodz.gdzienawesta.com')
+            again = self.client.get(path, HTTP_HOST='lodz.gdzienawesta.com',
+                                    HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual(again.status_code, 304, path)
+            self.assertEqual(again.content, b'', path)
+
+    def test_each_host_keeps_its_own(self):
+        apex = self.client.get('/robots.txt', HTTP_HOST='gdzienawesta.com').content
+        lodz = self.client.get('/robots.txt', HTTP_HOST='lodz.gdzienawesta.com').content
+        self.assertNotEqual(apex, lodz)
+
+    def test_hosts_naming_no_city_are_not_kept(self):
+        self.client.get('/robots.txt', HTTP_HOST='gdansk.gdzienawesta.com')
+        self.client.get('/robots.txt', HTTP_HOST='example.org')
+        self.assertFalse([k for k in cache._cache if 'gdansk' in k or 'example.org' in k])
+
+
+@override_settings(CACHES=LOCMEM)
+class OccurrenceStoreTests(TestCase):
+    """The endpoints answer from the Occurrence table the refresher fills."""
+
+    def setUp(self):
+        cache.clear()
+        self.warsaw = City.objects.create(name='Warszawa', calendar_id='w@example.com',
+                                          is_default=True)
+
+    def _next(self, feed=None, **google):
+        if feed is not None:
+            google = {'return_value': _google_says(feed)}
+        with patch('requests.get', **google):
+            return self.client.get('/api/next-events/?limit=10', HTTP_HOST='gdzienawesta.com')
+
+    def test_a_refresh_stores_every_occurrence_of_the_city(self):
+        from events.models import Occurrence
+        self._next(_feed(WEEKLY, WORKSHOP))
+        stored = Occurrence.objects.filter(city=self.warsaw)
+        self.assertEqual(stored.filter(uid='workshop@google.com').count(), 1)
+        self.assertGreater(stored.filter(uid='social@google.com').count(), 50)
+        self.assertEqual(len({o.feed_version for o in stored}), 1)
+
+    def test_the_answer_survives_a_lost_cache_and_google_being_down(self):
+        self._next(_feed(WORKSHOP))
+        cache.clear()
+        response = self._next(side_effect=requests.Timeout())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['events'][0]['title'], 'Warsztaty')
+
+    def test_a_checked_city_is_answered_without_parsing_anything(self):
+        self._next(_feed(WORKSHOP))
+        with patch('events.services.build_index', side_effect=AssertionError), \
+                patch('events.services.CalendarFeedService.get', side_effect=AssertionError):
+            response = self._next(_feed(WORKSHOP))
+        self.assertEqual(response.json()['events'][0]['title'], 'Warsztaty')
+
+    def test_a_new_feed_replaces_the_citys_rows(self):
+        from events.models import Occurrence
+        self._next(_feed(WEEKLY, WORKSHOP))
+        cache.delete('ics:fresh:w@example.com')
+        cache.delete('ics:checked:w@example.com')
+        response = self._next(_feed(WORKSHOP))
+        self.assertEqual(set(Occurrence.objects.values_list('uid', flat=True)),
+                         {'workshop@google.com'})
+        self.assertEqual([e['title'] for e in response.json()['events']], ['Warsztaty'])
+
+    def test_other_cities_are_left_alone(self):
+        from events.models import Occurrence
+        lodz = City.objects.create(name='Łódź', calendar_id='l@example.com')
+        Occurrence.objects.create(city=lodz, uid='x', title='Łódź',
+                                  start=timezone.now() + timedelta(days=1),
+                                  end=timezone.now() + timedelta(days=1, hours=2),
+                                  feed_version='x')
+        self._next(_feed(WORKSHOP))
+        self.assertEqual(Occurrence.objects.filter(city=lodz).count(), 1)
+
+    def test_times_come_back_in_the_sites_timezone(self):
+        event = self._next(_feed(WORKSHOP)).json()['events'][0]
+        self.assertRegex(event['start'], r'T12:00:00\+0[12]:00$')
+
+
+@override_settings(CACHES=LOCMEM)
+class EncodedEventTests(TestCase):
+    """Responses are assembled from fragments encoded when the rows were written."""
+
+    ODD = ['UID:odd@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(2, 19)}',
+           f'DTEND;TZID=Europe/Warsaw:{_local(2, 21)}',
+           r'SUMMARY:"Bachata" \\ Łódź\, </script> \u2028',
+           r'DESCRIPTION:Linia\nDruga', 'LOCATION:Sala 5']
+
+    def setUp(self):
+        cache.clear()
+        self.warsaw = City.objects.create(name='Warszawa', calendar_id='w@example.com',
+                                          is_default=True)
+
+    def _get(self, path):
+        with patch('requests.get', return_value=_google_says(_feed(self.ODD, WEEKLY))):
+            return self.client.get(path, HTTP_HOST='gdzienawesta.com')
+
+    def _as_json_response(self, **data):
+        from django.http import JsonResponse
+        return JsonResponse(data).content
+
+    def test_the_list_is_what_json_response_would_have_sent(self):
+        from events.models import Occurrence
+
+        response = self._get('/api/next-events/?limit=5')
+        rows = Occurrence.objects.filter(end__gt=timezone.now())[:5]
+        events = [row.as_event('w@example.com') for row in rows]
+        self.assertEqual(response.content, self._as_json_response(
+            success=True, events=events, count=len(events),
+            valid_until=response.json()['valid_until']))
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_the_single_event_is_what_json_response_would_have_sent(self):
+        from events.models import Occurrence
+
+        response = self._get('/api/next-event/')
+        row = Occurrence.objects.filter(end__gt=timezone.now()).first()
+        self.assertEqual(response.content, self._as_json_response(
+            success=True, event=row.as_event('w@example.com'),
+            valid_until=response.json()['valid_until']))
+
+    def test_fragments_are_encoded_when_rows_are_written(self):
+        from events.models import Occurrence
+
+        self._get('/api/next-events/')
+        self.assertFalse(Occurrence.objects.filter(encoded='').exists())
+        with patch('events.models.Occurrence.encode', side_effect=AssertionError):
+            response = self._get('/api/next-events/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_rows_from_before_the_column_are_encoded_on_the_way_out(self):
+        from events.models import Occurrence
+
+        first = self._get('/api/next-events/').content
+        Occurrence.objects.update(encoded='')
+        self.assertEqual(self._get('/api/next-events/').content, first)
+
+    def test_the_calendar_id_is_the_citys_current_one(self):
+        self._get('/api/next-events/')
+        City.objects.filter(pk=self.warsaw.pk).update(calendar_id='moved@example.com')
+        with patch('events.services.OccurrenceStore.refresh'):
+            response = self._get('/api/next-events/')
+        self.assertEqual({e['calendar_id'] for e in response.json()['events']},
+                         {'moved@example.com'})
+
+
+@override_settings(CACHES=LOCMEM)
+class EdgeCacheTests(TestCase):
+    """Answers say how long nginx may keep them, and are purged when they change."""
+
+    def setUp(self):
+        import tempfile
+        cache.clear()
+        self.edge_dir = tempfile.mkdtemp()
+        self.addCleanup(__import__('shutil').rmtree, self.edge_dir)
+        self.settings_override = override_settings(EDGE_CACHE_DIR=self.edge_dir)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.warsaw = City.objects.create(name='Warszawa', calendar_id='w@example.com',
+                                          is_default=True)
+
+    def _cached(self, key):
+        """Put a file where nginx would keep the answer for ``key``."""
+        from events.edge import nginx_cache_file
+        path = Path(nginx_cache_file(key))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'cached')
+        return path
+
+    def _max_ages(self, response):
+        return {k.strip(): int(v) for k, _, v in
+                (part.partition('=') for part in response['Cache-Control'].split(','))
+                if v}
+
+    def test_events_are_kept_until_the_first_one_ends(self):
+        def utc(minutes):
+            return (timezone.now() + timedelta(minutes=minutes)).strftime('%Y%m%dT%H%M%SZ')
+
+        ending = ['UID:ending@google.com', f'DTSTART:{utc(-60)}', f'DTEND:{utc(5)}',
+                  'SUMMARY:Ending']
+        with patch('requests.get', return_value=_google_says(_feed(ending, WEEKLY))):
+            response = self.client.get('/api/next-events/', HTTP_HOST='gdzienawesta.com')
+        ages = self._max_ages(response)
+        self.assertTrue(240 < ages['s-maxage'] <= 300, ages)
+        # Browsers cannot be purged.
+        self.assertEqual(ages['max-age'], 60)
+        self.assertIn('Host', response['Vary'])
+
+    def test_never_longer_than_a_feed_stays_fresh(self):
+        with patch('requests.get', return_value=_google_says(_feed(WEEKLY))):
+            response = self.client.get('/api/next-event/', HTTP_HOST='gdzienawesta.com')
+        # The city's own interval, which before any plan is the default.
+        self.assertAlmostEqual(self._max_ages(response)['s-maxage'],
+                               schedule.interval('w@example.com'), delta=2)
+        self.assertEqual(schedule.interval('w@example.com'), schedule.DEFAULT_SECONDS)
+
+    def test_valid_until_is_the_next_look_at_the_feed(self):
+        from datetime import datetime
+
+        with patch('requests.get', return_value=_google_says(_feed(WEEKLY))):
+            response = self.client.get('/api/next-events/', HTTP_HOST='gdzienawesta.com')
+        valid_until = datetime.fromisoformat(response.json()['valid_until'])
+        left = (valid_until - timezone.now()).total_seconds()
+        self.assertAlmostEqual(left, schedule.interval('w@example.com'), delta=2)
+        self.assertFalse(response.has_header('Expires'))
+        self.assertIn('stale-while-revalidate=0', response['Cache-Control'])
+
+    def test_valid_until_is_when_the_first_event_ends(self):
+        def utc(minutes):
+            return (timezone.now() + timedelta(minutes=minutes)).strftime('%Y%m%dT%H%M%SZ')
+
+        ending = ['UID:ending@google.com', f'DTSTART:{utc(-60)}', f'DTEND:{utc(5)}',
+                  'SUMMARY:Ending']
+        with patch('requests.get', return_value=_google_says(_feed(ending, WEEKLY))):
+            body = self.client.get('/api/next-event/', HTTP_HOST='gdzienawesta.com').json()
+        self.assertEqual(body['valid_until'], body['event']['end'])
+
+    def test_errors_are_not_cached(self):
+        with patch('requests.get', return_value=_google_says(_feed())):
+            response = self.client.get('/api/next-events/', HTTP_HOST='gdzienawesta.com')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('Cache-Control'))
+
+    def test_city_answers_are_kept_for_a_day(self):
+        for path in ('/api/cities/', '/api/calendar/'):
+            response = self.client.get(path, HTTP_HOST='gdzienawesta.com')
+            self.assertEqual(self._max_ages(response)['s-maxage'], 24 * 60 * 60)
+            self.assertIn('Host', response['Vary'])
+
+    def test_cache_files_are_where_nginx_puts_them(self):
+        import hashlib
+        from events.edge import nginx_cache_file
+
+        digest = hashlib.md5(b'gdzienawesta.com/api/cities/').hexdigest()
+        self.assertEqual(nginx_cache_file('gdzienawesta.com/api/cities/'),
+                         f'{self.edge_dir}/{digest[-1]}/{digest[-3:-1]}/{digest}')
+
+    def test_a_new_feed_purges_the_citys_events(self):
+        apex = self._cached('gdzienawesta.com/api/next-events/?limit=3')
+        own = self._cached('warszawa.gdzienawesta.com/api/next-event/')
+        cities = self._cached('gdzienawesta.com/api/cities/')
+        with patch('requests.get', return_value=_google_says(_feed(WEEKLY))):
+            self.client.get('/api/next-events/', HTTP_HOST='gdzienawesta.com')
+        self.assertFalse(apex.exists())
+        self.assertFalse(own.exists())
+        self.assertTrue(cities.exists())
+
+    def test_an_unchanged_feed_purges_nothing(self):
+        with patch('requests.get', return_value=_google_says(_feed(WEEKLY))):
+            self.client.get('/api/next-events/', HTTP_HOST='gdzienawesta.com')
+            apex = self._cached('gdzienawesta.com/api/next-events/')
+            cache.delete('ics:checked:w@example.com')
+            cache.delete('ics:fresh:w@example.com')
+            self.client.get('/api/next-events/', HTTP_HOST='gdzienawesta.com')
+        self.assertTrue(apex.exists())
+
+    def test_a_city_edit_purges_every_city_and_its_old_address(self):
+        lodz = City.objects.create(name='Łódź', calendar_id='l@example.com')
+        apex = self._cached('gdzienawesta.com/api/cities/')
+        old = self._cached('lodz.gdzienawesta.com/api/calendar/')
+        lodz.slug = 'lodz-centrum'
+        lodz.save()
+        self.assertFalse(apex.exists())
+        self.assertFalse(old.exists())
+
+    @override_settings(CLOUDFLARE_ZONE_ID='zone', CLOUDFLARE_API_TOKEN='token')
+    def test_cloudflare_is_purged_by_url(self):
+        from events import edge
+
+        with patch('requests.post') as post:
+            edge._purge_cloudflare(['gdzienawesta.com/api/cities/'])
+        self.assertIn('/zones/zone/purge_cache', post.call_args.args[0])
+        self.assertEqual(post.call_args.kwargs['json'],
+                         {'files': ['https://gdzienawesta.com/api/cities/']})
+
+
+@override_settings(CACHES=LOCMEM)
+class FeedRefreshTests(TestCase):
+    """A city's feed fetched on demand, from the admin panel or the command line."""
+
+    def setUp(self):
+        cache.clear()
+        self.warsaw = City.objects.create(name='Warszawa', calendar_id='w@example.com',
+                                          is_default=True)
+        self.lodz = City.objects.create(name='Łódź', calendar_id='l@example.com')
+        with patch('requests.get', return_value=_google_says(_feed(WEEKLY))):
+            self.client.get('/api/next-events/', HTTP_HOST='gdzienawesta.com')
+
+    def _titles(self):
+        response = self.client.get('/api/next-events/?limit=10', HTTP_HOST='gdzienawesta.com')
+        return {event['title'] for event in response.json()['events']}
+
+    def test_a_fixed_event_shows_without_waiting(self):
+        from events.services import FeedRefreshService
+
+        fixed = _google_says(_feed(WEEKLY, WORKSHOP, stamp='20260102T000000Z'))
+        with patch('requests.get', return_value=fixed) as google:
+            [report] = FeedRefreshService().refresh(['w@example.com'])
+        google.assert_called_once()
+        self.assertTrue(report.fetched)
+        self.assertTrue(report.changed)
+        self.assertGreater(report.occurrences, 0)
+        self.assertIn('Warsztaty', self._titles())
+
+    def test_an_unchanged_feed_changes_nothing(self):
+        from events.services import FeedRefreshService
+
+        with patch('requests.get', return_value=_google_says(_feed(WEEKLY))):
+            [report] = FeedRefreshService().refresh(['w@example.com'])
+        self.assertEqual(report.error, '')
+        self.assertFalse(report.changed)
+
+    def test_google_down_leaves_the_stored_events(self):
+        from events.services import FeedRefreshService
+
+        with patch('requests.get', side_effect=requests.ConnectionError):
+            [report] = FeedRefreshService().refresh(['w@example.com'])
+        self.assertFalse(report.fetched)
+        self.assertTrue(report.error)
+        self.assertEqual(self._titles(), {'Social'})
+
+    def test_several_cities_at_once(self):
+        from events.services import FeedRefreshService
+
+        with patch('requests.get', return_value=_google_says(_feed(WEEKLY))) as google:
+            reports = FeedRefreshService().refresh(['w@example.com', 'l@example.com'])
+        self.assertEqual([r.calendar_id for r in reports], ['w@example.com', 'l@example.com'])
+        self.assertEqual(google.call_count, 2)
+        self.assertTrue(reports[1].changed)
+
+    def test_the_command(self):
+        from io import StringIO
+        from django.core.management import CommandError, call_command
+
+        out = StringIO()
+        with patch('requests.get', return_value=_google_says(_feed(WEEKLY))):
+            call_command('refresh_feeds', 'lodz', stdout=out)
+        self.assertIn('lodz', out.getvalue())
+        self.assertIn('updated', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('refresh_feeds', 'krakow', stdout=out)
+
+    def test_the_admin_action(self):
+        from django.contrib.auth.models import User
+        from django.urls import reverse
+
+        self.client.force_login(User.objects.create_superuser('admin', '', 'x'))
+        fixed = _google_says(_feed(WEEKLY, WORKSHOP, stamp='20260102T000000Z'))
+        with patch('requests.get', return_value=fixed):
+            response = self.client.post(reverse('admin:events_city_changelist'), {
+                'action': 'refresh_now', '_selected_action': [self.warsaw.pk],
+            }, follow=True)
+        self.assertContains(response, 'Warszawa: updated')
+        self.assertIn('Warsztaty', self._titles())
+
+
+@override_settings(CACHES=LOCMEM)
+class FeedHealthTests(TestCase):
+    """Each look at a feed leaves a row for the admin panel - events/health.py."""
+
+    def setUp(self):
+        cache.clear()
+        self.warsaw = City.objects.create(name='Warszawa', calendar_id='w@example.com',
+                                          is_default=True)
+
+    def _fetch(self, **google):
+        from events.services import FeedRefreshService
+        with patch('requests.get', **google):
+            FeedRefreshService().refresh(['w@example.com'])
+
+    def test_a_fetch_is_measured(self):
+        from events.models import FeedCheck
+
+        feed = _feed(WEEKLY, WORKSHOP)
+        with patch('requests.get', return_value=_google_says(feed)):
+            self.client.get('/api/next-events/', HTTP_HOST='gdzienawesta.com')
+        check = FeedCheck.objects.get(city=self.warsaw)
+        self.assertTrue(check.ok)
+        self.assertEqual(check.feed_bytes, len(feed))
+        self.assertEqual(check.vevents, 2)
+        self.assertGreater(check.occurrences, 2)
+        self.assertIsNotNone(check.fetch_ms)
+        self.assertIsNotNone(check.index_ms)
+
+    def test_a_failure_says_why_and_that_a_stale_copy_was_served(self):
+        from events.models import FeedCheck
+
+        self._fetch(return_value=_google_says(_feed(WEEKLY)))
+        self._fetch(return_value=_google_says(b'<html>Log in</html>'))
+        self._fetch(return_value=_google_says(status=404))
+        failures = FeedCheck.objects.filter(ok=False)
+        self.assertEqual([c.error for c in failures],
+                         ['HTTP 404', 'Not a calendar (is it still public?)'])
+        self.assertTrue(all(c.stale for c in failures))
+
+    def test_the_history_is_bounded(self):
+        from events.models import FeedCheck
+
+        with patch.object(FeedCheck, 'HISTORY', 3):
+            for _ in range(5):
+                self._fetch(return_value=_google_says(_feed(WEEKLY)))
+        self.assertEqual(FeedCheck.objects.count(), 3)
+
+    def test_fetches_in_threads_are_recorded_too(self):
+        from events.models import FeedCheck
+
+        City.objects.create(name='Łódź', calendar_id='l@example.com')
+        with patch('requests.get', return_value=_google_says(_feed(WEEKLY))):
+            self.client.get('/api/everywhere/')
+        self.assertEqual(FeedCheck.objects.filter(ok=True).count(), 2)
+
+    def test_the_admin_shows_it(self):
+        from django.contrib.auth.models import User
+        from django.urls import reverse
+
+        self._fetch(return_value=_google_says(_feed(WEEKLY)))
+        self.client.force_login(User.objects.create_superuser('admin', '', 'x'))
+        listing = self.client.get(reverse('admin:events_city_changelist'))
+        self.assertContains(listing, 'Stale serves')
+        page = self.client.get(reverse('admin:events_city_change', args=[self.warsaw.pk]))
+        self.assertContains(page, '<th>VEVENTs</th>', html=False)
+        history = self.client.get(reverse('admin:events_feedcheck_changelist'))
+        self.assertEqual(history.status_code, 200)
+
+
+@override_settings(CACHES=LOCMEM,
+                   PROFILE_SECRET='sesame', PROFILE_SAMPLE_RATE=0)
+class ProfilingTests(TestCase):
+    """Requests profiled on demand or by sampling - events/profiling.py."""
+
+    def setUp(self):
+        cache.clear()
+        City.objects.create(name='Warszawa', calendar_id='w@example.com', is_default=True)
+
+    def _get(self, **headers):
+        with patch('requests.get', return_value=_google_says(_feed(WEEKLY))):
+            return self.client.get('/api/next-events/', HTTP_HOST='gdzienawesta.com',
+                                   headers=headers)
+
+    def test_only_when_asked_with_the_secret(self):
+        from events.models import RequestProfile
+
+        self.assertFalse(self._get().has_header('X-Profile-Id'))
+        self.assertFalse(self._get(**{'X-Profile': 'guess'}).has_header('X-Profile-Id'))
+        with override_settings(PROFILE_SECRET=''):
+            self.assertFalse(self._get(**{'X-Profile': ''}).has_header('X-Profile-Id'))
+        self.assertEqual(RequestProfile.objects.count(), 0)
+
+    def test_a_profile_is_stored(self):
+        from events.models import RequestProfile
+
+        response = self._get(**{'X-Profile': 'sesame'})
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual(profile.path, '/api/next-events/')
+        self.assertEqual(profile.status, 200)
+        self.assertGreater(profile.peak_kb, 0)
+        self.assertIn('services.py', profile.summary)
+        self.assertIn('This app and the icalendar stack', profile.summary)
+
+    @override_settings(PROFILE_SAMPLE_RATE=1)
+    def test_sampled_requests_and_the_history_is_bounded(self):
+        from events.models import RequestProfile
+
+        with patch.object(RequestProfile, 'HISTORY', 2):
+            for _ in range(3):
+                self.assertTrue(self._get().has_header('X-Profile-Id'))
+        self.assertEqual(RequestProfile.objects.count(), 2)
+
+    def test_the_admin_hands_out_the_raw_stats(self):
+        import marshal
+        from django.contrib.auth.models import User
+        from django.urls import reverse
+
+        profile_id = self._get(**{'X-Profile': 'sesame'})['X-Profile-Id']
+        self.client.force_login(User.objects.create_superuser('admin', '', 'x'))
+        page = self.client.get(reverse('admin:events_requestprofile_change', args=[profile_id]))
+        self.assertContains(page, f'profile-{profile_id}.prof')
+        download = self.client.get(
+            reverse('admin:events_requestprofile_download', args=[profile_id]))
+        stats = marshal.loads(download.content)
+        self.assertTrue(any(path.endswith('services.py') for path, _, _ in stats))
+
+
+@override_settings(CACHES=LOCMEM)
+class SharedCacheTests(TestCase):
+    """Several workers on several hosts - the claim in OccurrenceStore, and events/bus.py."""
+
+    def setUp(self):
+        cache.clear()
+        self.warsaw = City.objects.create(name='Warszawa', calendar_id='w@example.com',
+                                          is_default=True)
+        with patch('requests.get', return_value=_google_says(_feed(WEEKLY))):
+            self.client.get('/api/next-events/', HTTP_HOST='gdzienawesta.com')
+
+    def test_a_city_being_refreshed_elsewhere_is_answered_from_the_stored_rows(self):
+        cache.delete('ics:checked:w@example.com')
+        cache.delete('ics:fresh:w@example.com')
+        cache.add('ics:refreshing:w@example.com', 'another worker', 60)
+        with patch('requests.get', return_value=_google_says(_feed(WORKSHOP))) as google:
+            response = self.client.get('/api/next-events/', HTTP_HOST='gdzienawesta.com')
+        google.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['events'][0]['title'], 'Social')
+
+    def test_a_refresh_lets_go_of_its_claim(self):
+        from events.services import OccurrenceStore
+
+        cache.delete('ics:checked:w@example.com')
+        cache.delete('ics:fresh:w@example.com')
+        with patch('requests.get', return_value=_google_says(_feed(WEEKLY))) as google:
+            OccurrenceStore().refresh('w@example.com')
+        google.assert_called_once()
+        self.assertIsNone(cache.get('ics:refreshing:w@example.com'))
+        # Someone else's claim, taken after ours lapsed, is not ours to end.
+        store = OccurrenceStore()
+        token = store.claim('w@example.com')
+        self.assertIsNone(store.claim('w@example.com'))
+        store.release('w@example.com', 'a lapsed token')
+        self.assertEqual(cache.get('ics:refreshing:w@example.com'), token)
+
+    @override_settings(REDIS_URL='redis://redis:6379/0')
+    def test_a_change_is_applied_here_and_published(self):
+        from events import bus
+
+        client = Mock()
+        with patch('events.bus._client', return_value=client), \
+                patch('events.bus.apply') as apply:
+            bus.announce('nginx', keys=['gdzienawesta.com/api/next-events/'])
+        apply.assert_called_once_with('nginx', {'keys': ['gdzienawesta.com/api/next-events/']})
+        channel, message = client.publish.call_args.args
+        self.assertEqual(channel, bus.CHANNEL)
+        self.assertEqual(json.loads(message), {
+            'kind': 'nginx', 'node': bus.NODE, 'keys': ['gdzienawesta.com/api/next-events/']})
+
+    def test_without_redis_nothing_is_published(self):
+        from events import bus
+
+        with patch('events.bus._client') as client, patch('events.bus.apply'):
+            bus.announce('pages', calendar_id=None)
+        client.assert_not_called()
+
+    def test_another_nodes_purge_is_applied_here_and_ours_is_not(self):
+        import shutil
+        import tempfile
+        from events import bus, edge
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        key = 'gdzienawesta.com/api/next-events/'
+        with override_settings(EDGE_CACHE_DIR=directory):
+            cached = Path(edge.nginx_cache_file(key))
+            cached.parent.mkdir(parents=True)
+            cached.write_bytes(b'answer')
+
+            bus.receive(json.dumps({'kind': 'nginx', 'node': bus.NODE, 'keys': [key]}))
+            self.assertTrue(cached.exists())
+            bus.receive(json.dumps({'kind': 'nginx', 'node': 'another-host', 'keys': [key]}))
+            self.assertFalse(cached.exists())
+
+    def test_another_nodes_new_feed_renders_that_citys_pages(self):
+        from events import bus
+
+        with patch('events.prerender.refresh') as refresh:
+            bus.receive(json.dumps({'kind': 'pages', 'node': 'another-host',
+                                    'calendar_id': 'w@example.com'}))
+            bus.receive(json.dumps({'kind': 'pages', 'node': 'another-host',
+                                    'calendar_id': None}))
+            bus.receive('not json')
+        self.assertEqual([c.args for c in refresh.call_args_list], [(self.warsaw,), (None,)])
+
+    def _settings(self, **environ):
+        import os
+        import runpy
+        from django.conf import settings
+
+        path = Path(settings.BASE_DIR) / 'westnfound' / 'settings.py'
+        with patch.dict(os.environ, environ):
+            return runpy.run_path(str(path))
+
+    def test_hosts_sharing_a_cache_must_share_a_database(self):
+        from django.core.exceptions import ImproperlyConfigured
+
+        with self.assertRaises(ImproperlyConfigured):
+            self._settings(REDIS_URL='redis://redis:6379/0', DATABASE_URL='')
+        shared = self._settings(REDIS_URL='redis://redis:6379/0',
+                                DATABASE_URL='postgres://west:p%40ss@db:5432/westnfound')
+        self.assertEqual(shared['DATABASES']['default'], {
+            'ENGINE': 'django.db.backends.postgresql', 'NAME': 'westnfound',
+            'USER': 'west', 'PASSWORD': 'p@ss', 'HOST': 'db', 'PORT': '5432',
+        })
+
+
+@override_settings(CACHES=LOCMEM,
+                   FEED_FETCH_RATE=(20, 60))
+class ScheduleTests(TestCase):
+    """Each city's own refresh interval, under one budget - events/schedule.py."""
+
+    def setUp(self):
+        cache.clear()
+        schedule._counted.clear()
+        self.warsaw = City.objects.create(name='Warszawa', calendar_id='w@example.com',
+                                          is_default=True)
+        self.lodz = City.objects.create(name='Łódź', calendar_id='l@example.com')
+
+    def test_busy_volatile_cities_are_looked_at_more_often(self):
+        start = 1_800_000_000
+        day = 24 * 60 * 60
+        for hour in range(14 * 24):
+            now = start + hour * 3600
+            for _ in range(30):
+                schedule.wanted('w@example.com')
+            if hour % 4 == 0:
+                edited = [WORKSHOP] if hour % 8 else []
+                schedule.fetched('w@example.com', _feed(WEEKLY, *edited), 60, now=now)
+            if hour % 24 == 0:
+                schedule.wanted('l@example.com')
+                schedule.fetched('l@example.com', _feed(WEEKLY), 60, now=now)
+            schedule.flush(now)
+        now = start + 14 * day
+        cache.delete('schedule:plan')
+        plan = schedule.plan(now)
+
+        self.assertEqual(plan['w@example.com'], schedule.MIN_SECONDS)
+        self.assertGreater(plan['l@example.com'], 3 * 60 * 60)
+        # Within the share of the budget planned for.
+        refill_seconds = 60
+        self.assertLessEqual(sum(1 / seconds for seconds in plan.values()),
+                             schedule.BUDGET_SHARE / refill_seconds + 1 / schedule.MAX_SECONDS)
+
+    def test_a_new_stamp_is_not_a_change(self):
+        schedule.fetched('w@example.com', _feed(WEEKLY, stamp='20260101T000000Z'), 60)
+        schedule.fetched('w@example.com', _feed(WEEKLY, stamp='20260102T000000Z'), 60)
+        self.assertEqual(cache.get('schedule:changes:w@example.com')[1], 0)
+        schedule.fetched('w@example.com', _feed(WEEKLY, WORKSHOP), 60)
+        self.assertAlmostEqual(cache.get('schedule:changes:w@example.com')[1], 1, places=3)
+
+    def test_requests_count_as_demand(self):
+        with patch('requests.get', return_value=_google_says(_feed(WEEKLY))):
+            self.client.get('/api/next-events/', HTTP_HOST='gdzienawesta.com')
+            self.client.get('/kalendarz.ics', HTTP_HOST='gdzienawesta.com')
+            self.client.get('/api/everywhere/', HTTP_HOST='gdzienawesta.com')
+        # Counted here, not written to the cache on every request.
+        self.assertIsNone(cache.get('schedule:demand:w@example.com'))
+        schedule.flush()
+        count, _, _ = cache.get('schedule:demand:w@example.com')
+        self.assertAlmostEqual(count, 2.5, places=3)
+        self.assertEqual(set(cache.get('schedule:plan')), {'w@example.com', 'l@example.com'})
+
+    def test_the_copy_is_fresh_for_the_citys_interval(self):
+        from events.services import CalendarFeedService
+
+        cache.set('schedule:plan', {'w@example.com': 1234}, 60)
+        with patch('requests.get', return_value=_google_says(_feed(WEEKLY))):
+            CalendarFeedService().get('w@example.com')
+        self.assertAlmostEqual(schedule.remaining('w@example.com'), 1234, delta=2)
+
+    def test_the_admin_shows_each_citys_interval(self):
+        from django.contrib.auth.models import User
+        from django.urls import reverse
+
+        cache.set('schedule:plan', {'w@example.com': 900, 'l@example.com': 3 * 3600 + 600}, 60)
+        self.client.force_login(User.objects.create_superuser('admin', '', 'x'))
+        response = self.client.get(reverse('admin:events_city_changelist'))
+        self.assertContains(response, '15 min')
+        self.assertContains(response, '3 h 10 min')
+
+    @override_settings(FEED_FETCH_RATE=(1, 3600))
+    def test_over_the_budget_the_copy_there_is_stands(self):
+        from events.services import CalendarFeedService
+
+        with patch('requests.get', return_value=_google_says(_feed(WEEKLY))) as google:
+            first, _ = CalendarFeedService().get('w@example.com')
+            cache.delete('ics:fresh:w@example.com')
+            second, is_stale = CalendarFeedService().get('w@example.com')
+        google.assert_called_once()
+        self.assertEqual(second, first)
+        self.assertFalse(is_stale)
+        # Until the budget has a fetch again, not for a whole interval.
+        self.assertAlmostEqual(schedule.remaining('w@example.com'), 3600, delta=2)
+
+        # A city with nothing to answer from, and a refresh someone asked
+        # for, are fetched regardless.
+        with patch('requests.get', return_value=_google_says(_feed(WEEKLY))) as google:
+            self.assertIsNotNone(CalendarFeedService().get('l@example.com')[0])
+            CalendarFeedService().get('w@example.com', refetch=True)
+        self.assertEqual(google.call_count, 2)
+
+
+@override_settings(CACHES=LOCMEM)
+class WarmupTests(TestCase):
+    """A worker pays its first-request costs before it takes a request."""
+
+    def setUp(self):
+        from events import warmup
+        cache.clear()
+        warmup._state = None
+        self.addCleanup(setattr, warmup, '_state', None)
+        City.objects.create(name='Warszawa', calendar_id='w@example.com', is_default=True)
+
+    def test_not_ready_until_warmed(self):
+        from events import warmup
+        warmup._state = {'ready': False, 'loaded': {}}
+        self.assertEqual(self.client.get('/api/ready/').status_code, 503)
+
+    def test_warming_loads_the_cities_and_the_indexes(self):
+        from events.warmup import warm
+        from events.services import CalendarIndexService
+        with patch('requests.get', return_value=_google_says()):
+            CalendarIndexService().get('w@example.com')
+        state = warm()
+        self.assertTrue(state['ready'])
+        self.assertEqual(state['loaded']['cities']['count'], 1)
+        self.assertEqual(state['loaded']['indexes']['count'], 1)
+
+    def test_a_worker_nobody_warmed_warms_when_asked(self):
+        response = self.client.get('/api/ready/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['ready'])
+
+    def test_a_failing_step_does_not_stop_the_worker(self):
+        from events import warmup
+        with patch.object(warmup, '_read_pages', side_effect=OSError('no /frontend')):
+            state = warmup.warm()
+        self.assertTrue(state['ready'])
+        self.assertIsNone(state['loaded']['pages']['count'])
+
+
+@override_settings(CACHES=LOCMEM)
+class EventStreamTests(TestCase):
+    """/api/stream/ sends the next events, then again only when they change."""
+
+    def setUp(self):
+        cache.clear()
+        City.objects.create(name='Warszawa', calendar_id='w@example.com', is_default=True)
+        self.google = patch('requests.get', return_value=_google_says(_feed(WEEKLY)))
+        self.google.start()
+        self.addCleanup(self.google.stop)
+
+    async def _open(self, **headers):
+        response = await self.async_client.get('/api/stream/', HTTP_HOST='gdzienawesta.com',
+                                               **headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        messages = response.streaming_content
+        self.assertEqual(await anext(messages), b'retry: 5000\n\n')
+        return messages
+
+    async def _close(self):
+        """Stop the watchers before the test's event loop goes away."""
+        from events import stream
+        for channel in list(stream._channels.values()):
+            if channel._task is not None:
+                channel._task.cancel()
+        stream._channels.clear()
+
+    def _data(self, message):
+        import json
+        fields = dict(line.split(': ', 1) for line in message.decode().splitlines() if line)
+        return fields['id'], json.loads(fields['data'])
+
+    async def test_an_orphaned_channel_leaves_its_successor_alone(self):
+        import asyncio
+        from events import stream
+
+        with patch.object(stream.Channel, '_watch', lambda channel: asyncio.sleep(3600)):
+            try:
+                key = (asyncio.get_running_loop(), 'w@example.com', 3)
+                orphan = stream.channel_for('w@example.com', 3)
+                successor = stream.Channel('w@example.com', 3)
+                stream._channels[key] = successor
+                successor.subscribe()
+                orphan.unsubscribe()
+                self.assertIs(stream._channels.get(key), successor)
+                successor.unsubscribe()
+                self.assertEqual(stream._channels, {})
+            finally:
+                await self._close()
+
+    async def test_a_channel_subscribed_to_after_its_teardown_watches_again(self):
+        from events import stream
+
+        try:
+            channel = stream.channel_for('w@example.com', 3)
+            channel.unsubscribe()
+            self.assertIsNone(channel._task)
+            # Someone who had it from before: the watcher starts again, and
+            # they are sent events, not only heartbeats.
+            channel.subscribe()
+            self.assertFalse(channel._task.done())
+            message = await channel.next_message(None, 5)
+            self.assertIsNotNone(message)
+            self.assertEqual(json.loads(message[1])['status'], 200)
+            channel.unsubscribe()
+        finally:
+            await self._close()
+
+    def test_not_under_wsgi(self):
+        response = self.client.get('/api/stream/', HTTP_HOST='gdzienawesta.com')
+        self.assertEqual(response.status_code, 501)
+
+    async def test_first_message_is_what_the_api_answers(self):
+        try:
+            _, data = self._data(await anext(await self._open()))
+        finally:
+            await self._close()
+        answer = await self.async_client.get('/api/next-events/', HTTP_HOST='gdzienawesta.com')
+        # The stream is its own schedule; it has no use for valid_until.
+        body = answer.json()
+        del body['valid_until']
+        self.assertEqual(data, {'status': 200, 'body': body})
+
+    async def test_a_reconnect_is_not_sent_what_it_has(self):
+        try:
+            message_id, _ = self._data(await anext(await self._open()))
+            with patch('events.stream.HEARTBEAT_SECONDS', 0.05):
+                again = await self._open(headers={'Last-Event-ID': message_id})
+                self.assertEqual(await anext(again), b': heartbeat\n\n')
+        finally:
+            await self._close()
+
+    async def test_a_new_feed_is_pushed(self):
+        from asgiref.sync import sync_to_async
+
+        workshop = _google_says(_feed(WEEKLY, WORKSHOP, stamp='20260102T000000Z'))
+        try:
+            with patch('events.stream.WATCH_SECONDS', 0.01):
+                messages = await self._open()
+                first, _ = self._data(await anext(messages))
+                with patch('requests.get', return_value=workshop):
+                    await sync_to_async(cache.delete)('ics:checked:w@example.com')
+                    await sync_to_async(cache.delete)('ics:fresh:w@example.com')
+                    second, data = self._data(await anext(messages))
+        finally:
+            await self._close()
+        self.assertNotEqual(first, second)
+        self.assertIn('Warsztaty', str(data['body']))
+
+
+class PackedIndexTests(TestCase):
+    """The cached index is one flat buffer, read in place - events/packing.py."""
+
+    def _index(self, *events):
+        from events.indexing import build_index, feed_version
+        feed = _feed(*events)
+        return build_index('w@example.com', feed, feed_version(feed), timezone.now())
+
+    def test_it_reads_back_as_what_was_packed(self):
+        from events.packing import PackedIndex, pack_index
+        index = self._index(WEEKLY, WORKSHOP)
+        packed = PackedIndex(pack_index(index))
+
+        self.assertEqual(packed.occurrences, index.occurrences)
+        self.assertEqual(packed.series, index.series)
+        self.assertEqual((packed.calendar_id, packed.version, packed.context, packed.window),
+                         (index.calendar_id, index.version, index.context, index.window))
+        now = timezone.now()
+        self.assertEqual(list(packed.upcoming(now)), list(index.upcoming(now)))
+        self.assertTrue(packed.covers(now))
+
+    def test_times_keep_their_offset(self):
+        from events.packing import PackedIndex, pack_index
+        index = self._index(WORKSHOP)
+        packed = PackedIndex(pack_index(index))
+        self.assertEqual(packed.occurrences[0].as_event('x'),
+                         index.occurrences[0].as_event('x'))
+
+    def test_a_weekly_title_is_stored_once(self):
+        import pickle
+        from events.packing import pack_index
+        index = self._index(WEEKLY)
+        packed = pack_index(index)
+        self.assertEqual(packed.count(b'Social'), 1)
+        self.assertLess(len(packed), len(pickle.dumps(index)))
+
+    def test_an_empty_calendar(self):
+        from events.packing import PackedIndex, pack_index
+        packed = PackedIndex(pack_index(self._index()))
+        self.assertEqual(packed.occurrences, [])
+        self.assertEqual(list(packed.upcoming(timezone.now())), [])
+
+    def test_it_can_be_mapped_from_a_file(self):
+        import tempfile
+        from events.packing import PackedIndex, pack_index
+        index = self._index(WEEKLY, WORKSHOP)
+        with tempfile.NamedTemporaryFile(suffix='.idx') as f:
+            f.write(pack_index(index))
+            f.flush()
+            mapped = PackedIndex.open(f.name)
+            self.assertEqual(mapped.occurrences, index.occurrences)
+
+    def test_anything_else_is_refused(self):
+        from events.packing import PackedIndex, pack_index
+        packed = pack_index(self._index(WORKSHOP))
+        for broken in (b'', b'pickle' * 40, packed[:4] + b'\x09' + packed[5:],
+                       packed[:len(packed) // 2]):
+            with self.assertRaises(ValueError):
+                PackedIndex(broken)
+
+
+@override_settings(CACHES=LOCMEM)
+class IndexFileTests(TestCase):
+    """Built indexes are files every worker maps - events/indexfiles.py."""
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        from events import indexfiles
+
+        cache.clear()
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+        override = override_settings(INDEX_DIR=str(self.directory))
+        override.enable()
+        self.addCleanup(override.disable)
+        indexfiles._attached.clear()
+        self.addCleanup(indexfiles._attached.clear)
+
+    def _build(self, *events):
+        from events.services import CalendarIndexService
+        cache.delete('ics:fresh:w@example.com')
+        with patch('requests.get', return_value=_google_says(_feed(*events))):
+            return CalendarIndexService().get('w@example.com')
+
+    def test_the_index_is_published_and_mapped(self):
+        import mmap
+        from events import indexfiles
+        from events.services import CalendarIndexService
+
+        built = self._build(WEEKLY)
+        [published] = self.directory.glob('*.wnfi')
+        self.assertEqual(cache.get('ics:index:w@example.com'), published.name)
+        self.assertIsInstance(built._buffer, mmap.mmap)
+
+        # Another worker: nothing attached yet, the same file.
+        indexfiles._attached.clear()
+        other = CalendarIndexService().cached('w@example.com')
+        self.assertIsInstance(other._buffer, mmap.mmap)
+        self.assertEqual(other.occurrences, built.occurrences)
+        self.assertIs(CalendarIndexService().cached('w@example.com'), other)
+
+    def test_a_new_version_replaces_the_file(self):
+        first = self._build(WEEKLY)
+        second = self._build(WEEKLY, WORKSHOP)
+        self.assertNotEqual(first.version, second.version)
+        [published] = self.directory.glob('*.wnfi')
+        self.assertIn(second.version, published.name)
+        # A worker still holding the old mapping can read it.
+        self.assertTrue(first.occurrences)
+
+    def test_a_missing_file_is_built_again(self):
+        from events import indexfiles
+        from events.services import CalendarIndexService
+
+        self._build(WEEKLY)
+        for published in self.directory.glob('*.wnfi'):
+            published.unlink()
+        indexfiles._attached.clear()
+        self.assertIsNone(CalendarIndexService().cached('w@example.com'))
+        self.assertIsNotNone(self._build(WEEKLY))
+
+    @override_settings(REDIS_URL='redis://redis:6379/0')
+    def test_hosts_sharing_a_cache_each_keep_their_own_files_name(self):
+        from events import bus, indexfiles
+        from events.services import CalendarIndexService
+
+        built = self._build(WEEKLY)
+        [published] = self.directory.glob('*.wnfi')
+        self.assertIsNone(cache.get('ics:index:w@example.com'))
+        self.assertEqual(cache.get(f'ics:index:w@example.com:{bus.NODE}'), published.name)
+
+        # Another host, whose disk has no such file, is not pointed at it:
+        # it finds no name of its own, and ours is left where it was.
+        indexfiles._attached.clear()
+        with patch('events.bus.NODE', 'another-host'):
+            self.assertIsNone(CalendarIndexService().cached('w@example.com'))
+        self.assertEqual(CalendarIndexService().cached('w@example.com').occurrences,
+                         built.occurrences)
+
+    @override_settings(INDEX_DIR='')
+    def test_without_a_directory_the_cache_keeps_the_bytes(self):
+        self._build(WEEKLY)
+        self.assertIsInstance(cache.get('ics:index:w@example.com'), bytes)
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+
+class ImportBudgetTests(TestCase):
+    """Starting the app must not pay for the calendar stack - events/startup.py."""
+
+    def test_the_wsgi_application_imports_no_calendar_stack(self):
+        from events.startup import heavy_imported, import_times
+        self.assertEqual(heavy_imported(import_times('import westnfound.wsgi')), {})
+
+    def test_nor_does_the_first_request(self):
+        # robots.txt, the admin panel, a page: the URLconf imports every view.
+        from events.startup import heavy_imported, import_times
+        times = import_times('import westnfound.wsgi, westnfound.urls')
+        self.assertEqual(sorted(heavy_imported(times)), [])
+
+    def test_the_wsgi_application_stays_within_its_budget(self):
+        from events.startup import WSGI_BUDGET_MS, import_times
+        times = import_times('import westnfound.wsgi')
+        self.assertLess(times['westnfound.wsgi'].cumulative_us / 1000, WSGI_BUDGET_MS)
+
+
+@override_settings(CACHES=LOCMEM,
+                   THROTTLE_RATES={'feed': (3, 60), 'api': (5, 10)}, THROTTLE_PROXY_COUNT=1)
+class ThrottleTests(TestCase):
+    """A client polling in a loop cannot hold the workers - events/throttle.py."""
+
+    def setUp(self):
+        from django.core.cache import caches
+
+        cache.clear()
+        caches['throttle'].clear()
+        City.objects.create(name='Warszawa', calendar_id='w@example.com', is_default=True)
+        cache.set('ics:fresh:w@example.com', ICS)
+
+    def _get(self, path, ip='203.0.113.7', **headers):
+        headers.setdefault('HTTP_X_FORWARDED_FOR', ip)
+        return self.client.get(path, HTTP_HOST='gdzienawesta.com', **headers)
+
+    def test_a_client_over_its_budget_is_told_when_to_come_back(self):
+        statuses = [self._get('/kalendarz.ics').status_code for _ in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+        response = self._get('/kalendarz.ics')
+        self.assertEqual(response['Retry-After'], '60')
+
+    def test_the_api_answers_429_in_json(self):
+        for _ in range(5):
+            self._get('/api/cities/')
+        response = self._get('/api/cities/')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['error'], 'Too many requests')
+        self.assertEqual(response['Retry-After'], '10')
+
+    def test_a_crowd_of_clients_does_not_evict_the_feeds(self):
+        import shutil
+        import tempfile
+        from django.core.cache import caches
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # As in production: file caches, the shared one culling at Django's
+        # default 300 entries.
+        files = 'django.core.cache.backends.filebased.FileBasedCache'
+        with override_settings(CACHES={
+            'default': {'BACKEND': files, 'LOCATION': f'{directory}/default'},
+            'throttle': {'BACKEND': files, 'LOCATION': f'{directory}/throttle',
+                         'OPTIONS': {'MAX_ENTRIES': 50}},
+        }):
+            cache.set('ics:fresh:w@example.com', ICS)
+            cache.set('ics:last-good:w@example.com', ICS)
+            for n in range(400):
+                self._get('/api/cities/', ip=f'198.51.{n // 250}.{n % 250}')
+            self.assertEqual(cache.get('ics:last-good:w@example.com'), ICS)
+            self.assertLessEqual(len(list(Path(directory, 'throttle').glob('*.djcache'))), 50)
+            caches['throttle'].clear()
+
+    def test_subscribers_and_the_page_spend_separate_budgets(self):
+        for _ in range(3):
+            self._get('/kalendarz.ics')
+        self.assertEqual(self._get('/kalendarz.ics').status_code, 429)
+        self.assertEqual(self._get('/api/cities/').status_code, 200)
+
+    def test_one_client_does_not_spend_anothers(self):
+        for _ in range(4):
+            self._get('/kalendarz.ics')
+        self.assertEqual(self._get('/kalendarz.ics', ip='198.51.100.1').status_code, 200)
+
+    def test_tokens_come_back(self):
+        with patch('events.throttle.time.time', return_value=1000.0):
+            for _ in range(3):
+                self._get('/kalendarz.ics')
+        with patch('events.throttle.time.time', return_value=1061.0):
+            self.assertEqual(self._get('/kalendarz.ics').status_code, 200)
+
+    def test_a_forged_forwarded_for_is_not_believed(self):
+        # nginx appends the real address; whatever came before is the client's.
+        for n in range(4):
+            response = self._get('/kalendarz.ics', ip=f'10.0.0.{n}, 203.0.113.7')
+        self.assertEqual(response.status_code, 429)
+
+    def test_behind_cloudflare_the_entry_before_it_is_the_client(self):
+        with override_settings(THROTTLE_PROXY_COUNT=2):
+            for n in range(4):
+                response = self._get('/kalendarz.ics', ip=f'203.0.113.7, 172.70.0.{n}')
+        self.assertEqual(response.status_code, 429)
+
+    def test_visitors_behind_one_cloudflare_edge_have_a_bucket_each(self):
+        from events import documents
+
+        # What nginx passes on once it has taken CF-Connecting-IP: Cloudflare
+        # wrote the visitor into X-Forwarded-For, and nginx appends the same
+        # address rather than the edge's.
+        def through_cloudflare(visitor, sent=''):
+            return self._get('/kalendarz.ics', ip=f'{sent}{visitor}, {visitor}',
+                             HTTP_X_REAL_IP=visitor, HTTP_CF_CONNECTING_IP=visitor,
+                             REMOTE_ADDR='172.18.0.5')
+
+        for n in range(4):
+            response = through_cloudflare('203.0.113.7', sent=f'10.0.0.{n}, ')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(through_cloudflare('198.51.100.1').status_code, 200)
+
+        path = documents.FRONTEND_DIR / 'nginx.prod.conf'
+        if not path.exists():
+            self.skipTest(f'nginx.prod.conf not mounted at {path}')
+        conf = path.read_text()
+        self.assertIn('real_ip_header CF-Connecting-IP;', conf)
+        self.assertIn('set_real_ip_from 173.245.48.0/20;', conf)
+        self.assertIn('proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;', conf)
+
+    def test_pages_and_the_readiness_probe_are_not_throttled(self):
+        for _ in range(10):
+            self.assertNotEqual(self._get('/robots.txt').status_code, 429)
+            self.assertNotEqual(self._get('/api/ready/').status_code, 429)
+
+
+def _last_sunday_of_october():
+    year = timezone.now().year + 1
+    day = 31
+    while timezone.datetime(year, 10, day).weekday() != 6:
+        day -= 1
+    return f'{year}10{day:02d}'
+
+
+def _in_utc(days, hour):
+    local = timezone.localtime(timezone.now() + timedelta(days=days))
+    return local.replace(hour=hour, minute=0, second=0).astimezone(
+        timezone.get_fixed_timezone(0)).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _weekday(days):
+    return ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')[
+        timezone.localtime(timezone.now() + timedelta(days=days)).weekday()]
+
+
+# Everything Google puts in basic.ics, and the odd things it might: each
+# feed is indexed both ways and the answers compared.
+_ODDITIES = [
+    ['UID:utc@google.com', f'DTSTART:{_local(2, 10)}Z', f'DTEND:{_local(2, 12)}Z',
+     'SUMMARY:Praktis w UTC'],
+    ['UID:floating@google.com', f'DTSTART:{_local(4, 19)}', f'DTEND:{_local(4, 21)}',
+     'SUMMARY:Bez strefy'],
+    ['UID:escaped@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(5, 18)}',
+     f'DTEND;TZID="Europe/Warsaw":{_local(5, 20)}',
+     r'SUMMARY:Kizomba\, semba\; tarraxinha',
+     r'DESCRIPTION:Pierwsza linia\nDruga\Nlinia\\ 100%2C wolny wstęp',
+     'LOCATION:Sala "Pod Arkadami"\\, ul. Długa 5'],
+    ['UID:folded@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(6, 18)}',
+     f'DTEND;TZID=Europe/Warsaw:{_local(6, 20)}',
+     'SUMMARY:Bardzo długi tytuł wydarzenia, który Google zawija\r\n  na dwie\r\n\t linie'],
+    ['UID:all-day@google.com', f'DTSTART;VALUE=DATE:{_local(7, 0)[:8]}',
+     f'DTEND;VALUE=DATE:{_local(8, 0)[:8]}', 'SUMMARY:Cały dzień'],
+    ['UID:duration@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(9, 18)}',
+     'DURATION:PT2H', 'SUMMARY:Z DURATION'],
+    ['UID:no-end@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(10, 18)}',
+     'SUMMARY:Bez końca'],
+    ['UID:long@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(11, 10)}',
+     f'DTEND;TZID=Europe/Warsaw:{_local(12, 10)}', 'SUMMARY:Festiwal'],
+    ['UID:past@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(-3, 18)}',
+     f'DTEND;TZID=Europe/Warsaw:{_local(-3, 20)}', 'SUMMARY:Było'],
+    ['UID:far@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(400, 18)}',
+     f'DTEND;TZID=Europe/Warsaw:{_local(400, 20)}', 'SUMMARY:Za daleko'],
+    ['UID:alarm@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(13, 18)}',
+     f'DTEND;TZID=Europe/Warsaw:{_local(13, 20)}', 'SUMMARY:Z przypomnieniem',
+     'BEGIN:VALARM', 'ACTION:DISPLAY', 'TRIGGER:-PT30M', 'DESCRIPTION:Przypomnienie',
+     'END:VALARM'],
+    ['UID:ambiguous@google.com',
+     f'DTSTART;TZID=Europe/Warsaw:{_last_sunday_of_october()}T023000',
+     f'DTEND;TZID=Europe/Warsaw:{_last_sunday_of_october()}T040000',
+     'SUMMARY:Godzina dwa razy'],
+    ['UID:windows@google.com', f'DTSTART;TZID=Central European Standard Time:{_local(14, 18)}',
+     f'DTEND;TZID=Central European Standard Time:{_local(14, 20)}', 'SUMMARY:Windows'],
+    ['UID:excluded@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(15, 18)}',
+     f'DTEND;TZID=Europe/Warsaw:{_local(15, 20)}',
+     f'EXDATE;TZID=Europe/Warsaw:{_local(15, 18)}', 'SUMMARY:Odwołane'],
+    [f'DTSTART;TZID=Europe/Warsaw:{_local(16, 18)}',
+     f'DTEND;TZID=Europe/Warsaw:{_local(16, 20)}', 'SUMMARY:Bez UID'],
+    # Rules events/recurrence.py expands itself...
+    ['UID:skipped-weeks@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(-30, 20)}',
+     f'DTEND;TZID=Europe/Warsaw:{_local(-30, 23)}', 'RRULE:FREQ=WEEKLY',
+     f'EXDATE;TZID=Europe/Warsaw:{_local(5, 20)},{_local(12, 20)}',
+     f'EXDATE:{_in_utc(26, 20)}',
+     'SUMMARY:Tydzień w tydzień'],
+    ['UID:fortnightly@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(-40, 19)}',
+     f'DTEND;TZID=Europe/Warsaw:{_local(-40, 21)}',
+     f'RRULE:FREQ=WEEKLY;INTERVAL=2;WKST=SU;BYDAY={_weekday(-40)},{_weekday(-37)}',
+     'SUMMARY:Co dwa tygodnie'],
+    ['UID:daily@google.com', f'DTSTART:{_local(-2, 8)}Z', f'DTEND:{_local(-2, 9)}Z',
+     'RRULE:FREQ=DAILY;COUNT=10', 'SUMMARY:Codziennie, w UTC'],
+    ['UID:until@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(-1, 17)}',
+     f'DTEND;TZID=Europe/Warsaw:{_local(-1, 18)}',
+     f'RRULE:FREQ=WEEKLY;UNTIL={_local(200, 16)}Z', 'SUMMARY:Do jesieni'],
+    # ...and rules it leaves to recurring_ical_events.
+    ['UID:monthly@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(-10, 18)}',
+     f'DTEND;TZID=Europe/Warsaw:{_local(-10, 20)}', 'RRULE:FREQ=MONTHLY;BYDAY=1FR',
+     'SUMMARY:Co miesiąc'],
+    ['UID:off-day@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(0, 18)}',
+     f'DTEND;TZID=Europe/Warsaw:{_local(0, 19)}',
+     f'RRULE:FREQ=WEEKLY;COUNT=5;BYDAY={_weekday(2)}',
+     'SUMMARY:Nie w swój dzień'],
+    ['UID:night@google.com', f'DTSTART;TZID=Europe/Warsaw:{_local(-5, 23)}',
+     f'DTEND;TZID=Europe/Warsaw:{_local(-4, 4)}', 'RRULE:FREQ=DAILY',
+     'SUMMARY:Całą noc'],
+]
+
+
+def _without_zone(feed):
+    lines = feed.decode().split('\r\n')
+    start, end = lines.index('BEGIN:VTIMEZONE'), lines.index('END:VTIMEZONE')
+    lines = lines[:start] + lines[end + 1:]
+    return '\r\n'.join(line for line in lines
+                         if not line.startswith('X-WR-TIMEZONE')).encode()
+
+
+class ParserDifferentialTests(TestCase):
+    """The fast reader answers what icalendar answers - events/parsing.py."""
+
+    def corpus(self):
+        google = _feed(WEEKLY, WORKSHOP, *_ODDITIES)
+        return {
+            'plain UTC': ICS,
+            'google': google,
+            'google, LF only': google.replace(b'\r\n', b'\n'),
+            'no X-WR-TIMEZONE': _without_zone(google),
+            'overridden series': _feed(WEEKLY, WORKSHOP, [
+                'UID:social@google.com', f'RECURRENCE-ID;TZID=Europe/Warsaw:{_local(1, 21)}',
+                f'DTSTART;TZID=Europe/Warsaw:{_local(1, 20)}',
+                f'DTEND;TZID=Europe/Warsaw:{_local(1, 22)}', 'SUMMARY:Social (wcześniej)']),
+        }
+
+    def test_the_index_is_the_same_either_way(self):
+        from events import indexing
+        from events.parsing import parse_feed
+
+        now = timezone.now()
+        for name, feed in self.corpus().items():
+            with self.subTest(feed=name):
+                parse_feed(feed)  # read by the fast path, not sent back
+                fast = indexing.build_index('w@example.com', feed, 'v', now)
+                whole = indexing._build_from_calendar('w@example.com', feed, 'v', now, None)
+                self.assertTrue(fast.occurrences)
+                self.assertEqual([o.as_event('w') for o in fast.occurrences],
+                                 [o.as_event('w') for o in whole.occurrences])
+                named = {uid for uid in whole.series if not uid.startswith('no-uid:')}
+                self.assertEqual({uid for uid in fast.series if not uid.startswith('no-uid:')},
+                                 named)
+                for uid in named:
+                    self.assertEqual(fast.series[uid].occurrences, whole.series[uid].occurrences)
+
+    def test_fields_decode_as_icalendar_decodes_them(self):
+        from icalendar import Calendar
+        from events.parsing import Unsupported, date_time, parse_feed, text
+
+        feed = self.corpus()['google']
+        components = list(Calendar.from_ical(feed).walk('VEVENT'))
+        records = parse_feed(feed).events
+        self.assertEqual(len(records), len(components))
+        for record, component in zip(records, components):
+            with self.subTest(uid=str(component.get('UID'))):
+                for field in ('uid', 'summary', 'description', 'location'):
+                    self.assertEqual(text(getattr(record, field)),
+                                     str(component.get(field, '')))
+                try:
+                    start = date_time(record.dtstart)
+                except Unsupported:
+                    continue
+                self.assertEqual(start, component['DTSTART'].dt)
+                self.assertEqual(start.utcoffset(), component['DTSTART'].dt.utcoffset())
+
+    def test_what_it_cannot_read_goes_to_icalendar_whole(self):
+        from events import indexing
+        from events.parsing import Unsupported, parse_feed
+
+        latin = _feed(['UID:latin@google.com', f'DTSTART:{_local(2, 10)}Z',
+                       f'DTEND:{_local(2, 12)}Z', 'SUMMARY:Zażółć'])
+        latin = latin.replace('Zażółć'.encode(), 'Zaz'.encode('latin-1') + b'\xf3\xb3')
+        two = ICS + ICS
+        for feed in (latin, two, ICS.replace(b'END:VEVENT', b'END:VTODO')):
+            with self.subTest(feed=feed[-60:]):
+                with self.assertRaises(Unsupported):
+                    parse_feed(feed)
+        index = indexing.build_index('w@example.com', latin, 'v', timezone.now())
+        self.assertEqual(len(index.occurrences), 1)
+
+    def test_a_zone_the_reader_does_not_know_goes_to_icalendar_whole(self):
+        from events import indexing
+
+        # A floating time, which only X-WR-TIMEZONE places.
+        floating = ['UID:floating@google.com', f'DTSTART:{_local(4, 18)}',
+                    f'DTEND:{_local(4, 20)}', 'SUMMARY:Bez strefy']
+        feed = _feed(WEEKLY, WORKSHOP, floating).replace(
+            b'X-WR-TIMEZONE:Europe/Warsaw', b'X-WR-TIMEZONE:Central European Standard Time')
+        with patch('events.indexing._build_from_calendar',
+                   wraps=indexing._build_from_calendar) as whole:
+            index = indexing.build_index('w@example.com', feed, 'v', timezone.now())
+        whole.assert_called_once()
+        warsaw = indexing.build_index('w@example.com', _feed(WEEKLY, WORKSHOP, floating),
+                                      'v', timezone.now())
+        self.assertEqual([o.as_event('w') for o in index.occurrences],
+                         [o.as_event('w') for o in warsaw.occurrences])
+
+    def test_an_unchanged_feed_is_not_parsed_by_icalendar(self):
+        from events.indexing import build_index
+
+        feed = _feed(WEEKLY, WORKSHOP, *_ODDITIES[:3])
+        before = build_index('w@example.com', feed, 'v1', timezone.now())
+        with patch('icalendar.Calendar.from_ical', side_effect=AssertionError):
+            after = build_index('w@example.com', feed, 'v2', timezone.now(), before)
+        self.assertEqual(after.occurrences, before.occurrences)
+
+    def test_plain_weekly_series_need_no_recurring_ical_events(self):
+        from events.indexing import build_index
+
+        with patch('recurring_ical_events.of', side_effect=AssertionError):
+            skipped = next(e for e in _ODDITIES if e[0] == 'UID:skipped-weeks@google.com')
+            index = build_index('w@example.com', _feed(WEEKLY, skipped), 'v', timezone.now())
+        self.assertEqual({o.title for o in index.occurrences},
+                         {'Social', 'Tydzień w tydzień'})
@@ -0,0 +1,118 @@
+"""A token bucket per client in front of the feed and the API.
+
+Gunicorn runs four synchronous workers. A calendar app misconfigured to poll
+every second, or a scraper walking /api/next-events/ in a loop, holds one of
+them for as long as it keeps asking, and two such clients take half the site.
+Each client gets a bucket of tokens instead: every request takes one, tokens
+come back at a steady rate, and a client with an empty bucket is told 429
+and when to come back - before the request touches the database.
+
+Subscribers and the page's own JavaScript get separate buckets with separate
+sizes. A calendar app polls slowly and steadily; a person clicking around
+the site asks for several things at once and then nothing for minutes.
+
+The buckets live in a cache shared by the workers, so all four count against
+one bucket per client - the 'throttle' cache, not the default one: a flood
+of clients fills it with buckets, and a full cache evicts at random.
+Reading and writing it are two steps, not one, so two workers serving one
+client at the same instant can both take the same token: the limit is
+approximate by a request or two, which is fine for its purpose and avoids
+a lock on every request.
+"""
+
+import math
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+
+FEED_PATHS = ('/kalendarz.ics', '/calendar.ics')
+
+# Loopback without a proxy header in front of it: the machine itself. A
+# health check, the dev server, the test client - never a visitor, whose
+# requests all arrive through nginx.
+LOOPBACK = ('127.0.0.1', '::1')
+
+
+def path_class(path: str) -> Optional[str]:
+    """Which budget a path spends from, or None if it has none."""
+    if path in FEED_PATHS:
+        return 'feed'
+    if path.startswith('/api/') and path != '/api/ready/':
+        return 'api'
+    return None
+
+
+def client_ip(request) -> Optional[str]:
+    """The address of the client, as the proxies in front of us saw it.
+
+    Every proxy appends the address it was talked to from to
+    X-Forwarded-For, so with THROTTLE_PROXY_COUNT proxies in front, the
+    entry that many places from the end was written by the outermost one we
+    trust. Anything before it was written by the client and is not believed.
+    With one proxy - nginx - that entry is the same as X-Real-IP.
+    """
+    count = settings.THROTTLE_PROXY_COUNT
+    forwarded = [a.strip() for a in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')
+                 if a.strip()]
+    if count and len(forwarded) >= count:
+        return forwarded[-count]
+    real_ip = request.META.get('HTTP_X_REAL_IP', '').strip()
+    if real_ip:
+        return real_ip
+    remote = request.META.get('REMOTE_ADDR')
+    return None if remote in LOOPBACK else remote
+
+
+def take(key: str, capacity: int, refill_seconds: float, now: float, store=None) -> float:
+    """Take a token from the bucket at ``key``. Seconds to wait, 0 if taken.
+
+    In ``store``, a cache; the throttle's own by default.
+    """
+    cache = store if store is not None else caches['throttle']
+    tokens, stamp = cache.get(key) or (capacity, now)
+    tokens = min(capacity, tokens + (now - stamp) / refill_seconds)
+    if tokens < 1:
+        cache.set(key, (tokens, now), math.ceil(capacity * refill_seconds))
+        return (1 - tokens) * refill_seconds
+    # Expires when it would be full again, when it is no different from a
+    # bucket that was never there.
+    cache.set(key, (tokens - 1, now), math.ceil(capacity * refill_seconds))
+    return 0.0
+
+
+class ThrottleMiddleware:
+    """Answers 429 with Retry-After to a client that has spent its bucket."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        kind = path_class(request.path)
+        rates = settings.THROTTLE_RATES
+        if kind is not None and kind in rates:
+            ip = client_ip(request)
+            if ip is not None:
+                capacity, refill_seconds = rates[kind]
+                wait = take(f'throttle:{kind}:{ip}', capacity, refill_seconds, time.time())
+                if wait:
+                    return self._too_many(kind, math.ceil(wait))
+        return self.get_response(request)
+
+    @staticmethod
+    def _too_many(kind, retry_after):
+        if kind == 'api':
+            response = JsonResponse({
+                'error': 'Too many requests',
+                'message': f'Try again in {retry_after} s'
+            }, status=429)
+        else:
+            response = HttpResponse(
+                f'Too many requests, try again in {retry_after} s\n',
+                status=429,
+                content_type='text/plain; charset=utf-8',
+            )
+        response['Retry-After'] = str(retry_after)
+        return response
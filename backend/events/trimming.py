@@ -0,0 +1,115 @@
+"""A feed cut down to the events that still matter to a phone.
+
+Google's basic.ics carries every event the calendar has ever had. A phone
+subscribed to it downloads and parses years of finished socials on every
+sync, and the pile only grows. The trimmed feed keeps what overlaps a window
+around today and drops the rest.
+
+It is cut, not rebuilt: the events that stay are Google's own bytes, block
+for block, so nothing about them can differ from the full feed except that
+some of their neighbours are gone. A series stays whole - master, overrides
+and all - as soon as any of its occurrences falls inside the window; a phone
+given half a series would invent the missing half from the RRULE.
+"""
+
+import re
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Set
+
+_UID = re.compile(rb'^UID:(.*)$', re.M)
+_TZID = re.compile(rb';TZID="?([^";:]+)"?[;:]')
+
+
+class _Block(NamedTuple):
+    name: bytes
+    raw: bytes
+    uid: Optional[bytes]
+
+
+def trim_feed(feed: bytes, start: datetime, end: datetime) -> bytes:
+    """``feed`` with only the events that occur between ``start`` and ``end``.
+
+    VTIMEZONEs are kept only if a remaining event names them, and everything
+    outside the components - the calendar's own properties - is kept as is.
+    """
+    head, blocks, tail = _split(feed)
+
+    keep_uids = _uids_between(feed, start, end)
+    events = [b for b in blocks if b.name == b'VEVENT'
+              and (b.uid is None or b.uid in keep_uids)]
+
+    used_zones: Set[bytes] = set()
+    for event in events:
+        used_zones.update(_TZID.findall(_unfold(event.raw)))
+
+    kept = []
+    for block in blocks:
+        if block.name == b'VEVENT':
+            continue
+        if block.name == b'VTIMEZONE':
+            tzid = re.search(rb'^TZID:(.*)$', _unfold(block.raw), re.M)
+            if tzid is None or tzid.group(1).strip() not in used_zones:
+                continue
+        kept.append(block)
+    kept.extend(events)
+
+    return head + b''.join(b.raw for b in kept) + tail
+
+
+def _uids_between(feed: bytes, start: datetime, end: datetime) -> Set[bytes]:
+    # Loaded on the one path that parses - see events/startup.py.
+    from icalendar import Calendar
+    import recurring_ical_events
+
+    calendar = Calendar.from_ical(feed)
+    return {
+        str(component.get('UID', '')).encode()
+        for component in recurring_ical_events.of(calendar).between(start, end)
+    }
+
+
+def _unfold(raw: bytes) -> bytes:
+    return raw.replace(b'\r\n ', b'').replace(b'\r\n\t', b'').replace(b'\r\n', b'\n')
+
+
+def _split(feed: bytes):
+    """(head, top-level components, tail) of a feed, byte for byte."""
+    lines: List[bytes] = feed.splitlines(keepends=True)
+    head: List[bytes] = []
+    tail: List[bytes] = []
+    blocks: List[_Block] = []
+
+    current: List[bytes] = []
+    name = b''
+    depth = 0
+    for line in lines:
+        stripped = line.rstrip(b'\r\n')
+        if depth == 0 and stripped == b'BEGIN:VCALENDAR':
+            head.append(line)
+            depth = 1
+            continue
+        if depth == 1 and stripped == b'END:VCALENDAR':
+            tail.append(line)
+            depth = 0
+            continue
+        if depth == 1 and stripped.startswith(b'BEGIN:'):
+            name = stripped[len(b'BEGIN:'):]
+            current = [line]
+            depth = 2
+            continue
+        if depth >= 2:
+            current.append(line)
+            if stripped.startswith(b'BEGIN:'):
+                depth += 1
+            elif stripped.startswith(b'END:'):
+                depth -= 1
+                if depth == 1:
+                    raw = b''.join(current)
+                    uid = _UID.search(_unfold(raw))
+                    blocks.append(_Block(
+                        name, raw, uid.group(1).strip() if uid else None))
+            continue
+        # Calendar properties, and anything after END:VCALENDAR.
+        (head if not blocks and depth == 1 else tail).append(line)
+
+    return b''.join(head), blocks, b''.join(tail)
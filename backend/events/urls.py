@@ -1,9 +1,16 @@
 from django.urls import path
-from .views import CalendarInfoView, CitiesView, NextEventView, NextEventsView
+from .views import (
+    CalendarInfoView, CitiesView, EverywhereView, NextEventView, NextEventsView,
+    ReadyView,
+)
+from .stream import EventStreamView
 
 urlpatterns = [
     path('next-event/', NextEventView.as_view(), name='next-event'),
     path('next-events/', NextEventsView.as_view(), name='next-events'),
+    path('everywhere/', EverywhereView.as_view(), name='everywhere'),
     path('cities/', CitiesView.as_view(), name='cities'),
     path('calendar/', CalendarInfoView.as_view(), name='calendar-info'),
+    path('ready/', ReadyView.as_view(), name='ready'),
+    path('stream/', EventStreamView.as_view(), name='stream'),
 ]
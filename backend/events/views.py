@@ -1,8 +1,12 @@
 from urllib.parse import quote
 
 from django.http import HttpResponse, HttpResponseNotFound, JsonResponse
+from django.utils import timezone as django_timezone
 from django.views import View
-from .services import CalendarFeedService, GoogleCalendarService
+from . import edge, health, schedule
+from .services import (
+    CalendarFeedService, EverywhereService, GoogleCalendarService, TrimmedFeedService,
+)
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,15 +20,69 @@ def _no_city_response(request):
     city is configured at all - worth telling apart in the message, since only
     the second one is something the owner can fix in the admin panel.
     """
-    if getattr(request, 'city_is_unknown', False):
-        return JsonResponse({
+    return JsonResponse(no_city_body(request.get_host(),
+                                     getattr(request, 'city_is_unknown', False)),
+                        status=404)
+
+
+def no_city_body(host, city_is_unknown):
+    if city_is_unknown:
+        return {
             'error': 'Unknown city',
-            'message': f'No city is served at {request.get_host()}'
-        }, status=404)
-    return JsonResponse({
+            'message': f'No city is served at {host}'
+        }
+    return {
         'error': 'No active cities',
         'message': 'Add cities in the admin panel'
-    }, status=404)
+    }
+
+
+NO_UPCOMING_EVENTS = {
+    'error': 'No upcoming events',
+    'message': 'No upcoming events found in calendars'
+}
+
+
+def _assembled(fragments, single=False, valid_until=None):
+    """The success envelope around already-encoded events.
+
+    Byte for byte what JsonResponse would send for the same dict: the events
+    were encoded with the same encoder when their rows were written, so all
+    that is left is to join them.
+    """
+    return HttpResponse(envelope(fragments, single, valid_until),
+                        content_type='application/json')
+
+
+def envelope(fragments, single=False, valid_until=None):
+    until = ''
+    if valid_until is not None:
+        until = f', "valid_until": "{django_timezone.localtime(valid_until).isoformat()}"'
+    if single:
+        return f'{{"success": true, "event": {fragments[0]}{until}}}'
+    return (f'{{"success": true, "events": [{", ".join(fragments)}], '
+            f'"count": {len(fragments)}{until}}}')
+
+
+def _events_response(events, single=False):
+    """An events answer, kept by every cache for exactly as long as it holds.
+
+    That is until its valid_until - the first event in it ends, or the feed
+    is next looked at - which the body says as well, for the page to ask
+    again then rather than on a timer. With no stale-while-revalidate: a
+    page asking at valid_until wants the new answer, not the old one while
+    the new is fetched.
+
+    Except browsers, which keep it for BROWSER_SECONDS at most like any
+    other answer: a refresh from the admin panel or a city edit changes it
+    sooner, and what they hold cannot be purged.
+    """
+    response = _assembled(events.fragments, single, events.valid_until)
+    seconds = schedule.MAX_SECONDS
+    if events.valid_until is not None:
+        left = (events.valid_until - django_timezone.now()).total_seconds()
+        seconds = max(0, min(seconds, int(left)))
+    return edge.cache_control(response, seconds, stale_seconds=0)
 
 
 class NextEventView(View):
@@ -36,19 +94,14 @@ class NextEventView(View):
             if city is None:
                 return _no_city_response(request)
 
+            schedule.wanted(city.calendar_id)
             service = GoogleCalendarService()
-            event = service.get_next_event_from_multiple_calendars([city.calendar_id])
+            events = service.get_next_events_json([city.calendar_id], 1)
 
-            if not event:
-                return JsonResponse({
-                    'error': 'No upcoming events',
-                    'message': 'No upcoming events found in calendars'
-                }, status=404)
+            if not events.fragments:
+                return JsonResponse(NO_UPCOMING_EVENTS, status=404)
 
-            return JsonResponse({
-                'success': True,
-                'event': event
-            })
+            return _events_response(events, single=True)
 
         except Exception as e:
             logger.error(f"Error in NextEventView: {str(e)}")
@@ -75,25 +128,83 @@ class NextEventsView(View):
             except ValueError:
                 limit = 3
 
+            schedule.wanted(city.calendar_id)
             service = GoogleCalendarService()
-            events = service.get_next_events_from_multiple_calendars(
-                [city.calendar_id], limit
-            )
+            events = service.get_next_events_json([city.calendar_id], limit)
 
-            if not events:
+            if not events.fragments:
+                return JsonResponse(NO_UPCOMING_EVENTS, status=404)
+
+            return _events_response(events)
+
+        except Exception as e:
+            logger.error(f"Error in NextEventsView: {str(e)}")
+            return JsonResponse({
+                'error': 'Server error',
+                'message': str(e)
+            }, status=500)
+
+
+class EverywhereView(View):
+    """API endpoint for the next N events across every active city.
+
+    Not scoped to the request's city, unlike everything else under /api/:
+    the events are the same on every host, though the links to their
+    cities are on the visitor's own domain. Kept by the caches in front
+    until the answer can change, like the other event answers; nothing
+    purges it, so no longer than that.
+    """
+
+    def get(self, request):
+        from django.conf import settings
+
+        from .middleware import base_domain_for
+        from .models import City
+
+        try:
+            try:
+                limit = int(request.GET.get('limit', 10))
+                if limit < 1 or limit > 30:
+                    limit = 10
+            except ValueError:
+                limit = 10
+
+            cities = list(City.objects.filter(is_active=True))
+            if not cities:
                 return JsonResponse({
-                    'error': 'No upcoming events',
-                    'message': 'No upcoming events found in calendars'
+                    'error': 'No active cities',
+                    'message': 'Add cities in the admin panel'
                 }, status=404)
 
-            return JsonResponse({
+            # One overview is a request for every city, a share of one each.
+            for city in cities:
+                schedule.wanted(city.calendar_id, 1 / len(cities))
+            events, valid_until = EverywhereService().get(cities, limit)
+            if not events:
+                return JsonResponse(NO_UPCOMING_EVENTS, status=404)
+
+            # Protocol-relative and on the visitor's own domain, for the same
+            # reasons CitiesView gives.
+            base = (
+                base_domain_for(request.get_host(), settings.CITY_BASE_DOMAINS)
+                or settings.CITY_BASE_DOMAINS[0]
+            )
+            defaults = {c.slug for c in cities if c.is_default}
+            for event in events:
+                slug = event['city']['slug']
+                host = base if slug in defaults else f'{slug}.{base}'
+                event['city'] = {**event['city'], 'url': f'//{host}'}
+
+            response = JsonResponse({
                 'success': True,
                 'events': events,
                 'count': len(events)
             })
+            seconds = int((valid_until - django_timezone.now()).total_seconds())
+            return edge.cache_control(response, seconds, stale_seconds=0)
 
         except Exception as e:
-            logger.error(f"Error in NextEventsView: {str(e)}")
+            logger.error(f"Error in EverywhereView: {str(e)}")
             return JsonResponse({
                 'error': 'Server error',
                 'message': str(e)
@@ -128,6 +239,11 @@ class CalendarFeedView(View):
     Google calendar id.
 
     The caching, and the promise it keeps, live in CalendarFeedService.
+
+    ``?window=<days>`` asks for the trimmed feed instead: events from that
+    many days back onwards, rather than everything the calendar ever had.
+    Opt-in, because a subscriber who already has the full feed expects the
+    history in it to stay.
     """
 
     def get(self, request):
@@ -135,7 +251,15 @@ class CalendarFeedView(View):
         if city is None:
             return HttpResponseNotFound('No city is served at this address\n')
 
-        feed, is_stale = CalendarFeedService().get(city.calendar_id)
+        schedule.wanted(city.calendar_id)
+        if 'window' in request.GET:
+            feed, is_stale = TrimmedFeedService().get(
+                city.calendar_id,
+                TrimmedFeedService.history_days(request.GET.get('window')),
+            )
+        else:
+            feed, is_stale = CalendarFeedService().get(city.calendar_id)
+        health.flush()
         if feed is None:
             # No copy at all, fresh or stale. Saying so beats answering with
             # an empty calendar, which a subscriber's app would take as "every
@@ -150,7 +274,7 @@ class CalendarFeedView(View):
         # inline, not attachment: a browser that follows this link should be
         # able to hand it straight to the calendar app.
         response['Content-Disposition'] = f'inline; filename="{city.slug}.ics"'
-        response['Cache-Control'] = f'public, max-age={CalendarFeedService.FRESH_SECONDS}'
+        response['Cache-Control'] = f'public, max-age={schedule.remaining(city.calendar_id)}'
         if is_stale:
             # Invisible to subscribers, but it turns "did the feed update?"
             # into something a single curl can answer.
@@ -158,7 +282,7 @@ class CalendarFeedView(View):
         return response
 
 
-def _feed_url(request, city):
+def _feed_url(host, city):
     """The address to hand out for subscribing to this city's calendar.
 
     Deliberately the city's own subdomain, even when the visitor is standing
@@ -180,7 +304,7 @@ def _feed_url(request, city):
     from .middleware import base_domain_for, scheme_for
 
     base = (
-        base_domain_for(request.get_host(), settings.CITY_BASE_DOMAINS)
+        base_domain_for(host, settings.CITY_BASE_DOMAINS)
         or settings.CITY_BASE_DOMAINS[0]
     )
     host = f'{city.slug}.{base}'
@@ -195,48 +319,84 @@ class CalendarInfoView(View):
         if city is None:
             return _no_city_response(request)
 
-        return JsonResponse({
-            'success': True,
-            'city': {'name': city.name, 'slug': city.slug},
-            'calendar_id': city.calendar_id,
-            'timezone': DISPLAY_TIMEZONE,
-            'google_url': _google_embed_url(city),
-            'feed_url': _feed_url(request, city),
-        })
+        return edge.cache_control(JsonResponse(calendar_body(request.get_host(), city)),
+                                  edge.CITY_SECONDS, edge.CITY_SECONDS)
+
+
+def calendar_body(host, city):
+    return {
+        'success': True,
+        'city': {'name': city.name, 'slug': city.slug},
+        'calendar_id': city.calendar_id,
+        'timezone': DISPLAY_TIMEZONE,
+        'google_url': _google_embed_url(city),
+        'feed_url': _feed_url(host, city),
+    }
 
 
 class CitiesView(View):
     """The cities we serve, for the footer and the unknown-city page."""
 
     def get(self, request):
-        from django.conf import settings
+        current = getattr(request, 'city', None)
+        # Purged by any city edit - except under a host that names no city,
+        # which nothing knows to purge.
+        seconds = edge.CITY_SECONDS if current is not None else schedule.DEFAULT_SECONDS
+        return edge.cache_control(JsonResponse(cities_body(request.get_host(), current)),
+                                  seconds, seconds)
 
-        from .middleware import base_domain_for
-        from .models import City
 
-        base = (
-            base_domain_for(request.get_host(), settings.CITY_BASE_DOMAINS)
-            or settings.CITY_BASE_DOMAINS[0]
-        )
-        current = getattr(request, 'city', None)
+def cities_body(host, current):
+    from django.conf import settings
 
-        cities = []
-        for city in City.objects.filter(is_active=True):
-            # The default city keeps the apex as its address; the rest live on
-            # their own subdomain. Links are protocol-relative on purpose:
-            # Cloudflare terminates TLS, so the origin always sees plain http
-            # and would otherwise hand out http:// links on an https page.
-            host = base if city.is_default else f'{city.slug}.{base}'
-            cities.append({
-                'name': city.name,
-                'slug': city.slug,
-                'url': f'//{host}',
-                'is_current': current is not None and city.pk == current.pk,
-            })
+    from .middleware import base_domain_for
+    from .models import City
 
-        return JsonResponse({
-            'success': True,
-            'cities': cities,
-            'count': len(cities),
-            'current': current.slug if current else None,
+    base = (
+        base_domain_for(host, settings.CITY_BASE_DOMAINS)
+        or settings.CITY_BASE_DOMAINS[0]
+    )
+
+    cities = []
+    for city in City.objects.filter(is_active=True):
+        # The default city keeps the apex as its address; the rest live on
+        # their own subdomain. Links are protocol-relative on purpose:
+        # Cloudflare terminates TLS, so the origin always sees plain http
+        # and would otherwise hand out http:// links on an https page.
+        city_host = base if city.is_default else f'{city.slug}.{base}'
+        cities.append({
+            'name': city.name,
+            'slug': city.slug,
+            'url': f'//{city_host}',
+            'is_current': current is not None and city.pk == current.pk,
         })
+
+    return {
+        'success': True,
+        'cities': cities,
+        'count': len(cities),
+        'current': current.slug if current else None,
+    }
+
+
+class ReadyView(View):
+    """Whether the worker answering has warmed up - see events/warmup.py.
+
+    503 until it has, so whatever sits in front can wait for it. Under
+    gunicorn the warm-up runs before a worker takes its first request; a
+    process started any other way - the dev server - warms up on the first
+    request here instead.
+    """
+
+    def get(self, request):
+        from .warmup import status, warm
+
+        state = status()
+        if state is None:
+            state = warm()
+
+        return JsonResponse({
+            'ready': state['ready'],
+            'ms': state.get('ms'),
+            'loaded': state['loaded'],
+        }, status=200 if state['ready'] else 503)
@@ -0,0 +1,96 @@
+"""Paying a worker's first-request costs before it takes a request.
+
+A gunicorn worker starts cold: the first request it serves imports the
+calendar stack, opens the database connection, reads the page off disk and
+unpickles a city's index - tens to hundreds of milliseconds that a visitor
+waits through, four times over after every deploy, once per worker. Worse,
+the first requests after a deploy are exactly the burst of everyone whose
+tab reloaded.
+
+warm() does that work up front. gunicorn.conf.py calls it in each worker
+after the fork and before the worker accepts a connection; /api/ready/
+reports whether it has run, so a load balancer can hold traffic back until
+it has.
+
+Nothing here may fail the worker. A missing page or an unreachable cache
+costs the first request what it always did, and is logged.
+"""
+
+import logging
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_state: Optional[Dict[str, Any]] = None
+
+
+def status() -> Optional[Dict[str, Any]]:
+    """What warm() did in this process, or None if it has not run."""
+    return _state
+
+
+def warm() -> Dict[str, Any]:
+    global _state
+    if _state is not None and _state['ready']:
+        return _state
+    _state = {'ready': False, 'loaded': {}}
+    started = time.monotonic()
+
+    for name, step in (('calendar stack', _import_calendar_stack),
+                       ('cities', _load_cities),
+                       ('pages', _read_pages),
+                       ('indexes', _load_indexes)):
+        step_started = time.monotonic()
+        try:
+            loaded = step()
+        except Exception as e:
+            logger.warning(f'Warm-up step "{name}" failed: {e}')
+            loaded = None
+        _state['loaded'][name] = {
+            'count': loaded,
+            'ms': round((time.monotonic() - step_started) * 1000, 1),
+        }
+
+    _state['ms'] = round((time.monotonic() - started) * 1000, 1)
+    _state['ready'] = True
+    logger.info(f'Worker warmed in {_state["ms"]} ms: {_state["loaded"]}')
+    return _state
+
+
+def _import_calendar_stack() -> int:
+    # Deliberately not imported by the app itself until something parses -
+    # see events/startup.py - so a worker about to serve has to ask.
+    import icalendar  # noqa: F401
+    import recurring_ical_events  # noqa: F401
+    import requests  # noqa: F401
+    return 3
+
+
+def _load_cities() -> int:
+    # Also the worker's first query, which opens its database connection.
+    from .models import City
+    City.default()
+    return len(City.objects.filter(is_active=True))
+
+
+def _read_pages() -> int:
+    from . import documents
+    read = 0
+    for name in ('index.html', 'calendar.html'):
+        if (documents.FRONTEND_DIR / name).exists():
+            documents._read(name)
+            read += 1
+    return read
+
+
+def _load_indexes() -> int:
+    """Each active city's index, off disk and into the page cache."""
+    from .models import City
+    from .services import CalendarIndexService
+
+    loaded = 0
+    for calendar_id in City.objects.filter(is_active=True).values_list('calendar_id', flat=True):
+        if CalendarIndexService().cached(calendar_id) is not None:
+            loaded += 1
+    return loaded
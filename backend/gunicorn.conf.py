@@ -0,0 +1,13 @@
+"""gunicorn settings for the prod profile.
+
+Loaded automatically from the working directory. The command line in
+docker-compose.yml still names the bind address and worker count; what lives
+here is what a command line cannot say.
+"""
+
+
+def post_worker_init(worker):
+    # After the fork and the import of the application, before the first
+    # connection: see events/warmup.py.
+    from events.warmup import warm
+    warm()
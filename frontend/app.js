@@ -15,6 +15,8 @@ function eventApp() {
         cities: [],
         refreshTimer: null,
         inFlight: false,
+        initial: null,
+        stream: null,
         // Reading `now` is what ties the countdown to the clock; see startCountdown()
         now: Date.now(),
 
@@ -22,6 +24,11 @@ function eventApp() {
         // A refresh usually fails because the network has just gone away with
         // the phone screen. It comes back in seconds, so retry in seconds.
         RETRY_MS: 20 * 1000,
+        // How long after valid_until to ask: five to ten seconds, spread so
+        // that every open page does not ask in the same instant.
+        // And an upper bound on waiting at all, for a clock that is far off.
+        SPREAD_MS: 5 * 1000,
+        MAX_WAIT_MS: 60 * 60 * 1000,
         FETCH_TIMEOUT_MS: 15 * 1000,
 
         get event() {
@@ -45,6 +52,7 @@ function eventApp() {
             // Every load schedules the next one, so there is one timer, and a
             // failed refresh can come back sooner than a successful one.
             this.loadEvent();
+            this.startStream();
 
             // A phone whose screen was locked, or a laptop back from sleep,
             // returns with a timer that has not run for a while and possibly a
@@ -56,6 +64,52 @@ function eventApp() {
             window.addEventListener('online', () => this.loadEvent({ background: true }));
         },
 
+        // Where the server can, it sends new events the moment it has them
+        // (/api/stream/), and the timer below only stands in while the
+        // stream is down. A server that cannot stream answers it with an
+        // error, the browser gives up on it, and polling is all there is.
+        startStream() {
+            if (!window.EventSource) return;
+            const stream = new EventSource('/api/stream/?limit=3');
+            stream.addEventListener('events', (message) => {
+                let answer;
+                try {
+                    answer = JSON.parse(message.data);
+                } catch (err) {
+                    return;
+                }
+                const silent = this.events.length > 0 && !this.error && !this.unknownCity;
+                this.applyAnswer(answer.status === 200, answer.body, silent);
+                this.loading = false;
+            });
+            stream.addEventListener('error', () => {
+                // CONNECTING means the browser will try again by itself;
+                // CLOSED means it will not.
+                if (stream.readyState === EventSource.CLOSED) {
+                    this.stream = null;
+                    this.scheduleRefresh(this.RETRY_MS);
+                }
+            });
+            this.stream = stream;
+        },
+
+        get streaming() {
+            return this.stream !== null && this.stream.readyState === EventSource.OPEN;
+        },
+
+        // The server says until when its answer holds: the first event ends,
+        // or it looks at the feed again. Nothing new can come before that,
+        // so that is when to ask - just after, a little apart from everyone
+        // else. An answer without it, from an older server, gets the timer.
+        refreshDelay(validUntil) {
+            const left = validUntil ? new Date(validUntil) - Date.now() : NaN;
+            if (isNaN(left)) return this.REFRESH_MS;
+            // Never straight away, even for an answer already past it - a
+            // cache's stale copy - or a stale copy is all it would get.
+            const delay = Math.max(left, 0) + this.SPREAD_MS * (1 + Math.random());
+            return Math.min(delay, this.MAX_WAIT_MS);
+        },
+
         scheduleRefresh(delay) {
             if (this.refreshTimer) clearTimeout(this.refreshTimer);
             this.refreshTimer = setTimeout(
@@ -182,7 +236,30 @@ function eventApp() {
             return translations[this.currentLang]?.[key] || key;
         },
 
+        // What the server already answered for `url` inside the page, as
+        // { status, body } - the body the API would send - or null. Each is
+        // taken once; everything after the first paint asks the API.
+        initialData(url) {
+            if (this.initial === null) {
+                const tag = document.getElementById('initial-data');
+                try {
+                    this.initial = tag ? JSON.parse(tag.textContent) : {};
+                } catch (err) {
+                    this.initial = {};
+                }
+            }
+            const entry = this.initial[url] || null;
+            delete this.initial[url];
+            return entry;
+        },
+
         async loadCities() {
+            const initial = this.initialData('/api/cities/');
+            if (initial) {
+                this.cities = initial.body.cities || [];
+                this.updateTitle();
+                return;
+            }
             try {
                 const response = await fetch('/api/cities/');
                 const data = await response.json();
@@ -203,7 +280,7 @@ function eventApp() {
             const timer = setTimeout(() => controller.abort(), this.FETCH_TIMEOUT_MS);
             try {
                 const response = await fetch(url, { signal: controller.signal });
-                return { response, data: await response.json() };
+                return { ok: response.ok, data: await response.json() };
             } finally {
                 clearTimeout(timer);
             }
@@ -211,6 +288,11 @@ function eventApp() {
 
         async loadEvent({ background = false } = {}) {
             if (this.inFlight) return;
+            if (background && this.streaming) {
+                // Keep the timer going in case the stream drops later.
+                this.scheduleRefresh(this.REFRESH_MS);
+                return;
+            }
             this.inFlight = true;
 
             // A background refresh runs behind a card someone may be reading.
@@ -229,31 +311,26 @@ function eventApp() {
                 this.unknownCity = false;
             }
 
+            // The events in the page can be older than the API's: the page
+            // may have been rendered ahead, hours ago. Ended ones go, and if
+            // that leaves none the API is asked straight away; otherwise they
+            // are shown at once and refreshed behind the visitor's back.
+            let initial = background ? null : this.initialData('/api/next-events/?limit=3');
+            if (initial && initial.status === 200) {
+                initial.body.events = (initial.body.events || [])
+                    .filter(event => new Date(event.end) > Date.now());
+                if (!initial.body.events.length) initial = null;
+            }
+
             let succeeded = false;
+            let validUntil = null;
             try {
-                const { response, data } = await this.fetchJson('/api/next-events/?limit=3');
-
-                if (data.error === 'Unknown city') {
-                    // The address names a city we do not serve. Not an error
-                    // the visitor can retry out of, so it gets its own state.
-                    if (!silent) this.unknownCity = true;
-                    succeeded = true;
-                    return;
-                }
-
-                if (!response.ok) {
-                    throw new Error(data.message || this.t('errorDefault'));
-                }
+                const { ok, data } = initial
+                    ? { ok: initial.status === 200, data: initial.body }
+                    : await this.fetchJson('/api/next-events/?limit=3');
 
-                this.events = data.events || [];
-                this.currentEventIndex = 0;
-                this.lastUpdate = new Date().toLocaleTimeString(this.currentLang + '-' + this.currentLang.toUpperCase());
-                this.error = false;
-                this.startCountdown();
-                succeeded = true;
-
-                // Re-initialize swipe handlers after DOM update
-                this.$nextTick(() => this.initSwipeHandlers());
+                succeeded = this.applyAnswer(ok, data, silent);
+                validUntil = data.valid_until || null;
             } catch (err) {
                 console.error('Error loading event:', err);
                 if (!silent) {
@@ -263,10 +340,41 @@ function eventApp() {
             } finally {
                 this.inFlight = false;
                 if (!silent) this.loading = false;
-                this.scheduleRefresh(succeeded ? this.REFRESH_MS : this.RETRY_MS);
+                this.scheduleRefresh(initial ? 0 : succeeded ? this.refreshDelay(validUntil) : this.RETRY_MS);
             }
         },
 
+        // Show an answer of /api/next-events/, fetched or streamed. False if
+        // it was an error; a silent one leaves the last good events alone.
+        applyAnswer(ok, data, silent) {
+            if (data.error === 'Unknown city') {
+                // The address names a city we do not serve. Not an error
+                // the visitor can retry out of, so it gets its own state.
+                if (!silent) this.unknownCity = true;
+                return true;
+            }
+
+            if (!ok) {
+                console.error('Error loading event:', data.message);
+                if (!silent) {
+                    this.error = true;
+                    this.errorMessage = data.message || this.t('errorDefault');
+                }
+                return false;
+            }
+
+            this.events = data.events || [];
+            this.currentEventIndex = 0;
+            this.lastUpdate = new Date().toLocaleTimeString(this.currentLang + '-' + this.currentLang.toUpperCase());
+            this.error = false;
+            this.unknownCity = false;
+            this.startCountdown();
+
+            // Re-initialize swipe handlers after DOM update
+            this.$nextTick(() => this.initSwipeHandlers());
+            return true;
+        },
+
         formatDate(dateString) {
             if (!dateString) return '';
 
@@ -10,6 +10,7 @@ function calendarPage() {
         timezone: 'Europe/Warsaw',
         googleUrl: '',
         copied: false,
+        initial: null,
         // A month grid on a phone is a wall of coloured slivers; the agenda
         // view is the same calendar, readable. Which one applies is decided
         // once and only revisited when the window crosses the threshold, so
@@ -127,6 +128,23 @@ function calendarPage() {
             return translations[this.currentLang]?.[key] || key;
         },
 
+        // What the server already answered for `url` inside the page, as
+        // { status, body } - the body the API would send - or null. Each is
+        // taken once; a retry asks the API.
+        initialData(url) {
+            if (this.initial === null) {
+                const tag = document.getElementById('initial-data');
+                try {
+                    this.initial = tag ? JSON.parse(tag.textContent) : {};
+                } catch (err) {
+                    this.initial = {};
+                }
+            }
+            const entry = this.initial[url] || null;
+            delete this.initial[url];
+            return entry;
+        },
+
         async load() {
             this.loading = true;
             this.error = false;
@@ -137,14 +155,21 @@ function calendarPage() {
             const controller = new AbortController();
             const timer = setTimeout(() => controller.abort(), this.FETCH_TIMEOUT_MS);
             try {
-                const response = await fetch('/api/calendar/', { signal: controller.signal });
-                const data = await response.json();
+                let status, data;
+                const initial = this.initialData('/api/calendar/');
+                if (initial) {
+                    ({ status, body: data } = initial);
+                } else {
+                    const response = await fetch('/api/calendar/', { signal: controller.signal });
+                    status = response.status;
+                    data = await response.json();
+                }
 
-                if (response.status === 404) {
+                if (status === 404) {
                     this.unknownCity = true;
                     return;
                 }
-                if (!response.ok || !data.success) {
+                if (status < 200 || status > 299 || !data.success) {
                     this.error = true;
                     return;
                 }
@@ -168,6 +193,11 @@ function calendarPage() {
             // Only the unknown-city card uses these, and it is the one case
             // where the request above has already failed - so this one stands
             // on its own and stays silent when it cannot deliver.
+            const initial = this.initialData('/api/cities/');
+            if (initial) {
+                this.cities = initial.body.cities || [];
+                return;
+            }
             try {
                 const response = await fetch('/api/cities/');
                 const data = await response.json();
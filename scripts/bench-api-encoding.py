@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Compare encoding an event list per request with joining stored fragments.
+
+/api/next-events/ is polled by every open page. Encoding its answer used to
+mean building a dict per event and running the whole list through
+JsonResponse's encoder on every poll:
+
+    encoded      JsonResponse({'success': True, 'events': [...], 'count': n})
+                 from the rows, as the view used to
+    assembled    the view's _assembled() over the fragments stored with the
+                 rows, as it does now
+
+Both produce the same bytes; the script checks that before timing them. The
+database read is the same either way and is left out.
+
+Run from the repository root, with the backend's requirements installed:
+
+    python3 scripts/bench-api-encoding.py [--limit 3] [--description-length 600]
+"""
+
+import argparse
+import sys
+import timeit
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+
+def setup():
+    import django
+    from django.conf import settings
+
+    settings.configure(
+        USE_TZ=True, TIME_ZONE='Europe/Warsaw', DEFAULT_CHARSET='utf-8',
+        INSTALLED_APPS=['events'], DATABASES={},
+    )
+    django.setup()
+
+
+def rows(limit: int, description_length: int):
+    from django.utils import timezone
+    from events.models import City, Occurrence
+
+    city = City(name='Warszawa', calendar_id='w@example.com')
+    now = timezone.now()
+    result = []
+    for n in range(limit):
+        row = Occurrence(
+            city=city, uid=f'social-{n}@google.com', feed_version='bench',
+            start=now + timedelta(days=n), end=now + timedelta(days=n, hours=3),
+            title=f'Social w Łodzi #{n}', location='Sala "Pod Arkadami", ul. Długa 5',
+            description=('Wstęp wolny, zapraszamy! ' * description_length)[:description_length],
+        )
+        row.encoded = Occurrence.encode(row.as_event(city.calendar_id))
+        result.append(row)
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--limit', type=int, default=3)
+    parser.add_argument('--description-length', type=int, default=600)
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    setup()
+    from django.http import JsonResponse
+    from events.views import _assembled
+
+    stored = rows(args.limit, args.description_length)
+
+    def encoded():
+        events = [row.as_event('w@example.com') for row in stored]
+        return JsonResponse({'success': True, 'events': events, 'count': len(events)})
+
+    def assembled():
+        return _assembled([row.as_json('w@example.com') for row in stored])
+
+    if encoded().content != assembled().content:
+        print('The two responses differ', file=sys.stderr)
+        return 1
+
+    print(f'{args.limit} events, {len(assembled().content):,} B response')
+    for name, run in (('encoded', encoded), ('assembled', assembled)):
+        seconds = min(timeit.repeat(run, number=args.number, repeat=5)) / args.number
+        print(f'{name:<12}{seconds * 1e6:>10,.1f} µs per response')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Compare the packed occurrence index with pickle, on size and load time.
+
+The cached index is read back on every request that finds its city due for a
+check, and by every worker as it warms up. What matters is how many bytes
+come off disk and how long it takes before the next event can be read:
+
+    pickle   pickle.loads() of a FeedIndex, then its next three events
+    packed   PackedIndex() over the same bytes, then its next three events
+
+and, for completeness, decoding every occurrence of the packed index - what
+patching it after a feed change costs.
+
+The calendar is synthetic: weekly socials, a workshop a fortnight and a pile
+of one-off events, expanded for a year like a busy city's real feed.
+
+Run from the repository root, with the backend's requirements installed:
+
+    python3 scripts/bench-index-format.py [--series 40] [--one-offs 300]
+"""
+
+import argparse
+import pickle
+import sys
+import timeit
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+
+def build(series: int, one_offs: int):
+    import django
+    from django.conf import settings
+
+    settings.configure(USE_TZ=True, TIME_ZONE='Europe/Warsaw')
+    django.setup()
+
+    from django.utils import timezone
+    from events.indexing import build_index, feed_version
+
+    now = timezone.localtime()
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//bench//EN',
+             'X-WR-TIMEZONE:Europe/Warsaw']
+    for n in range(series):
+        start = (now - timedelta(days=n % 7)).strftime('%Y%m%dT190000')
+        end = (now - timedelta(days=n % 7)).strftime('%Y%m%dT220000')
+        lines += ['BEGIN:VEVENT', f'UID:series-{n}', 'DTSTAMP:20260101T000000Z',
+                  f'DTSTART;TZID=Europe/Warsaw:{start}',
+                  f'DTEND;TZID=Europe/Warsaw:{end}',
+                  f'RRULE:FREQ=WEEKLY;INTERVAL={1 + n % 2}',
+                  f'SUMMARY:Social {n}', 'LOCATION:Sala na Mokotowie, Warszawa',
+                  'DESCRIPTION:' + 'Wstęp wolny. ' * 20, 'END:VEVENT']
+    for n in range(one_offs):
+        day = now + timedelta(days=n % 365)
+        lines += ['BEGIN:VEVENT', f'UID:one-off-{n}', 'DTSTAMP:20260101T000000Z',
+                  f'DTSTART;TZID=Europe/Warsaw:{day:%Y%m%dT120000}',
+                  f'DTEND;TZID=Europe/Warsaw:{day:%Y%m%dT160000}',
+                  f'SUMMARY:Warsztaty {n}', 'END:VEVENT']
+    lines.append('END:VCALENDAR')
+    feed = ('\r\n'.join(lines) + '\r\n').encode()
+    return build_index('bench@example.com', feed, feed_version(feed), now), now
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--series', type=int, default=40)
+    parser.add_argument('--one-offs', type=int, default=300)
+    parser.add_argument('--number', type=int, default=200)
+    args = parser.parse_args()
+
+    index, now = build(args.series, args.one_offs)
+
+    from itertools import islice
+    from events.packing import PackedIndex, pack_index
+
+    pickled = pickle.dumps(index, pickle.HIGHEST_PROTOCOL)
+    packed = pack_index(index)
+
+    def next_three(loaded):
+        return list(islice(loaded.upcoming(now), 3))
+
+    timings = {
+        'pickle: load + next 3': lambda: next_three(pickle.loads(pickled)),
+        'packed: load + next 3': lambda: next_three(PackedIndex(packed)),
+        'packed: decode all': lambda: PackedIndex(packed).occurrences,
+    }
+
+    print(f'{len(index.occurrences)} occurrences in {len(index.series)} series')
+    print(f'{"pickle size":<24}{len(pickled):>12,} B')
+    print(f'{"packed size":<24}{len(packed):>12,} B  '
+          f'({len(packed) / len(pickled):.0%} of pickle)')
+    for name, run in timings.items():
+        seconds = min(timeit.repeat(run, number=args.number, repeat=5)) / args.number
+        print(f'{name:<24}{seconds * 1e6:>12,.1f} µs')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -17,18 +17,46 @@ give it exactly the mismatch this script exists to prevent.
 
 Run from the repository root, after any step that edits a page:
 
-    python3 scripts/stamp-assets.py
+    python3 scripts/stamp-assets.py [--force]
 
 Re-running is safe: an existing ?v= is replaced, not appended to.
+
+Each asset is also compressed once, here, rather than by nginx on every
+request: app.js.gz beside app.js for gzip_static, and app.js.br for
+brotli_static if the brotli package is installed (pip install brotli). A
+compressed copy carries its original's mtime, which is how the next run
+knows the asset has not changed since and leaves the copy as it is.
+--force compresses everything again regardless.
+
+The stamped tags in the pages are the one record of which version is
+current: the backend reads its preload links off them too
+(events/documents.py).
+
+The pages nginx actually serves are copies rendered per city
+(backend/events/prerender.py), so a stamp reaches visitors only once they
+are rendered again - and the Link headers naming the stamped assets only
+once nginx reloads. If the prod backend is running, this asks it to render
+and nginx to reload; if not, it says so - the container renders them when
+it starts.
 """
 
+import argparse
+import gzip
 import hashlib
+import os
 import re
+import shutil
+import subprocess
 import sys
 from pathlib import Path
 
 ASSETS = ('styles.css', 'app.js', 'translations.js', 'calendar.js')
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 
 def content_hash(path: Path) -> str:
     return hashlib.sha256(path.read_bytes()).hexdigest()[:8]
@@ -50,18 +78,53 @@ def stamp_page(page: Path, versions: dict[str, str]) -> list[str]:
         if count:
             stamped.append(f'{page.name}: {asset} -> {version} ({count}x)')
 
-    page.write_text(html, encoding='utf-8')
+    # Untouched when nothing changed: the backend renders the pages again
+    # when a file's mtime moves.
+    if html != page.read_text(encoding='utf-8'):
+        page.write_text(html, encoding='utf-8')
     return stamped
 
 
-def stamp(frontend: Path) -> list[str]:
+def compress(asset: Path, force: bool) -> dict[str, int]:
+    """Write ``asset``'s .gz and .br siblings. The sizes of those written.
+
+    A sibling with the asset's own mtime was written from this very file
+    and is left alone.
+    """
+    data = asset.read_bytes()
+    compressors = {'gzip': ('.gz', lambda b: gzip.compress(b, compresslevel=9, mtime=0))}
+    if brotli is not None:
+        compressors['br'] = ('.br', lambda b: brotli.compress(b, quality=11))
+
+    stat = asset.stat()
+    sizes = {}
+    for encoding, (suffix, squeeze) in compressors.items():
+        sibling = asset.with_name(asset.name + suffix)
+        if not force and sibling.exists() and sibling.stat().st_mtime_ns == stat.st_mtime_ns:
+            continue
+        sibling.write_bytes(squeeze(data))
+        # nginx answers with the sibling's Last-Modified and ETag; the same
+        # as the original's keeps them from changing with the encoding.
+        os.utime(sibling, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        sizes[encoding] = sibling.stat().st_size
+    return sizes
+
+
+def stamp(frontend: Path, force: bool = False) -> list[str]:
     versions = {}
+    compressed = []
     for asset in ASSETS:
         asset_path = frontend / asset
         if not asset_path.exists():
             print(f'skipping {asset}: not found', file=sys.stderr)
             continue
         versions[asset] = content_hash(asset_path)
+        sizes = compress(asset_path, force)
+        if sizes:
+            compressed.append(f'{asset}: compressed ' + ', '.join(
+                f'{encoding} {size} B' for encoding, size in sizes.items()))
+    if brotli is None:
+        print('note: brotli not installed; only .gz written', file=sys.stderr)
 
     stamped = []
     for page in sorted(frontend.glob('*.html')):
@@ -69,18 +132,46 @@ def stamp(frontend: Path) -> list[str]:
         if not lines:
             print(f'warning: {page.name} references no known asset', file=sys.stderr)
         stamped.extend(lines)
-    return stamped
+    return compressed + stamped
 
 
 def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--force', action='store_true',
+                        help='compress every asset again, changed or not')
+    args = parser.parse_args()
+
     frontend = Path(__file__).resolve().parent.parent / 'frontend'
     if not (frontend / 'index.html').exists():
         print(f'error: {frontend}/index.html not found', file=sys.stderr)
         return 1
 
-    for line in stamp(frontend):
+    for line in stamp(frontend, args.force):
         print(line)
-    return 0
+    return render_pages(frontend.parent)
+
+
+def render_pages(repository: Path) -> int:
+    compose = ['docker', 'compose', '--profile', 'prod']
+    if shutil.which('docker') is None:
+        print('note: no docker here; run `manage.py render_pages` where the backend runs',
+              file=sys.stderr)
+        return 0
+    running = subprocess.run(compose + ['ps', '-q', 'backend-prod'], cwd=repository,
+                             capture_output=True, text=True)
+    if running.returncode != 0 or not running.stdout.strip():
+        print('note: backend-prod is not running; it renders the pages when it starts',
+              file=sys.stderr)
+        return 0
+    rendered = subprocess.run(compose + ['exec', '-T', 'backend-prod',
+                                         'python', 'manage.py', 'render_pages'],
+                              cwd=repository)
+    if rendered.returncode != 0:
+        return rendered.returncode
+    # The pages' Link headers come from links.conf, which nginx reads only
+    # when it loads its configuration.
+    return subprocess.run(compose + ['exec', '-T', 'frontend-prod', 'nginx', '-s', 'reload'],
+                          cwd=repository).returncode
 
 
 if __name__ == '__main__':